@@ -0,0 +1,295 @@
+#admission
+"""
+Admission control for upstream OpenAI calls.
+
+Every call needs a permit from both a global limit and a per-API-key limit.
+The limits adapt AIMD-style: they grow by about one per round trip while
+calls succeed within ADMISSION_LATENCY_TARGET, are cut in half when OpenAI
+answers 429 and shrink gently when latency goes over target. The latency
+compared with the target is the time OpenAI took to start answering: the
+time to response headers for a streamed call, and for a complete answer its
+total time less ADMISSION_SECONDS_PER_TOKEN per completion token, so long
+answers are not mistaken for an overloaded upstream. Latency alone never cuts
+a limit below ADMISSION_LATENCY_FLOOR of its maximum, so one slow route
+cannot starve the others; only 429s take it lower. Requests that
+cannot get a permit wait in a bounded queue; a request is shed right away
+with Overloaded (a 503 with Retry-After) when the queue is full or its
+expected wait would pass its deadline, so latency stays bounded instead of
+piling up behind the rate limit.
+
+Retryable upstream failures (429, connection errors, 5xx) are retried with
+exponential backoff and jitter, honoring OpenAI's retry-after header, within
+ADMISSION_MAX_RETRIES and ADMISSION_RETRY_BUDGET seconds. The OpenAI
+clients are created with their own retries off (see openai_pool.py) so every
+attempt goes through the limiter.
+
+Configure with ADMISSION=on|off, ADMISSION_GLOBAL_LIMIT, ADMISSION_KEY_LIMIT,
+ADMISSION_QUEUE_SIZE, ADMISSION_MAX_WAIT, ADMISSION_LATENCY_TARGET,
+ADMISSION_SECONDS_PER_TOKEN, ADMISSION_LATENCY_FLOOR, ADMISSION_MAX_RETRIES
+and ADMISSION_RETRY_BUDGET.
+"""
+import os
+import math
+import time
+import random
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import openai
+
+from metrics import ADMISSION_TOTAL, ADMISSION_WAIT_SECONDS, UPSTREAM_RETRIES
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+# Per-key limiters kept for recently seen keys only
+MAX_TRACKED_KEYS = 1024
+
+
+class Overloaded(Exception):
+    """No upstream capacity for this request within its deadline."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdaptiveLimit:
+    """A concurrency limit adjusted by additive increase / multiplicative decrease."""
+
+    def __init__(self, max_limit, min_limit=1, latency_target=10.0, latency_floor=0.25):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.latency_target = latency_target
+        # Latency cuts stop here; only rate limiting goes down to min_limit
+        self.latency_min_limit = max(min_limit, max_limit * latency_floor)
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self._last_decrease = 0.0
+
+    def has_capacity(self):
+        return self.in_flight < int(self.limit)
+
+    def on_success(self, latency):
+        if latency > self.latency_target:
+            if self.limit > self.latency_min_limit:
+                self._decrease(0.9, self.latency_min_limit)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    def on_rate_limited(self):
+        self._decrease(0.5, self.min_limit)
+
+    def _decrease(self, factor, floor):
+        # One cut per second, so a burst of 429s from the same overload only halves once
+        now = time.monotonic()
+        if now - self._last_decrease < 1.0:
+            return
+        self._last_decrease = now
+        self.limit = max(floor, self.limit * factor)
+
+
+class Permit:
+    """Held while an upstream call (including a streamed answer) is in progress."""
+
+    def __init__(self, controller, key, max_retries, retry_budget):
+        self.controller = controller
+        self.key = key
+        self.max_retries = max_retries
+        self.deadline = time.monotonic() + retry_budget
+        self.acquired_at = time.monotonic()
+        self._released = False
+
+    def call(self, fn):
+        """Run fn() (one OpenAI request), retrying retryable failures with backoff."""
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                result = fn()
+            except RETRYABLE_ERRORS as e:
+                rate_limited = isinstance(e, openai.RateLimitError)
+                self.controller.record(self.key, rate_limited=rate_limited)
+                delay = retry_after_from(e)
+                if delay is None:
+                    delay = min(8.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+                if attempt >= self.max_retries or time.monotonic() + delay > self.deadline:
+                    raise
+                attempt += 1
+                UPSTREAM_RETRIES.inc(reason=type(e).__name__)
+                logger.warning(f"Retrying OpenAI call in {delay:.1f}s after {type(e).__name__} (attempt {attempt})")
+                time.sleep(delay)
+                continue
+            self.controller.record(self.key, latency=self.controller.response_latency(
+                result, time.monotonic() - started))
+            return result
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller.release(self.key, time.monotonic() - self.acquired_at)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def retry_after_from(error):
+    """Seconds to wait from OpenAI's retry-after headers, if it sent any."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+class AdmissionController:
+    """Global and per-key adaptive limits with a bounded, deadline-aware wait queue."""
+
+    def __init__(self, global_limit=64, key_limit=16, queue_size=100, max_wait=10.0,
+                 latency_target=10.0, seconds_per_token=0.05, latency_floor=0.25,
+                 max_retries=2, retry_budget=20.0, enabled=True):
+        self.enabled = enabled
+        self.key_limit = key_limit
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.latency_target = latency_target
+        self.seconds_per_token = seconds_per_token
+        self.latency_floor = latency_floor
+        self.max_retries = max_retries
+        self.retry_budget = retry_budget
+        self.global_limit = AdaptiveLimit(global_limit, latency_target=latency_target, latency_floor=latency_floor)
+        self._key_limits = OrderedDict()
+        self.waiting = 0
+        # Moving average of how long a permit is held, to estimate queue wait
+        self.hold_seconds = 1.0
+        self._condition = threading.Condition()
+
+    def _key_limit(self, key):
+        limit = self._key_limits.get(key)
+        if limit is None:
+            limit = self._key_limits[key] = AdaptiveLimit(self.key_limit, latency_target=self.latency_target,
+                                                          latency_floor=self.latency_floor)
+            # Forget idle keys beyond the newest MAX_TRACKED_KEYS
+            while len(self._key_limits) > MAX_TRACKED_KEYS:
+                oldest_key, oldest = next(iter(self._key_limits.items()))
+                if oldest.in_flight:
+                    break
+                del self._key_limits[oldest_key]
+        self._key_limits.move_to_end(key)
+        return limit
+
+    def _expected_wait(self, position):
+        return position * self.hold_seconds / max(1.0, self.global_limit.limit)
+
+    def acquire(self, api_key, route=None):
+        """Return a Permit for api_key, waiting up to ADMISSION_MAX_WAIT; raise Overloaded otherwise."""
+        key = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+        if not self.enabled:
+            return Permit(self, None, self.max_retries, self.retry_budget)
+
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        with self._condition:
+            key_limit = self._key_limit(key)
+            if not (self.global_limit.has_capacity() and key_limit.has_capacity()):
+                expected = self._expected_wait(self.waiting + 1)
+                if self.waiting >= self.queue_size or expected > self.max_wait:
+                    ADMISSION_TOTAL.inc(route=route, outcome='shed')
+                    raise Overloaded("Too many requests are waiting for the AI service", _seconds(expected))
+                self.waiting += 1
+                try:
+                    while not (self.global_limit.has_capacity() and key_limit.has_capacity()):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            ADMISSION_TOTAL.inc(route=route, outcome='timeout')
+                            raise Overloaded("Timed out waiting for the AI service",
+                                             _seconds(self._expected_wait(self.waiting)))
+                        self._condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.global_limit.in_flight += 1
+            key_limit.in_flight += 1
+
+        waited = time.monotonic() - started
+        ADMISSION_WAIT_SECONDS.observe(waited, route=route)
+        ADMISSION_TOTAL.inc(route=route, outcome='admitted' if waited < 0.001 else 'queued')
+        return Permit(self, key, self.max_retries, self.retry_budget)
+
+    def response_latency(self, result, seconds):
+        """
+        How long an attempt that returned result in seconds took to start
+        answering. A stream returns at its response headers; a complete answer
+        is credited seconds_per_token for each token it generated.
+        """
+        usage = getattr(result, "usage", None)
+        completion_tokens = getattr(usage, "completion_tokens", None) or 0
+        return max(0.0, seconds - completion_tokens * self.seconds_per_token)
+
+    def record(self, key, latency=None, rate_limited=False):
+        """Feed the outcome of one upstream attempt into the global and per-key limits."""
+        if key is None:
+            return
+        with self._condition:
+            limits = [self.global_limit, self._key_limit(key)]
+            for limit in limits:
+                if rate_limited:
+                    limit.on_rate_limited()
+                elif latency is not None:
+                    limit.on_success(latency)
+            self._condition.notify_all()
+
+    def release(self, key, held):
+        if key is None:
+            return
+        with self._condition:
+            self.global_limit.in_flight -= 1
+            self._key_limit(key).in_flight -= 1
+            self.hold_seconds = 0.9 * self.hold_seconds + 0.1 * held
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {
+                "enabled": self.enabled,
+                "global_limit": round(self.global_limit.limit, 2),
+                "in_flight": self.global_limit.in_flight,
+                "waiting": self.waiting,
+                "tracked_keys": len(self._key_limits),
+                "average_hold_seconds": round(self.hold_seconds, 3),
+            }
+
+
+def _seconds(value):
+    return max(1, int(math.ceil(value)))
+
+
+def admission_from_env():
+    """Build the AdmissionController configured by the ADMISSION_* environment variables."""
+    return AdmissionController(
+        global_limit=int(os.getenv('ADMISSION_GLOBAL_LIMIT', '64')),
+        key_limit=int(os.getenv('ADMISSION_KEY_LIMIT', '16')),
+        queue_size=int(os.getenv('ADMISSION_QUEUE_SIZE', '100')),
+        max_wait=float(os.getenv('ADMISSION_MAX_WAIT', '10')),
+        latency_target=float(os.getenv('ADMISSION_LATENCY_TARGET', '10')),
+        seconds_per_token=float(os.getenv('ADMISSION_SECONDS_PER_TOKEN', '0.05')),
+        latency_floor=float(os.getenv('ADMISSION_LATENCY_FLOOR', '0.25')),
+        max_retries=int(os.getenv('ADMISSION_MAX_RETRIES', '2')),
+        retry_budget=float(os.getenv('ADMISSION_RETRY_BUDGET', '20')),
+        enabled=os.getenv('ADMISSION', 'on').lower() != 'off',
+    )
+
+
+ADMISSION = admission_from_env()
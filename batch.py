@@ -0,0 +1,245 @@
+#batch
+"""
+Bulk requests for caseworkers triaging many households at once.
+
+POST /batch takes a JSON body (or a multipart form with the JSON in a
+"payload" field and the PDFs as files) with up to BATCH_MAX_ITEMS items:
+
+    {"openai_key": "sk-...",
+     "items": [
+        {"id": "smith", "tool": "resource_finder", "user_message": "..."},
+        {"id": "lee", "tool": "rejection_simulation", "user_message": "...",
+         "documents": [{"filename": "letter.pdf", "content_base64": "..."},
+                       {"file": "<multipart field name>"}]},
+        {"id": "diaz", "tool": "toxicity_assessment", "user_message": "...",
+         "messages": [{"role": "assistant", "content": "..."}, ...]}
+    ]}
+
+By default the items run concurrently, at most BATCH_CONCURRENCY at a time
+per batch, and each result is streamed back as one NDJSON line as soon as
+it finishes, followed by a summary line. With "mode": "openai_batch" the
+completions are instead submitted to the OpenAI Batch API, at about half
+the price, and GET /batch/<batch_id> returns the NDJSON results once
+OpenAI has finished them (within 24 hours).
+
+The route is exempt from CSRF so scripts can call it, so it never falls back
+to the server's OpenAI key: the caller's key is required, in "openai_key" or
+an Authorization: Bearer header (which GET /batch/<batch_id> also needs).
+Documents sent as base64 go through the same checks as uploaded files
+(extension, PDF magic bytes, size and page count; see uploads.py).
+"""
+import os
+import io
+import json
+import time
+import base64
+import binascii
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from uploads import UploadGuard
+
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '50'))
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '4'))
+
+TOOLS = ('resource_finder', 'rejection_simulation', 'toxicity_assessment', 'recovery_capital')
+MAX_DOCUMENTS = 5
+# base64 documents are validated in chunks of this size, like a streamed upload
+VALIDATE_CHUNK_BYTES = 64 * 1024
+
+
+class BatchError(Exception):
+    """A problem with the batch request whose message is safe to show to the caller."""
+
+
+def parse_items(payload, files=None, guard=None):
+    """
+    Validate the items of a batch payload. Returns a list of items, each with
+    "index", "id", "tool", "user_message", "messages" and "documents" as a
+    list of (filename, bytes). Raises BatchError for invalid input, and
+    UploadRejected from guard (the request's UploadGuard) for a base64
+    document that would have been rejected as an upload.
+    """
+    if guard is None:
+        guard = UploadGuard('batch', max_files=BATCH_MAX_ITEMS * MAX_DOCUMENTS)
+    items = payload.get("items") if isinstance(payload, dict) else None
+    if not isinstance(items, list) or not items:
+        raise BatchError("Send a JSON object with a non-empty \"items\" list.")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise BatchError(f"A batch can have at most {BATCH_MAX_ITEMS} items.")
+
+    parsed = []
+    seen_ids = set()
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise BatchError(f"Item {index} must be an object.")
+        item_id = str(item.get("id", index))
+        if item_id in seen_ids:
+            raise BatchError(f"Item id {item_id} is used more than once.")
+        seen_ids.add(item_id)
+
+        tool = item.get("tool")
+        if tool not in TOOLS:
+            raise BatchError(f"Item {item_id}: tool must be one of {', '.join(TOOLS)}.")
+        user_message = str(item.get("user_message", "")).strip()
+        if not user_message:
+            raise BatchError(f"Item {item_id}: user_message is required.")
+
+        messages = item.get("messages") or []
+        if not isinstance(messages, list) or not all(
+                isinstance(m, dict) and m.get("role") in ("user", "assistant") and isinstance(m.get("content"), str)
+                for m in messages):
+            raise BatchError(f"Item {item_id}: messages must be a list of user and assistant messages.")
+
+        documents = _parse_documents(item_id, item.get("documents") or [], files or {}, guard) \
+            if tool == 'rejection_simulation' else []
+
+        parsed.append({
+            "index": index,
+            "id": item_id,
+            "tool": tool,
+            "user_message": user_message,
+            "messages": messages,
+            "documents": documents,
+        })
+    return parsed
+
+
+def _parse_documents(item_id, documents, files, guard):
+    if not isinstance(documents, list) or len(documents) > MAX_DOCUMENTS:
+        raise BatchError(f"Item {item_id}: documents must be a list of at most {MAX_DOCUMENTS} PDFs.")
+    parsed = []
+    for document in documents:
+        if not isinstance(document, dict):
+            raise BatchError(f"Item {item_id}: each document must be an object.")
+        if not all(isinstance(document.get(field) or "", str) for field in ("file", "filename", "content_base64")):
+            raise BatchError(f"Item {item_id}: document file, filename and content_base64 must be strings.")
+        base64_document = "file" not in document
+        if not base64_document:
+            # Checked by the guard while the multipart body streamed in
+            upload = files.get(document["file"])
+            if upload is None:
+                raise BatchError(f"Item {item_id}: no uploaded file named {document['file']}.")
+            filename = document.get("filename") or upload.filename or document["file"]
+            stream = upload.stream
+            stream.seek(0)
+            data = stream.getvalue() if isinstance(stream, io.BytesIO) else stream.read()
+        else:
+            filename = document.get("filename") or ""
+            try:
+                data = base64.b64decode(document.get("content_base64") or "", validate=True)
+            except (binascii.Error, ValueError):
+                raise BatchError(f"Item {item_id}: {filename or 'a document'} is not valid base64.")
+        if not filename.lower().endswith('.pdf'):
+            raise BatchError(f"Item {item_id}: invalid file type: {filename}. Only PDF files are allowed.")
+        if base64_document:
+            _validate_pdf(guard, filename, data)
+        parsed.append((filename, data))
+    return parsed
+
+
+def _validate_pdf(guard, filename, data):
+    """Run decoded document bytes through the checks a multipart upload gets as it streams in."""
+    stream = guard.open(filename)
+    for start in range(0, len(data), VALIDATE_CHUNK_BYTES):
+        stream.write(data[start:start + VALIDATE_CHUNK_BYTES])
+    # Rejects a file too short to hold the PDF header, as for uploads
+    stream.seek(0)
+
+
+def run_concurrently(items, run_item, concurrency=BATCH_CONCURRENCY):
+    """
+    Run run_item(item) for every item on a pool of concurrency threads and
+    yield one result dict per item as it finishes, then a summary dict.
+    run_item returns a dict of result fields or raises; the exception's
+    message is reported in the item's result.
+    """
+    started = time.perf_counter()
+    errors = 0
+    executor = ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(items))), thread_name_prefix='batch')
+    try:
+        futures = {executor.submit(_timed, run_item, item): item for item in items}
+        for future in as_completed(futures):
+            item = futures[future]
+            result = {"index": item["index"], "id": item["id"], "tool": item["tool"]}
+            result.update(future.result())
+            if result["status"] == "error":
+                errors += 1
+            yield result
+    finally:
+        # Stop queued items if the client went away
+        executor.shutdown(wait=False, cancel_futures=True)
+    yield {"done": True, "items": len(items), "errors": errors,
+           "seconds": round(time.perf_counter() - started, 3)}
+
+
+def _timed(run_item, item):
+    started = time.perf_counter()
+    try:
+        result = {"status": "ok", **run_item(item)}
+    except Exception as e:
+        logger.error(f"Batch item {item['id']} ({item['tool']}) failed: {str(e)}")
+        result = {"status": "error", "error": str(e)}
+        retry_after = getattr(e, "retry_after", None)
+        if retry_after is not None:
+            result["retry_after"] = retry_after
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def to_ndjson(results):
+    """Encode result dicts as newline-delimited JSON, one line per result."""
+    for result in results:
+        yield json.dumps(result) + "\n"
+
+
+def submit_openai_batch(client, requests, metadata=None):
+    """
+    Submit (custom_id, completion_args) pairs as one OpenAI Batch API job.
+    Returns the batch object.
+    """
+    lines = [
+        json.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body})
+        for custom_id, body in requests
+    ]
+    input_file = client.files.create(
+        file=("batch.jsonl", ("\n".join(lines) + "\n").encode("utf-8")),
+        purpose="batch",
+    )
+    return client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+        metadata=metadata,
+    )
+
+
+def openai_batch_results(client, batch_id):
+    """
+    Return (batch, results) for an OpenAI batch; results is a list of result
+    dicts keyed by custom_id once the batch has completed, otherwise None.
+    """
+    batch = client.batches.retrieve(batch_id)
+    if batch.status != "completed":
+        return batch, None
+    results = []
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in client.files.content(file_id).text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            body = response.get("body") or {}
+            if response.get("status_code") == 200 and body.get("choices"):
+                results.append({"id": record["custom_id"], "status": "ok",
+                                "answer": body["choices"][0]["message"]["content"],
+                                "model": body.get("model"), "usage": body.get("usage")})
+            else:
+                error = record.get("error") or body.get("error") or {}
+                results.append({"id": record["custom_id"], "status": "error",
+                                "error": error.get("message", "The request failed")})
+    return batch, results
@@ -0,0 +1,118 @@
+#bench_logging
+"""
+Measure the CPU that request logging costs on /rejection-simulation.
+
+    python benchmarks/bench_logging.py --requests 50 --pdf-pages 40
+
+Each logging mode runs in its own process against the fake OpenAI server and
+posts the same large PDFs; extracted text is cached after the first request
+so the numbers are dominated by prompt building and logging. Reports process
+CPU time per request (request thread plus the log listener thread) and the
+bytes written to the log.
+"""
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_openai  # noqa: E402
+from bench_openai_pool import ROOT, percentile  # noqa: E402
+from sample_pdfs import make_sample_pdf  # noqa: E402
+
+MODES = {
+    # What DEBUG logging did before: every payload in full, written on the request thread
+    "debug-sync-full": {"LOG_LEVEL": "DEBUG", "LOG_ASYNC": "0",
+                        "LOG_PAYLOAD_SAMPLE_RATE": "1", "LOG_PAYLOAD_MAX_CHARS": "100000000"},
+    "debug-async-sampled": {"LOG_LEVEL": "DEBUG", "LOG_ASYNC": "1"},
+    "info-async": {"LOG_LEVEL": "INFO", "LOG_ASYNC": "1"},
+}
+
+
+def run_child(args):
+    """Post args.requests rejection simulations in-process and print CPU seconds per request."""
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    import main
+
+    main.app.config['WTF_CSRF_ENABLED'] = False
+    client = main.app.test_client()
+    pdfs = [make_sample_pdf(args.pdf_pages, label=f"Letter {i}") for i in range(args.pdfs)]
+
+    def post():
+        data = {
+            "user_message": "Renter in Altadena applying for FEMA rental assistance",
+            "documents": [(io.BytesIO(pdf), f"letter{i}.pdf") for i, pdf in enumerate(pdfs)],
+        }
+        response = client.post("/rejection-simulation", data=data, content_type="multipart/form-data")
+        assert response.status_code == 200, response.get_data(as_text=True)
+
+    post()  # warm up: imports, extraction pool, PDF text cache
+    cpu = []
+    for _ in range(args.requests):
+        started = time.process_time()
+        post()
+        cpu.append(time.process_time() - started)
+    # Let the listener drain so its CPU is counted too
+    started = time.process_time()
+    import logging_setup
+    logging_setup._flush_listener()
+    drain = time.process_time() - started
+    print(json.dumps({"cpu": cpu, "drain": drain}))
+
+
+def main(args):
+    upstream = fake_openai.start_in_thread(latency=0, tokens_per_second=0, answer_tokens=200)
+    results = []
+    for mode, mode_env in MODES.items():
+        env = dict(
+            os.environ,
+            OPENAI_API_KEY="sk-bench",
+            OPENAI_BASE_URL=f"http://127.0.0.1:{upstream.server_address[1]}/v1",
+            COMPLETION_CACHE="off",
+            PDF_TEXT_CACHE="memory",
+            METRICS="off",
+            **mode_env,
+        )
+        with tempfile.TemporaryFile() as log_file:
+            output = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__), "--child",
+                 "--requests", str(args.requests), "--pdfs", str(args.pdfs), "--pdf-pages", str(args.pdf_pages)],
+                env=env, stderr=log_file
+            )
+            log_bytes = log_file.tell()
+        child = json.loads(output.decode().strip().splitlines()[-1])
+        cpu = child["cpu"]
+        results.append({
+            "mode": mode,
+            "requests": len(cpu),
+            "cpu_ms_per_request": round((sum(cpu) + child["drain"]) / len(cpu) * 1000, 2),
+            "cpu_p50_ms": round(percentile(cpu, 50) * 1000, 2),
+            "cpu_p99_ms": round(percentile(cpu, 99) * 1000, 2),
+            "log_bytes_per_request": log_bytes // (len(cpu) + 1),
+        })
+    upstream.shutdown()
+
+    baseline = results[0]["cpu_ms_per_request"]
+    for result in results:
+        result["cpu_saved_ms_per_request"] = round(baseline - result["cpu_ms_per_request"], 2)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--pdfs", type=int, default=3)
+    parser.add_argument("--pdf-pages", type=int, default=40)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+    else:
+        print(json.dumps(main(args), indent=2))
@@ -0,0 +1,178 @@
+#bench_openai_pool
+"""
+Benchmark OpenAI client reuse and the gunicorn worker class against a local
+fake OpenAI server.
+
+    python benchmarks/bench_openai_pool.py client --requests 400 --concurrency 50
+    python benchmarks/bench_openai_pool.py serve --requests 400 --concurrency 200
+
+"client" compares a new OpenAI client per call (the old behaviour in main.py)
+with the pooled client from openai_pool. "serve" runs main:app under gunicorn
+with sync and gevent workers and drives /resource-finder through it.
+"""
+import os
+import re
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+import http.cookiejar
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_openai  # noqa: E402
+
+CSRF_RE = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(name, latencies, errors, elapsed):
+    return {
+        "name": name,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+    }
+
+
+def run_load(name, call, requests, concurrency):
+    """Run call() requests times on concurrency threads and summarize latencies."""
+    latencies = []
+    errors = 0
+
+    def timed(_):
+        start = time.perf_counter()
+        call()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(timed, i) for i in range(requests)]
+        for future in futures:
+            try:
+                latencies.append(future.result())
+            except Exception:
+                errors += 1
+    return summarize(name, latencies, errors, time.perf_counter() - start)
+
+
+def bench_client(args):
+    from openai import OpenAI
+    from openai_pool import ClientPool
+
+    server = fake_openai.start_in_thread(latency=args.latency, tokens_per_second=0, answer_tokens=20)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    messages = [{"role": "user", "content": "where is the nearest shelter"}]
+
+    def per_request():
+        client = OpenAI(api_key="sk-bench", base_url=base_url)
+        client.chat.completions.create(model="gpt-4o", messages=messages)
+        client.close()
+
+    pool = ClientPool(factory=lambda **kw: OpenAI(base_url=base_url, **kw))
+
+    def pooled():
+        pool.get("sk-bench").chat.completions.create(model="gpt-4o", messages=messages)
+
+    results = [
+        run_load("client-per-request", per_request, args.requests, args.concurrency),
+        run_load("pooled-client", pooled, args.requests, args.concurrency),
+    ]
+    server.shutdown()
+    return results
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+
+def csrf_token(page, cookie_jar):
+    """The CSRF token from the page's form or, on cached pages, from the csrf_token cookie."""
+    match = CSRF_RE.search(page)
+    if match:
+        return match.group(1)
+    return next(cookie.value for cookie in cookie_jar if cookie.name == "csrf_token")
+
+
+def resource_finder_call(base_url):
+    """One /resource-finder round trip with its own session and CSRF token."""
+    cookie_jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(cookie_jar))
+    page = opener.open(f"{base_url}/resource-finder").read().decode("utf-8")
+    token = csrf_token(page, cookie_jar)
+    data = urllib.parse.urlencode({"csrf_token": token, "user_message": "where is the nearest shelter"}).encode()
+    response = opener.open(f"{base_url}/resource-finder", data=data)
+    json.loads(response.read())
+
+
+def bench_serve(args):
+    upstream = fake_openai.start_in_thread(latency=args.latency, tokens_per_second=0, answer_tokens=20)
+    results = []
+    for worker_class in ("sync", "gevent"):
+        port = free_port()
+        env = dict(
+            os.environ,
+            PORT=str(port),
+            GUNICORN_WORKER_CLASS=worker_class,
+            WEB_CONCURRENCY="1",
+            OPENAI_API_KEY="sk-bench",
+            OPENAI_BASE_URL=f"http://127.0.0.1:{upstream.server_address[1]}/v1",
+            COMPLETION_CACHE="off",
+        )
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--log-level", "warning", "main:app"],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            wait_for_port(port)
+            base_url = f"http://127.0.0.1:{port}"
+            results.append(run_load(f"gunicorn-{worker_class}-1-worker",
+                                    lambda: resource_finder_call(base_url),
+                                    args.requests, args.concurrency))
+        finally:
+            proc.terminate()
+            proc.wait()
+    upstream.shutdown()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["client", "serve"])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.2, help="fake upstream latency in seconds")
+    args = parser.parse_args()
+
+    results = bench_client(args) if args.mode == "client" else bench_serve(args)
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,384 @@
+#bench_routes
+"""
+Load test every page of the app under gunicorn against the local fake OpenAI
+server and save the results as JSON, so runs on different commits can be
+compared.
+
+    python benchmarks/bench_routes.py --requests 200 --concurrency 20 --output results.json
+    python benchmarks/bench_routes.py --stream --compare results.json
+
+Each virtual user keeps its own cookie session and CSRF token. The chat tools
+are driven as multi-turn conversations, and rejection simulation uploads
+generated sample PDFs. Reports throughput, p50/p95/p99 latency, time to first
+token when streaming, and the resident memory of every gunicorn worker.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import platform
+import threading
+import subprocess
+import http.cookiejar
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_openai  # noqa: E402
+from bench_openai_pool import ROOT, csrf_token, percentile, free_port, wait_for_port  # noqa: E402
+from sample_pdfs import make_sample_pdf  # noqa: E402
+
+ROUTES = ["index", "resource_finder", "rejection_simulation", "toxicity_assessment", "recovery_capital"]
+
+QUESTIONS = [
+    "Where can I find emergency shelter in Pasadena?",
+    "My home in Altadena burned down, what grants can I apply for?",
+    "Who helps with debris removal after the Eaton fire?",
+    "Are there mental health services for wildfire survivors?",
+]
+
+
+class Session:
+    """One virtual user: a cookie jar, a CSRF token and open conversations."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.cookie_jar = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookie_jar))
+        self.csrf_token = None
+        self.conversations = {}
+        self.turns = {}
+
+    def get(self, path):
+        with self.opener.open(f"{self.base_url}{path}") as response:
+            return response.read().decode("utf-8")
+
+    def token(self):
+        if self.csrf_token is None:
+            self.csrf_token = csrf_token(self.get("/resource-finder"), self.cookie_jar)
+        return self.csrf_token
+
+    def post(self, path, fields, files=(), stream=False):
+        """POST a form and return (seconds, seconds to first token or None, JSON or done event)."""
+        fields = dict(fields, csrf_token=self.token())
+        if stream:
+            fields["stream"] = "1"
+        if files:
+            boundary = uuid.uuid4().hex
+            parts = []
+            for name, value in fields.items():
+                parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode("utf-8"))
+            for name, filename, data in files:
+                parts.append(
+                    f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                    'Content-Type: application/pdf\r\n\r\n'.encode("utf-8") + data + b"\r\n")
+            parts.append(f"--{boundary}--\r\n".encode("utf-8"))
+            body = b"".join(parts)
+            content_type = f"multipart/form-data; boundary={boundary}"
+        else:
+            body = urllib.parse.urlencode(fields).encode("utf-8")
+            content_type = "application/x-www-form-urlencoded"
+
+        request = urllib.request.Request(f"{self.base_url}{path}", data=body,
+                                         headers={"Content-Type": content_type})
+        start = time.perf_counter()
+        first_token = None
+        with self.opener.open(request) as response:
+            if not stream:
+                payload = json.loads(response.read())
+            else:
+                event, payload = "message", None
+                for raw in response:
+                    line = raw.decode("utf-8").rstrip("\r\n")
+                    if line.startswith("event: "):
+                        event = line[7:]
+                    elif line.startswith("data: "):
+                        if first_token is None:
+                            first_token = time.perf_counter() - start
+                        if event in ("done", "error"):
+                            payload = json.loads(line[6:])
+                            if event == "error":
+                                raise RuntimeError(payload.get("error"))
+                    elif not line:
+                        event = "message"
+        return time.perf_counter() - start, first_token, payload
+
+    def converse(self, route, path, stream, turns):
+        """Send the next turn of this user's conversation, starting over after turns turns."""
+        if self.turns.get(route, 0) >= turns:
+            self.conversations.pop(route, None)
+            self.turns[route] = 0
+        fields = {"user_message": QUESTIONS[self.turns.get(route, 0) % len(QUESTIONS)],
+                  "conversation_id": self.conversations.get(route, "")}
+        result = self.post(path, fields, stream=stream)
+        payload = result[2] or {}
+        self.conversations[route] = payload.get("conversation_id", "")
+        self.turns[route] = self.turns.get(route, 0) + 1
+        return result
+
+
+def make_calls(args):
+    """Map each route name to a call(session) that times one request."""
+    pdfs = [(f"letter{i}.pdf", make_sample_pdf(args.pdf_pages, label=f"Letter {i}")) for i in range(args.pdfs)]
+
+    def index(session):
+        start = time.perf_counter()
+        session.get("/")
+        return time.perf_counter() - start, None, None
+
+    def resource_finder(session):
+        return session.post("/resource-finder", {"user_message": QUESTIONS[0]}, stream=args.stream)
+
+    def rejection_simulation(session):
+        return session.post("/rejection-simulation",
+                            {"user_message": "Renter in Altadena applying for FEMA rental assistance"},
+                            files=[("pdf_files", name, data) for name, data in pdfs], stream=args.stream)
+
+    def toxicity_assessment(session):
+        return session.converse("toxicity_assessment", "/toxicity-assessment", args.stream, args.turns)
+
+    def recovery_capital(session):
+        return session.converse("recovery_capital", "/recovery-capital", args.stream, args.turns)
+
+    return {
+        "index": index,
+        "resource_finder": resource_finder,
+        "rejection_simulation": rejection_simulation,
+        "toxicity_assessment": toxicity_assessment,
+        "recovery_capital": recovery_capital,
+    }
+
+
+def worker_pids(master_pid):
+    """PIDs of the gunicorn workers forked by master_pid (Linux /proc)."""
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # Field 4 is the parent PID; the command name in field 2 may contain spaces
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == master_pid:
+            pids.append(int(entry))
+    return pids
+
+
+def rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return None
+
+
+class MemorySampler(threading.Thread):
+    """Samples the RSS of every gunicorn worker while a route is under load."""
+
+    def __init__(self, master_pid, interval=0.25):
+        super().__init__(daemon=True)
+        self.master_pid = master_pid
+        self.interval = interval
+        self.peak = {}
+        self.last = {}
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self.sample()
+            self._stopped.wait(self.interval)
+
+    def sample(self):
+        for pid in worker_pids(self.master_pid):
+            rss = rss_mb(pid)
+            if rss is not None:
+                self.last[pid] = rss
+                self.peak[pid] = max(rss, self.peak.get(pid, 0.0))
+
+    def stop(self):
+        self._stopped.set()
+        if self.ident is not None:
+            self.join()
+        self.sample()
+        return {
+            "workers": len(self.last),
+            "rss_mb_per_worker": [round(self.last[pid], 1) for pid in sorted(self.last)],
+            "peak_rss_mb_per_worker": [round(self.peak[pid], 1) for pid in sorted(self.peak)],
+        }
+
+
+def run_route(name, call, base_url, master_pid, args):
+    """Drive one route with args.concurrency virtual users for args.requests requests."""
+    local = threading.local()
+    latencies = []
+    first_tokens = []
+    errors = {}
+    lock = threading.Lock()
+
+    def one(_):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = Session(base_url)
+            session.token()
+        try:
+            seconds, first_token, _ = call(session)
+        except Exception as e:
+            # urllib.error.HTTPError carries the status code, other errors their type
+            kind = str(e.code) if isinstance(e, urllib.error.HTTPError) else type(e).__name__
+            with lock:
+                errors[kind] = errors.get(kind, 0) + 1
+            return
+        with lock:
+            latencies.append(seconds)
+            if first_token is not None:
+                first_tokens.append(first_token)
+
+    sampler = MemorySampler(master_pid)
+    sampler.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one, range(args.requests)))
+    elapsed = time.perf_counter() - start
+    memory = sampler.stop()
+
+    result = {
+        "route": name,
+        "requests": args.requests,
+        "errors": sum(errors.values()),
+        "error_kinds": errors,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "memory": memory,
+    }
+    if first_tokens:
+        result["ttft_p50_ms"] = round(percentile(first_tokens, 50) * 1000, 1)
+        result["ttft_p95_ms"] = round(percentile(first_tokens, 95) * 1000, 1)
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    """Print throughput and p95 changes against an earlier results file."""
+    with open(baseline_path) as f:
+        baseline = {r["route"]: r for r in json.load(f)["routes"]}
+    print(f"{'route':<24}{'rps':>10}{'Δrps':>9}{'p95 ms':>10}{'Δp95':>9}")
+    for result in results["routes"]:
+        before = baseline.get(result["route"])
+        if before is None:
+            continue
+
+        def change(key):
+            return (result[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+
+        print(f"{result['route']:<24}{result['throughput_rps']:>10.1f}{change('throughput_rps'):>+8.1f}%"
+              f"{result['p95_ms']:>10.1f}{change('p95_ms'):>+8.1f}%")
+
+
+def main(args):
+    upstream = fake_openai.start_in_thread(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                                           answer_tokens=args.answer_tokens)
+    port = free_port()
+    state_dir = os.path.join(ROOT, "benchmarks", f".bench-{port}")
+    os.makedirs(state_dir, exist_ok=True)
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        GUNICORN_WORKER_CLASS=args.worker_class,
+        WEB_CONCURRENCY=str(args.workers),
+        GUNICORN_THREADS=str(args.threads),
+        OPENAI_API_KEY="sk-bench",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{upstream.server_address[1]}/v1",
+        COMPLETION_CACHE=args.cache,
+        COMPLETION_CACHE_PATH=os.path.join(state_dir, "completion_cache.sqlite3"),
+        PDF_TEXT_CACHE="memory" if args.pdf_cache else "off",
+        # Conversations must be visible to every worker
+        CONVERSATION_STORE="sqlite",
+        CONVERSATION_STORE_PATH=os.path.join(state_dir, "conversations.sqlite3"),
+    )
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--log-level", "warning", "main:app"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL
+    )
+    calls = make_calls(args)
+    results = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "routes": [],
+    }
+    try:
+        wait_for_port(port)
+        base_url = f"http://127.0.0.1:{port}"
+        # Warm up every worker (prompt loading, catalog index) before measuring
+        for _ in range(args.workers * 2):
+            Session(base_url).token()
+        idle = MemorySampler(proc.pid)
+        idle.sample()
+        results["idle_memory"] = idle.stop()
+        for name in args.routes:
+            result = run_route(name, calls[name], base_url, proc.pid, args)
+            results["routes"].append(result)
+            print(f"{name:<24}{result['throughput_rps']:>8.1f} rps  p50 {result['p50_ms']:>7.1f} ms  "
+                  f"p95 {result['p95_ms']:>7.1f} ms  p99 {result['p99_ms']:>7.1f} ms  "
+                  f"errors {result['errors']}", file=sys.stderr)
+    finally:
+        proc.terminate()
+        proc.wait()
+        upstream.shutdown()
+        for name in os.listdir(state_dir):
+            os.remove(os.path.join(state_dir, name))
+        os.rmdir(state_dir)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--routes", nargs="+", choices=ROUTES, default=ROUTES)
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=20, help="concurrent virtual users")
+    parser.add_argument("--stream", action="store_true", help="request Server-Sent Events answers")
+    parser.add_argument("--turns", type=int, default=4, help="turns per chat conversation before starting over")
+    parser.add_argument("--pdfs", type=int, default=2, help="PDFs per rejection-simulation request")
+    parser.add_argument("--pdf-pages", type=int, default=5)
+    parser.add_argument("--pdf-cache", action="store_true", help="enable the extracted PDF text cache")
+    parser.add_argument("--cache", choices=["off", "memory", "sqlite"], default="off", help="completion cache")
+    parser.add_argument("--worker-class", default="gevent")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.5, help="fake upstream seconds to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--answer-tokens", type=int, default=50)
+    parser.add_argument("--output", help="write results JSON to this file")
+    parser.add_argument("--compare", help="results JSON from an earlier run to compare against")
+    parser.add_argument("--verbose", action="store_true", help="show gunicorn's stderr")
+    args = parser.parse_args()
+
+    results = main(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    if args.compare:
+        compare(results, args.compare)
@@ -0,0 +1,275 @@
+#fake_openai
+"""
+Local stand-in for the OpenAI chat completions API, for benchmarks.
+
+Serves POST /v1/chat/completions with a configurable time-to-first-token,
+token rate and answer length, both as a plain JSON response and as an SSE
+stream. Point the app at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.
+With --max-concurrent, requests beyond that many in flight get a 429 with
+retry-after, like an upstream rate limit, and requests for a model listed in
+--failing-models get a 503, like an overloaded model. Chat completion
+requests are counted per model in the handler's "requests" dict.
+
+It also stubs the Files and Batches endpoints used for OpenAI Batch API
+runs: an uploaded JSONL batch is answered at once (no latency) and its
+output file can be downloaded as soon as the batch is retrieved.
+
+    python benchmarks/fake_openai.py --port 8900 --latency 0.5 --tokens-per-second 50
+"""
+import sys
+import json
+import time
+import uuid
+import email.parser
+import email.policy
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    # Set by make_server
+    latency = 0.5
+    tokens_per_second = 50.0
+    answer_tokens = 50
+    max_concurrent = 0  # 0 means unlimited
+    failing_models = frozenset()
+    requests = {}  # model -> chat completion requests received
+    in_flight = 0
+    in_flight_lock = threading.Lock()
+    files = {}    # Batch API stub: file id -> (filename, bytes)
+    batches = {}  # batch id -> batch object
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path.startswith("/v1/batches/") and path[len("/v1/batches/"):] in self.batches:
+            self._send_json(200, self.batches[path[len("/v1/batches/"):]])
+        elif path.startswith("/v1/files/") and path.endswith("/content"):
+            stored = self.files.get(path[len("/v1/files/"):-len("/content")])
+            if stored is None:
+                self._send_json(404, {"error": {"message": "No such file"}})
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(stored[1])))
+            self.end_headers()
+            self.wfile.write(stored[1])
+        else:
+            self._send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if self.path.endswith("/files"):
+            self._create_file(body)
+            return
+        request = json.loads(body or b"{}")
+        if self.path.endswith("/batches"):
+            self._create_batch(request)
+            return
+        if not self.path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+
+        handler = type(self)
+        model = request.get("model", "gpt-4o")
+        with handler.in_flight_lock:
+            handler.requests[model] = handler.requests.get(model, 0) + 1
+        if model in handler.failing_models:
+            self._send_json(503, {"error": {"message": f"{model} is overloaded", "type": "server_error"}},
+                            {"retry-after-ms": "10"})
+            return
+        with handler.in_flight_lock:
+            limited = 0 < self.max_concurrent <= handler.in_flight
+            if not limited:
+                handler.in_flight += 1
+        if limited:
+            self._send_json(429, {"error": {"message": "Rate limit reached", "type": "requests",
+                                            "code": "rate_limit_exceeded"}},
+                            {"retry-after-ms": "500"})
+            return
+        try:
+            self._complete(request)
+        finally:
+            with handler.in_flight_lock:
+                handler.in_flight -= 1
+
+    def _create_file(self, body):
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode("utf-8") + body)
+        upload = next((part for part in message.iter_parts()
+                       if part.get_param("name", header="content-disposition") == "file"), None)
+        if upload is None:
+            self._send_json(400, {"error": {"message": "Missing file"}})
+            return
+        file_id = f"file-{uuid.uuid4().hex}"
+        content = upload.get_payload(decode=True)
+        self.files[file_id] = (upload.get_filename() or "upload.jsonl", content)
+        self._send_json(200, {"id": file_id, "object": "file", "bytes": len(content),
+                              "created_at": int(time.time()), "filename": self.files[file_id][0],
+                              "purpose": "batch", "status": "processed"})
+
+    def _create_batch(self, request):
+        stored = self.files.get(request.get("input_file_id"))
+        if stored is None:
+            self._send_json(400, {"error": {"message": "Unknown input_file_id"}})
+            return
+        lines = []
+        for line in stored[1].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            lines.append(json.dumps({"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": item["custom_id"],
+                                     "response": {"status_code": 200, "body": self._completion(item["body"])},
+                                     "error": None}))
+        output_id = f"file-{uuid.uuid4().hex}"
+        self.files[output_id] = ("output.jsonl", ("\n".join(lines) + "\n").encode("utf-8"))
+        now = int(time.time())
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex}",
+            "object": "batch",
+            "endpoint": request.get("endpoint"),
+            "input_file_id": request["input_file_id"],
+            "completion_window": request.get("completion_window", "24h"),
+            "status": "completed",
+            "output_file_id": output_id,
+            "created_at": now,
+            "completed_at": now,
+            "request_counts": {"total": len(lines), "completed": len(lines), "failed": 0},
+            "metadata": request.get("metadata"),
+        }
+        self.batches[batch["id"]] = batch
+        self._send_json(200, batch)
+
+    def _completion(self, request):
+        """A complete (non-streamed) chat completion object for request."""
+        prompt_chars = sum(len(m.get("content", "")) for m in request.get("messages", []))
+        answer = "".join(f"token{i} " for i in range(self.answer_tokens))
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "gpt-4o"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": answer},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_chars // 4,
+                "completion_tokens": self.answer_tokens,
+                "total_tokens": prompt_chars // 4 + self.answer_tokens,
+            },
+        }
+
+    def _complete(self, request):
+        model = request.get("model", "gpt-4o")
+        tokens = [f"token{i} " for i in range(self.answer_tokens)]
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        token_delay = 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+        time.sleep(self.latency)
+
+        if not request.get("stream"):
+            time.sleep(token_delay * len(tokens))
+            self._send_json(200, self._completion(request))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, token in enumerate(tokens):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "delta": {"role": "assistant", "content": token} if i == 0 else {"content": token},
+                    "finish_reason": None,
+                }],
+            }
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            time.sleep(token_delay)
+        final = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }
+        self._write_chunk(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # Pooled keep-alive connections are reset when the app's workers exit
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def make_server(port=0, latency=0.5, tokens_per_second=50.0, answer_tokens=50, max_concurrent=0, failing_models=()):
+    """Create a fake OpenAI server on 127.0.0.1; port 0 picks a free port."""
+    handler = type("ConfiguredFakeOpenAIHandler", (FakeOpenAIHandler,), {
+        "latency": latency,
+        "tokens_per_second": tokens_per_second,
+        "answer_tokens": answer_tokens,
+        "max_concurrent": max_concurrent,
+        "failing_models": frozenset(failing_models),
+        "requests": {},
+        "in_flight": 0,
+        "in_flight_lock": threading.Lock(),
+        "files": {},
+        "batches": {},
+    })
+    return FakeOpenAIServer(("127.0.0.1", port), handler)
+
+
+def start_in_thread(**kwargs):
+    """Start a fake server on a background thread and return it."""
+    server = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake OpenAI chat completions server")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--answer-tokens", type=int, default=50)
+    parser.add_argument("--max-concurrent", type=int, default=0, help="answer 429 above this many requests")
+    parser.add_argument("--failing-models", default="", help="comma-separated models to answer 503 for")
+    args = parser.parse_args()
+
+    failing_models = [m.strip() for m in args.failing_models.split(",") if m.strip()]
+    server = make_server(args.port, args.latency, args.tokens_per_second, args.answer_tokens, args.max_concurrent,
+                         failing_models)
+    print(f"Fake OpenAI listening on http://127.0.0.1:{server.server_address[1]}/v1")
+    server.serve_forever()
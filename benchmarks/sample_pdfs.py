@@ -0,0 +1,44 @@
+#sample_pdfs
+"""
+Generate small text PDFs for the rejection-simulation benchmark, so the
+suite does not need real FEMA letters or insurance policies checked in.
+"""
+
+PARAGRAPH = (
+    "Your claim for additional living expenses following the wildfire has been reviewed. "
+    "Coverage under Section II of the homeowners policy requires documentation of the "
+    "primary residence, proof of loss within sixty days and receipts for temporary housing. "
+    "FEMA Individual Assistance may not duplicate benefits paid by your insurer. "
+)
+
+
+def make_sample_pdf(pages=3, label="Claim determination"):
+    """Return the bytes of a PDF with pages pages of extractable Helvetica text."""
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [{}] /Count {} >>".format(
+            " ".join(f"{4 + 2 * i} 0 R" for i in range(pages)), pages),
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for page in range(pages):
+        text = f"{label} - page {page + 1} of {pages}. " + PARAGRAPH * 6
+        lines = [text[i:i + 90] for i in range(0, len(text), 90)]
+        content = "BT /F1 10 Tf 40 760 Td 12 TL " + " ".join(f"({line}) '" for line in lines) + " ET"
+        objects.append(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * page} 0 R >>"
+        )
+        objects.append(f"<< /Length {len(content)} >>\nstream\n{content}\nendstream")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref_offset = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("ascii")
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode("ascii")
+    out += (f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n"
+            f"startxref\n{xref_offset}\n%%EOF\n").encode("ascii")
+    return bytes(out)
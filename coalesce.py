@@ -0,0 +1,295 @@
+#coalesce
+"""
+Single-flight coalescing of identical in-flight chat completions.
+
+When many people ask the same question at once, only the first request (the
+leader) calls OpenAI; concurrent requests with the same cache key (normalized
+messages, model and temperature) and the same API key follow the leader's
+call and get the same tokens, streamed or as a complete answer. Requests
+made with different API keys never share a call, so nobody's completion is
+billed to someone else's key or fails with someone else's auth or quota error.
+
+Within a worker process, followers share one in-memory Flight. With
+COALESCE=shared the leader also publishes its progress to a SQLite file, so
+the first worker to ask for a key does the upstream call and the other
+workers on the host poll its text instead of asking again. The leader
+refreshes its flight every COALESCE_STALE_SECONDS / 3 while the call is open,
+tokens or not, so a slow first token is not mistaken for a dead leader; a
+flight not refreshed for COALESCE_STALE_SECONDS is taken over.
+
+Configure with COALESCE=local|shared|off, COALESCE_ROUTES (comma-separated)
+and COALESCE_PATH (SQLite file for shared mode).
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+from metrics import COALESCED_TOTAL
+
+logger = logging.getLogger(__name__)
+
+COALESCE_STALE_SECONDS = float(os.getenv('COALESCE_STALE_SECONDS', '30'))
+COALESCE_POLL_SECONDS = 0.1
+PUBLISH_INTERVAL = 0.2
+
+
+class Flight:
+    """One upstream completion and its tokens, shared by every request that joined it."""
+
+    def __init__(self):
+        self.tokens = []
+        self.model = None  # the model that answered, once the leader knows; None for another worker's flight
+        self.done = False
+        self.error = None
+        self.on_add = None  # called after each token, e.g. to publish progress
+        self._condition = threading.Condition()
+
+    @property
+    def answer(self):
+        return "".join(self.tokens)
+
+    def add(self, token):
+        with self._condition:
+            self.tokens.append(token)
+            self._condition.notify_all()
+        if self.on_add:
+            self.on_add()
+
+    def finish(self, error=None):
+        with self._condition:
+            self.error = error
+            self.done = True
+            self._condition.notify_all()
+
+    def wait_started(self):
+        """Block until the first token arrives or the flight ends; raise its error if it failed first."""
+        with self._condition:
+            self._condition.wait_for(lambda: self.tokens or self.done)
+            if self.error is not None and not self.tokens:
+                raise self.error
+
+    def follow(self):
+        """Yield tokens as they arrive, from the first one; raise the flight's error at the end."""
+        index = 0
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: len(self.tokens) > index or self.done)
+                new_tokens = self.tokens[index:]
+                done, error = self.done, self.error
+            for token in new_tokens:
+                yield token
+            index += len(new_tokens)
+            if done and index >= len(self.tokens):
+                if error is not None:
+                    raise error
+                return
+
+    def wait(self):
+        """Block until the flight ends and return the full answer."""
+        with self._condition:
+            self._condition.wait_for(lambda: self.done)
+        if self.error is not None:
+            raise self.error
+        return self.answer
+
+
+class SharedFlights:
+    """In-flight completions published in a SQLite file shared by the workers on a host."""
+
+    def __init__(self, path, stale_seconds=COALESCE_STALE_SECONDS):
+        self.path = path
+        self.stale_seconds = stale_seconds
+        self._local = threading.local()
+        self._pid = os.getpid()
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS flights ("
+            "key TEXT PRIMARY KEY, owner INTEGER NOT NULL, text TEXT NOT NULL, "
+            "done INTEGER NOT NULL, error TEXT, updated REAL NOT NULL)"
+        )
+
+    def _connect(self):
+        if self._pid != os.getpid():
+            # Never reuse a connection opened before fork (a preloaded app)
+            self._local = threading.local()
+            self._pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def acquire(self, key):
+        """True if this process now leads key; False if another worker's flight is live."""
+        conn = self._connect()
+        now = time.time()
+        # Finished flights only need to outlive their followers' last poll
+        conn.execute(
+            "DELETE FROM flights WHERE updated < ? OR (done = 1 AND updated < ?)",
+            (now - self.stale_seconds, now - 5 * COALESCE_POLL_SECONDS)
+        )
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO flights (key, owner, text, done, error, updated) VALUES (?, ?, '', 0, NULL, ?)",
+            (key, os.getpid(), now)
+        )
+        return cursor.rowcount == 1
+
+    def publish(self, key, text, done=False, error=None):
+        self._connect().execute(
+            "UPDATE flights SET text = ?, done = ?, error = ?, updated = ? WHERE key = ? AND owner = ?",
+            (text, int(done), error, time.time(), key, os.getpid())
+        )
+
+    def touch(self, key):
+        """Mark this process's unfinished flight for key as alive."""
+        self._connect().execute(
+            "UPDATE flights SET updated = ? WHERE key = ? AND owner = ? AND done = 0",
+            (time.time(), key, os.getpid())
+        )
+
+    def read(self, key):
+        """Return (text, done, error, updated) for key, or None."""
+        return self._connect().execute(
+            "SELECT text, done, error, updated FROM flights WHERE key = ?", (key,)
+        ).fetchone()
+
+
+class SingleFlight:
+    """Joins concurrent requests for the same key onto one producer call."""
+
+    def __init__(self, routes, shared=None):
+        self.routes = set(routes)
+        self.shared = shared
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def enabled_for(self, route):
+        return route in self.routes
+
+    def join(self, route, key, api_key, produce):
+        """
+        Return (flight, leader) for key and api_key. The first caller starts
+        produce(flight) on a background thread; produce calls flight.add() for
+        every token. Later callers with the same key and API key get the same
+        flight until it ends.
+        """
+        # Hashed so the key is never written to the shared file
+        key = f"{hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:16]}:{key}"
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+        COALESCED_TOTAL.inc(route=route, role='leader' if leader else 'follower')
+        if leader:
+            threading.Thread(target=self._run, args=(route, key, flight, produce), daemon=True).start()
+        return flight, leader
+
+    def _run(self, route, key, flight, produce):
+        try:
+            if self.shared is None:
+                produce(flight)
+            else:
+                self._run_shared(route, key, flight, produce)
+            flight.finish()
+        except Exception as e:
+            flight.finish(e)
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+
+    def _run_shared(self, route, key, flight, produce):
+        try:
+            leader = self.shared.acquire(key)
+        except sqlite3.Error as e:
+            logger.error(f"Shared coalescing unavailable: {str(e)}")
+            produce(flight)
+            return
+        if not leader:
+            COALESCED_TOTAL.inc(route=route, role='shared_follower')
+            if self._follow_shared(key, flight):
+                return
+            # The other worker's flight went stale or vanished; take over
+            if not self.shared.acquire(key):
+                logger.warning(f"Could not take over stale flight {key[:12]}, calling upstream")
+        self._produce_and_publish(key, flight, produce)
+
+    def _produce_and_publish(self, key, flight, produce):
+        published_at = time.monotonic()
+
+        def publish_progress():
+            nonlocal published_at
+            if time.monotonic() - published_at >= PUBLISH_INTERVAL:
+                published_at = time.monotonic()
+                self._publish(key, flight.answer)
+
+        flight.on_add = publish_progress
+        stopped = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(key, stopped), daemon=True).start()
+        try:
+            produce(flight)
+        except Exception as e:
+            self._publish(key, flight.answer, done=True, error=str(e))
+            raise
+        finally:
+            stopped.set()
+            flight.on_add = None
+        self._publish(key, flight.answer, done=True)
+
+    def _heartbeat(self, key, stopped):
+        # Followers only see updates; keep the flight fresh before the first token and between tokens
+        while not stopped.wait(self.shared.stale_seconds / 3):
+            try:
+                self.shared.touch(key)
+            except sqlite3.Error as e:
+                logger.error(f"Shared coalescing heartbeat error: {str(e)}")
+
+    def _publish(self, key, text, done=False, error=None):
+        try:
+            self.shared.publish(key, text, done, error)
+        except sqlite3.Error as e:
+            logger.error(f"Shared coalescing publish error: {str(e)}")
+
+    def _follow_shared(self, key, flight):
+        """
+        Copy another worker's flight into flight. Returns False if that flight
+        vanished or went stale before any text arrived, so this worker can take over.
+        """
+        seen = 0
+        while True:
+            row = self.shared.read(key)
+            if row is None:
+                if seen:
+                    raise RuntimeError("The shared completion ended unexpectedly")
+                return False
+            text, done, error, updated = row
+            if len(text) > seen:
+                flight.add(text[seen:])
+                seen = len(text)
+            if done:
+                if error:
+                    raise RuntimeError(error)
+                return True
+            if time.time() - updated > self.shared.stale_seconds:
+                if seen:
+                    raise RuntimeError("The shared completion stalled")
+                return False
+            time.sleep(COALESCE_POLL_SECONDS)
+
+
+def coalescer_from_env():
+    """Build the SingleFlight configured by the COALESCE_* environment variables."""
+    kind = os.getenv('COALESCE', 'local').lower()
+    routes = [r.strip() for r in os.getenv(
+        'COALESCE_ROUTES', 'resource_finder,toxicity_assessment,recovery_capital'
+    ).split(',') if r.strip()]
+    if kind == 'off':
+        routes = []
+    shared = None
+    if kind == 'shared':
+        shared = SharedFlights(os.getenv('COALESCE_PATH', './coalesce.sqlite3'))
+    return SingleFlight(routes, shared)
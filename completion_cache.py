@@ -0,0 +1,270 @@
+#completion_cache
+"""
+Cache of chat completion answers, keyed on the system prompt hash, the
+normalized user messages, the model and the temperature.
+
+Two backends are available:
+- MemoryCache: in-process LRU with TTL (per worker)
+- SQLiteCache: a SQLite file shared by every worker on the host
+
+Configure with COMPLETION_CACHE=memory|sqlite|off, COMPLETION_CACHE_TTL
+(seconds), COMPLETION_CACHE_SIZE (entries), COMPLETION_CACHE_PATH (SQLite file)
+and COMPLETION_CACHE_ROUTES (comma-separated route names that may be cached).
+"""
+import os
+import re
+import time
+import json
+import sqlite3
+import hashlib
+import threading
+import logging
+from collections import OrderedDict, defaultdict
+
+logger = logging.getLogger(__name__)
+
+WHITESPACE_RE = re.compile(r"\s+")
+
+# Seconds between sweeps of expired SQLite rows, which are otherwise only
+# deleted when read back
+SWEEP_SECONDS = 60
+
+
+def normalize_message(text):
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    return WHITESPACE_RE.sub(" ", text).strip().lower().rstrip("?!. ")
+
+
+def make_cache_key(messages, model, temperature):
+    """
+    Build the cache key for a chat completion request. The system prompt is
+    hashed as-is; user and assistant messages are normalized first.
+    """
+    key_parts = [model, repr(temperature)]
+    for message in messages:
+        content = message.get("content", "")
+        if message.get("role") == "system":
+            content = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        else:
+            content = normalize_message(content)
+        key_parts.append(f"{message.get('role')}:{content}")
+    return hashlib.sha256("\x1f".join(key_parts).encode("utf-8")).hexdigest()
+
+
+class MemoryCache:
+    """Thread-safe in-process LRU cache with a per-entry TTL."""
+
+    def __init__(self, max_entries=1024, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._set(key, value)
+
+    def _set(self, key, value):
+        self._entries[key] = (time.time() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def replace(self, key, expected, value):
+        """Set key to value only if it still holds expected (None: absent); returns whether it did."""
+        with self._lock:
+            item = self._entries.get(key)
+            current = item[1] if item is not None and item[0] >= time.time() else None
+            if current != expected:
+                return False
+            self._set(key, value)
+            return True
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache:
+    """
+    LRU cache with TTL stored in a SQLite file, so every gunicorn worker on
+    the host shares the same hits. Expired rows are swept on writes at most
+    every SWEEP_SECONDS, so nothing outlives its TTL by much on disk.
+    """
+
+    def __init__(self, path, max_entries=10000, ttl=3600, table="completion_cache"):
+        self.path = path
+        self.table = table
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        self._pid = os.getpid()
+        self._next_sweep = 0.0
+        with self._connect() as conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "expires REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_accessed "
+                f"ON {table} (accessed)"
+            )
+            conn.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_expires "
+                f"ON {table} (expires)"
+            )
+        self._sweep(self._connect(), time.time())
+
+    def _connect(self):
+        if self._pid != os.getpid():
+            # Never reuse a connection opened before fork (a preloaded app)
+            self._local = threading.local()
+            self._pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute(
+            f"SELECT value, expires FROM {self.table} WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires = row
+        if expires < now:
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            return None
+        conn.execute(f"UPDATE {self.table} SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(value)
+
+    def set(self, key, value):
+        self._set(self._connect(), key, value)
+
+    def _set(self, conn, key, value):
+        now = time.time()
+        conn.execute(
+            f"INSERT OR REPLACE INTO {self.table} (key, value, expires, accessed) "
+            "VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value), now + self.ttl, now)
+        )
+        conn.execute(
+            f"DELETE FROM {self.table} WHERE key IN ("
+            f"SELECT key FROM {self.table} ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+        if now >= self._next_sweep:
+            self._sweep(conn, now)
+
+    def _sweep(self, conn, now):
+        """Delete every expired row, including ones nobody will read again."""
+        self._next_sweep = now + SWEEP_SECONDS
+        conn.execute(f"DELETE FROM {self.table} WHERE expires < ?", (now,))
+
+    def replace(self, key, expected, value):
+        """Set key to value only if it still holds expected (None: absent); returns whether it did."""
+        conn = self._connect()
+        # IMMEDIATE takes the write lock before reading, so no other worker can write in between
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                f"SELECT value, expires FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            current = json.loads(row[0]) if row is not None and row[1] >= time.time() else None
+            if current != expected:
+                conn.execute("ROLLBACK")
+                return False
+            self._set(conn, key, value)
+            conn.execute("COMMIT")
+            return True
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def __len__(self):
+        return self._connect().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+
+class CompletionCache:
+    """
+    Front for a cache backend that applies the per-route opt-out and keeps
+    hit/miss counters per route.
+    """
+
+    def __init__(self, backend, routes):
+        self.backend = backend
+        self.routes = set(routes)
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+
+    def enabled_for(self, route):
+        return self.backend is not None and route in self.routes
+
+    def get(self, route, key):
+        try:
+            value = self.backend.get(key)
+        except sqlite3.Error as e:
+            logger.error(f"Completion cache read error: {str(e)}")
+            value = None
+        if value is None:
+            self.misses[route] += 1
+        else:
+            self.hits[route] += 1
+        return value
+
+    def set(self, route, key, value):
+        try:
+            self.backend.set(key, value)
+        except sqlite3.Error as e:
+            logger.error(f"Completion cache write error: {str(e)}")
+
+    def stats(self):
+        """Hit/miss counts and hit ratio per route."""
+        routes = {}
+        for route in sorted(set(self.hits) | set(self.misses)):
+            hits, misses = self.hits[route], self.misses[route]
+            routes[route] = {
+                "hits": hits,
+                "misses": misses,
+                "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            }
+        return {
+            "backend": type(self.backend).__name__ if self.backend else None,
+            "entries": len(self.backend) if self.backend else 0,
+            "routes": routes,
+        }
+
+
+def cache_from_env():
+    """Build the CompletionCache configured by the COMPLETION_CACHE_* environment variables."""
+    kind = os.getenv("COMPLETION_CACHE", "memory").lower()
+    ttl = int(os.getenv("COMPLETION_CACHE_TTL", "3600"))
+    size = int(os.getenv("COMPLETION_CACHE_SIZE", "1024"))
+    routes = [r.strip() for r in os.getenv(
+        "COMPLETION_CACHE_ROUTES", "resource_finder,toxicity_assessment,recovery_capital"
+    ).split(",") if r.strip()]
+
+    if kind == "sqlite":
+        backend = SQLiteCache(os.getenv("COMPLETION_CACHE_PATH", "./completion_cache.sqlite3"), size, ttl)
+    elif kind == "memory":
+        backend = MemoryCache(size, ttl)
+    else:
+        backend = None
+    return CompletionCache(backend, routes)
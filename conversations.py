@@ -0,0 +1,231 @@
+#conversations
+"""
+Server-side conversation state for the multi-turn chat tools.
+
+The browser only sends a conversation_id and the new message; the transcript
+lives here. Once the kept messages pass a token threshold, the older ones are
+rolled up into a running summary by a cheap model, in the background, so the
+prompt sent on each turn stays bounded however long the interview runs.
+Turns and roll-ups are saved with a compare-and-set on the stored
+conversation, so concurrent turns (or a turn racing a roll-up, in any worker)
+never overwrite each other's messages.
+
+The memory store is per process, so it only works with a single worker;
+serve.py defaults CONVERSATION_STORE to sqlite so every worker sees every
+conversation.
+
+Configure with CONVERSATION_STORE=memory|sqlite, CONVERSATION_STORE_PATH,
+CONVERSATION_TTL (seconds idle before a conversation expires and is deleted),
+CONVERSATION_MAX (conversations kept), CONVERSATION_SUMMARY_THRESHOLD
+(tokens), CONVERSATION_KEEP_RECENT (messages kept verbatim) and
+CONVERSATION_SUMMARY_MODEL.
+"""
+import os
+import json
+import time
+import secrets
+import logging
+import threading
+
+from completion_cache import MemoryCache, SQLiteCache
+from openai_pool import get_client
+from admission import ADMISSION
+from tokens import count_message_tokens
+
+logger = logging.getLogger(__name__)
+
+CONVERSATION_SUMMARY_THRESHOLD = int(os.getenv('CONVERSATION_SUMMARY_THRESHOLD', '2000'))
+CONVERSATION_KEEP_RECENT = int(os.getenv('CONVERSATION_KEEP_RECENT', '4'))
+CONVERSATION_SUMMARY_MODEL = os.getenv('CONVERSATION_SUMMARY_MODEL', 'gpt-4o-mini')
+# Saves retried this many times when another turn or roll-up saved the conversation first
+CONVERSATION_UPDATE_ATTEMPTS = 5
+
+SUMMARY_INSTRUCTION = (
+    "You maintain a running summary of an interview between an assistant and a person "
+    "affected by a disaster. Merge the existing summary and the new messages into one "
+    "updated summary. Keep every fact the person shared (locations, dates, household, "
+    "health, property, finances, answers to questions) and what the assistant has "
+    "already asked or concluded. Write plain prose, at most 300 words."
+)
+
+
+class Conversation:
+    """One chat transcript: a running summary plus the most recent messages."""
+
+    def __init__(self, id, route, summary="", messages=None, next_seq=0, revision=0):
+        self.id = id
+        self.route = route
+        self.summary = summary
+        # Each message is {"seq", "role", "content"}; seq orders messages across summaries
+        self.messages = messages or []
+        self.next_seq = next_seq
+        # Incremented on every save, so two saves of the same loaded copy cannot both succeed
+        self.revision = revision
+
+    @property
+    def is_new(self):
+        return not self.messages and not self.summary
+
+    def prompt_messages(self, system_prompt, user_message):
+        """Messages to send upstream for the next turn."""
+        messages = [{"role": "system", "content": system_prompt}]
+        if self.summary:
+            messages.append({"role": "system", "content": f"Summary of the conversation so far:\n{self.summary}"})
+        messages.extend({"role": m["role"], "content": m["content"]} for m in self.messages)
+        messages.append({"role": "user", "content": user_message})
+        return messages
+
+    def append(self, role, content):
+        self.messages.append({"seq": self.next_seq, "role": role, "content": content})
+        self.next_seq += 1
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "route": self.route,
+            "summary": self.summary,
+            "messages": self.messages,
+            "next_seq": self.next_seq,
+            "revision": self.revision,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["id"], data["route"], data["summary"], data["messages"], data["next_seq"],
+                   data.get("revision", 0))
+
+
+def summarize_with_openai(api_key, summary, messages):
+    """Fold messages into summary with the summary model; returns the new summary."""
+    transcript = "\n".join(f"{m['role'].upper()}: {m['content']}" for m in messages)
+    client = get_client(api_key)
+    with ADMISSION.acquire(api_key, 'conversation_summary') as permit:
+        response = permit.call(lambda: client.chat.completions.create(
+            model=CONVERSATION_SUMMARY_MODEL,
+            messages=[
+                {"role": "system", "content": SUMMARY_INSTRUCTION},
+                {"role": "user", "content": f"Existing summary:\n{summary or '(none)'}\n\nNew messages:\n{transcript}"}
+            ],
+            temperature=0.2
+        ))
+    return response.choices[0].message.content.strip()
+
+
+class ConversationStore:
+    """Loads and saves conversations in a key/value backend and rolls up long ones."""
+
+    def __init__(self, backend, summarize=summarize_with_openai,
+                 threshold=CONVERSATION_SUMMARY_THRESHOLD, keep_recent=CONVERSATION_KEEP_RECENT):
+        self.backend = backend
+        self.summarize = summarize
+        self.threshold = threshold
+        self.keep_recent = keep_recent
+        self._summarizing = set()
+        self._lock = threading.Lock()
+
+    def new(self, route):
+        return Conversation(secrets.token_urlsafe(16), route)
+
+    def load(self, route, conversation_id):
+        """Return the conversation, a new one if conversation_id is empty, or None if it expired."""
+        if not conversation_id:
+            return self.new(route)
+        return self._read(route, conversation_id)[0]
+
+    def _read(self, route, conversation_id):
+        """(conversation or None, the stored value it was read from)."""
+        data = self.backend.get(f"conversation:{conversation_id}")
+        if data is None:
+            return None, None
+        conversation = Conversation.from_dict(json.loads(data))
+        if conversation.route != route:
+            return None, data
+        return conversation, data
+
+    def _update(self, route, conversation_id, change):
+        """
+        Read the stored conversation, apply change to it and save it only if
+        nobody saved it in between (compare-and-set on the stored value, which
+        carries the revision); otherwise read it again and retry. change gets
+        the stored conversation (or None) and returns the one to save, or None
+        to leave it as it is. Returns the saved conversation or None.
+        """
+        for _ in range(CONVERSATION_UPDATE_ATTEMPTS):
+            stored, data = self._read(route, conversation_id)
+            conversation = change(stored)
+            if conversation is None:
+                return None
+            conversation.revision += 1
+            if self.backend.replace(f"conversation:{conversation_id}", data, json.dumps(conversation.to_dict())):
+                return conversation
+        raise RuntimeError(f"Conversation {conversation_id} kept changing; gave up after "
+                           f"{CONVERSATION_UPDATE_ATTEMPTS} attempts")
+
+    def record_turn(self, conversation, user_message, answer, api_key):
+        """
+        Append a finished turn to the stored conversation, and start a roll-up
+        if the transcript got long. Another turn or a roll-up may have saved the
+        conversation since it was loaded, so the turn is appended to the stored
+        copy rather than to conversation.
+        """
+        def append_turn(stored):
+            if stored is None:
+                # New, or expired while answering: start from the copy the turn was answered from
+                stored = Conversation.from_dict(conversation.to_dict())
+            stored.append("user", user_message)
+            stored.append("assistant", answer)
+            return stored
+
+        conversation = self._update(conversation.route, conversation.id, append_turn)
+        if len(conversation.messages) <= self.keep_recent:
+            return
+        if count_message_tokens(conversation.messages) < self.threshold:
+            return
+        with self._lock:
+            if conversation.id in self._summarizing:
+                return
+            self._summarizing.add(conversation.id)
+        threading.Thread(
+            target=self._roll_up, args=(conversation.route, conversation.id, api_key), daemon=True
+        ).start()
+
+    def _roll_up(self, route, conversation_id, api_key):
+        started = time.perf_counter()
+        try:
+            conversation = self.load(route, conversation_id)
+            if conversation is None:
+                return
+            older = conversation.messages[:-self.keep_recent]
+            summary = self.summarize(api_key, conversation.summary, older)
+            previous_summary = conversation.summary
+            last_seq = older[-1]["seq"]
+
+            def apply_summary(stored):
+                # Turns saved while the summary was written are kept; a roll-up
+                # finished by another worker in the meantime wins
+                if stored is None or stored.summary != previous_summary:
+                    return None
+                stored.summary = summary
+                stored.messages = [m for m in stored.messages if m["seq"] > last_seq]
+                return stored
+
+            if self._update(route, conversation_id, apply_summary) is not None:
+                logger.debug(f"Summarized {len(older)} messages of conversation {conversation_id} "
+                             f"in {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            logger.error(f"Conversation summary error: {str(e)}")
+        finally:
+            with self._lock:
+                self._summarizing.discard(conversation_id)
+
+
+def conversation_store_from_env():
+    """Build the ConversationStore configured by the CONVERSATION_* environment variables."""
+    ttl = int(os.getenv('CONVERSATION_TTL', str(6 * 3600)))
+    size = int(os.getenv('CONVERSATION_MAX', '10000'))
+    if os.getenv('CONVERSATION_STORE', 'memory').lower() == 'sqlite':
+        backend = SQLiteCache(os.getenv('CONVERSATION_STORE_PATH', './conversations.sqlite3'),
+                              size, ttl, table='conversations')
+    else:
+        backend = MemoryCache(size, ttl)
+    return ConversationStore(backend)
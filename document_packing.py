@@ -0,0 +1,205 @@
+#document_packing
+"""
+Token-budgeted packing of uploaded documents into the rejection-simulation prompt.
+
+Documents are cleaned (whitespace collapsed) and cut into chunks. When they do
+not fit the token budget, the page headers and footers of each document (a
+line at the top or bottom of most of its pages) are first kept only on their
+first page, and if that is not enough the documents are reduced to the chunks
+most relevant to the user's situation (BM25). Other repeated lines, such as
+the same answer given to several questions, are never removed. Every document
+keeps its opening chunk, and kept chunks stay in their original order with a
+marker where text was left out.
+
+Configure with REJECTION_DOCUMENT_TOKEN_BUDGET and DOCUMENT_CHUNK_TOKENS.
+"""
+import os
+import re
+from collections import Counter
+
+from retrieval import BM25Index
+from tokens import count_tokens
+from pdf_extraction import PAGE_BREAK
+
+DOCUMENT_TOKEN_BUDGET = int(os.getenv('REJECTION_DOCUMENT_TOKEN_BUDGET', '12000'))
+DOCUMENT_CHUNK_TOKENS = int(os.getenv('DOCUMENT_CHUNK_TOKENS', '300'))
+
+# Headers and footers are looked for in this many lines at the top and bottom of
+# each page, and must be on more than half of a document's pages
+BOILERPLATE_EDGE_LINES = 2
+BOILERPLATE_MAX_CHARS = 200
+
+OMITTED_MARKER = "[... less relevant text omitted ...]"
+
+WHITESPACE_RE = re.compile(r"[ \t\f\v\u00a0]+")
+PAGE_NUMBER_RE = re.compile(r"^(page\s*)?\d+(\s*(of|/)\s*\d+)?$")
+
+
+def clean_lines(text):
+    """Split text into lines with runs of whitespace collapsed and blank lines dropped."""
+    lines = (WHITESPACE_RE.sub(" ", line).strip() for line in text.splitlines())
+    return [line for line in lines if line]
+
+
+def _boilerplate_key(line):
+    line = line.lower()
+    # "Page 3 of 12" and "Page 4 of 12" are the same footer
+    if PAGE_NUMBER_RE.match(line):
+        return "page number"
+    return line
+
+
+def _split_long_line(line, model):
+    """Break a line longer than a chunk (text extracted without newlines) on word boundaries."""
+    if count_tokens(line, model) <= DOCUMENT_CHUNK_TOKENS:
+        return [line]
+    max_chars = DOCUMENT_CHUNK_TOKENS * 4
+    pieces = []
+    while len(line) > max_chars:
+        cut = line.rfind(" ", 0, max_chars)
+        if cut <= 0:
+            cut = max_chars
+        pieces.append(line[:cut].strip())
+        line = line[cut:].strip()
+    if line:
+        pieces.append(line)
+    return pieces
+
+
+def _chunk_lines(lines, model):
+    """Group lines into chunks of roughly DOCUMENT_CHUNK_TOKENS tokens."""
+    chunks = []
+    current = []
+    current_tokens = 0
+    for line in (piece for line in lines for piece in _split_long_line(line, model)):
+        line_tokens = count_tokens(line, model)
+        if current and current_tokens + line_tokens > DOCUMENT_CHUNK_TOKENS:
+            chunks.append(("\n".join(current), current_tokens))
+            current, current_tokens = [], 0
+        current.append(line)
+        current_tokens += line_tokens
+    if current:
+        chunks.append(("\n".join(current), current_tokens))
+    return chunks
+
+
+def _edge_lines(lines):
+    """Indexes of the lines at the top and bottom of a page, where headers and footers are."""
+    top = range(min(BOILERPLATE_EDGE_LINES, len(lines)))
+    bottom = range(max(len(lines) - BOILERPLATE_EDGE_LINES, 0), len(lines))
+    return set(top) | set(bottom)
+
+
+def _strip_headers_and_footers(pages):
+    """
+    Lines of a document's pages with the header and footer lines that repeat
+    on most pages kept only on the first. Returns (lines, lines removed).
+    """
+    counts = Counter()
+    for lines in pages:
+        counts.update({_boilerplate_key(lines[i]) for i in _edge_lines(lines)
+                       if len(lines[i]) <= BOILERPLATE_MAX_CHARS})
+    repeated = {key for key, count in counts.items() if count >= 2 and count * 2 > len(pages)}
+
+    seen = set()
+    kept = []
+    removed = 0
+    for lines in pages:
+        edges = _edge_lines(lines)
+        for index, line in enumerate(lines):
+            key = _boilerplate_key(line)
+            if index in edges and key in repeated and len(line) <= BOILERPLATE_MAX_CHARS:
+                if key in seen:
+                    removed += 1
+                    continue
+                seen.add(key)
+            kept.append(line)
+    return kept, removed
+
+
+def _document_chunks(doc_lines, model):
+    """Chunks of every document as (doc_index, text, tokens); identical chunks are kept once."""
+    seen_chunks = set()
+    chunks = []
+    for doc_index, lines in enumerate(doc_lines):
+        for text, tokens in _chunk_lines(lines, model):
+            # Identical chunks (the same page uploaded twice) are kept once
+            if text in seen_chunks:
+                continue
+            seen_chunks.add(text)
+            chunks.append((doc_index, text, tokens))
+    return chunks
+
+
+def pack_documents(documents, query, budget=DOCUMENT_TOKEN_BUDGET, model="gpt-4o"):
+    """
+    Fit documents (dicts with "filename" and "content") into budget tokens.
+    Returns (packed_documents, stats) where packed_documents has the same shape
+    as documents and stats holds the token accounting per document.
+    """
+    # Extracted PDF text separates its pages with PAGE_BREAK
+    doc_pages = [[clean_lines(page) for page in doc["content"].split(PAGE_BREAK)] for doc in documents]
+    doc_lines = [[line for lines in pages for line in lines] for pages in doc_pages]
+    chunks = _document_chunks(doc_lines, model)
+    removed_lines = [0] * len(documents)
+    if sum(tokens for _, _, tokens in chunks) > budget:
+        # Over budget: drop repeated page headers and footers before any content
+        stripped = [_strip_headers_and_footers(pages) for pages in doc_pages]
+        removed_lines = [removed for _, removed in stripped]
+        chunks = _document_chunks([lines for lines, _ in stripped], model)
+
+    total_tokens = sum(tokens for _, _, tokens in chunks)
+    if total_tokens <= budget:
+        selected = set(range(len(chunks)))
+    else:
+        scores = BM25Index([text for _, text, _ in chunks]).scores(query)
+        first_chunks = {}
+        for chunk_index, (doc_index, _, _) in enumerate(chunks):
+            first_chunks.setdefault(doc_index, chunk_index)
+        openings = set(first_chunks.values())
+        # Opening chunk of each document first, then by relevance, then by position
+        priority = sorted(
+            range(len(chunks)),
+            key=lambda i: (i not in openings, -scores.get(i, 0.0), i)
+        )
+        selected = set()
+        used = 0
+        for chunk_index in priority:
+            tokens = chunks[chunk_index][2]
+            if used + tokens <= budget:
+                selected.add(chunk_index)
+                used += tokens
+
+    packed = []
+    stats = []
+    for doc_index, doc in enumerate(documents):
+        parts = []
+        kept_tokens = 0
+        doc_chunks = [(i, chunk) for i, chunk in enumerate(chunks) if chunk[0] == doc_index]
+        previous_kept = True
+        for chunk_index, (_, text, tokens) in doc_chunks:
+            if chunk_index in selected:
+                parts.append(text)
+                kept_tokens += tokens
+                previous_kept = True
+            elif previous_kept:
+                parts.append(OMITTED_MARKER)
+                previous_kept = False
+        if not doc_chunks and doc_lines[doc_index]:
+            parts.append("(Same content as an earlier document.)")
+        packed.append({"filename": doc["filename"], "content": "\n".join(parts)})
+        stats.append({
+            "filename": doc["filename"],
+            "original_tokens": count_tokens(doc["content"], model),
+            "packed_tokens": kept_tokens,
+            "chunks": len(doc_chunks),
+            "chunks_kept": sum(1 for i, _ in doc_chunks if i in selected),
+            "boilerplate_lines_removed": removed_lines[doc_index],
+        })
+
+    return packed, {
+        "budget": budget,
+        "packed_tokens": sum(s["packed_tokens"] for s in stats),
+        "original_tokens": sum(s["original_tokens"] for s in stats),
+        "documents": stats,
+    }
@@ -0,0 +1,105 @@
+# Gunicorn configuration for serving main:app
+#
+#   python serve.py            (or: gunicorn -c gunicorn.conf.py main:app)
+#
+# The default gevent worker runs each request in a greenlet, so a worker holds
+# hundreds of in-flight OpenAI calls at once instead of one per thread. Set
+# GUNICORN_WORKER_CLASS=sync (or gthread) to fall back to thread-per-request.
+#
+# The app is preloaded: main.py (prompts, the catalog index, token encodings,
+# compiled templates) is loaded once in the master and the workers are forked
+# from it, sharing that memory copy-on-write and booting in milliseconds.
+# Set GUNICORN_PRELOAD=0 to load the app in each worker instead.
+#
+# Several workers means each request can land on any of them, so state that a
+# later request reads back must live in a store every worker shares: a chat's
+# follow-up turn (CONVERSATION_STORE) and a /jobs/<id> poll (JOB_STORE). The
+# launcher defaults both to their SQLite files, which drop conversations idle
+# past CONVERSATION_TTL and jobs past JOB_TTL, and refuses to start more than
+# one worker while either is set to memory. Caches (completion, similar
+# answers, pages) may stay per worker; a miss only costs an upstream call.
+#
+# Reloading:
+#   kill -HUP <master>   new workers with the new configuration; the old ones
+#                        stop accepting and finish their in-flight requests
+#                        (streamed answers, background jobs) for up to
+#                        GUNICORN_GRACEFUL_TIMEOUT seconds. Prompt files are
+#                        reloaded without this (see prompts.py).
+#   kill -USR2 <master>  new code: starts a new master and workers next to the
+#                        old ones; then send the old master -WINCH and -QUIT.
+#                        With a preloaded app, HUP alone does not load new code.
+import gc
+import os
+import time
+
+CONFIG_LOADED = time.perf_counter()
+
+# Stores read back by later requests, which may go to another worker
+SHARED_STORES = {'CONVERSATION_STORE': 'conversations', 'JOB_STORE': 'background jobs'}
+for store in SHARED_STORES:
+    # Set before the app is loaded, in the master and so in every worker
+    os.environ.setdefault(store, 'sqlite')
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gevent')
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+threads = int(os.getenv('GUNICORN_THREADS', '1'))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') == '1'
+
+# LLM calls can take a minute or more; streamed answers keep the connection busy
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '180'))
+# Workers being replaced or shut down get as long to finish their calls
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', str(timeout)))
+keepalive = 5
+
+if worker_class == 'gevent':
+    # Import the OpenAI SDK before select is monkey-patched: its HTTP stack
+    # imports trio when that is installed, and trio needs select.epoll.
+    import openai  # noqa: F401
+    if preload_app:
+        # The app is imported in the master, so patch there before it is:
+        # locks and thread-locals created at import must be gevent's
+        from gevent import monkey
+        monkey.patch_all()
+
+
+def on_starting(server):
+    # The final worker count, including --workers on the command line
+    if server.cfg.workers > 1:
+        for store, what in SHARED_STORES.items():
+            if os.environ[store].lower() != 'sqlite':
+                raise RuntimeError(f"{store}={os.environ[store]} keeps {what} in each worker's memory, so "
+                                   f"requests that reach another worker would not find them. Set {store}=sqlite "
+                                   f"or run a single worker (WEB_CONCURRENCY=1).")
+
+
+def when_ready(server):
+    # Runs in the master once the app is loaded, before the first worker is forked
+    if preload_app:
+        import main
+        main.warm_up()
+        main.STARTUP["preloaded"] = True
+        # Keep the garbage collector from touching (and so copying) the preloaded objects in every worker
+        gc.freeze()
+    server.log.info(f"Ready in {time.perf_counter() - CONFIG_LOADED:.2f}s "
+                    f"({'preloaded' if preload_app else 'not preloaded'}, {workers} {worker_class} workers)")
+
+
+def post_fork(server, worker):
+    worker.forked_at = time.perf_counter()
+
+
+def post_worker_init(worker):
+    import main
+    if not preload_app:
+        main.warm_up()
+    seconds = time.perf_counter() - worker.forked_at
+    main.STARTUP["worker_boot_seconds"] = round(seconds, 4)
+    worker.log.info(f"Worker {worker.pid} booted in {seconds:.3f}s")
+
+
+def worker_exit(server, worker):
+    # In-flight requests have finished; let queued background jobs finish too
+    import main
+    main.JOBS.shutdown()
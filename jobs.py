@@ -0,0 +1,163 @@
+#jobs
+"""
+Background jobs for long-running requests.
+
+A job is accepted by the web worker, run on a small local thread pool and
+its status, timings and result are written to a key/value store. With
+JOB_STORE=sqlite (the default under serve.py) every gunicorn worker reads the
+same store, so the client can poll any worker for the outcome; the memory
+store only works with a single worker process.
+Only a bounded number of jobs may be queued or running per process; past
+that, submit() raises QueueFull and the route answers 503 with Retry-After.
+
+Configure with JOB_WORKERS (threads per process), JOB_MAX_PENDING (queued
+plus running jobs per process), JOB_TTL (seconds results are kept before they are deleted),
+JOB_STORE=memory|sqlite and JOB_STORE_PATH.
+"""
+import os
+import json
+import time
+import secrets
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from completion_cache import MemoryCache, SQLiteCache
+from metrics import JOB_SECONDS, JOBS_TOTAL
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+JOB_MAX_PENDING = int(os.getenv('JOB_MAX_PENDING', '32'))
+
+
+class QueueFull(Exception):
+    """Raised by JobQueue.submit when the process already has its maximum of pending jobs."""
+
+
+class JobError(Exception):
+    """A job failure whose message is safe to show to the user."""
+
+
+class Job:
+    """The running job as seen by its function: an id and per-stage timings."""
+
+    def __init__(self, record):
+        self.id = record["id"]
+        self.timings = record["timings"]
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[f"{name}_seconds"] = round(time.perf_counter() - started, 4)
+
+
+class JobQueue:
+    """Runs job functions on a bounded local thread pool and records their outcome in store."""
+
+    def __init__(self, store, max_workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING):
+        self.store = store
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # One pool per server worker process, created after fork
+        if self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job')
+            self._executor_pid = os.getpid()
+            self.pending = 0
+        return self._executor
+
+    def shutdown(self):
+        """Wait for this process's queued and running jobs; called when the server worker exits."""
+        if self._executor is not None and self._executor_pid == os.getpid():
+            self._executor.shutdown(wait=True)
+
+    def _save(self, record):
+        self.store.set(f"job:{record['id']}", json.dumps(record))
+
+    def get(self, job_id):
+        """Return the job record (id, kind, status, timings and result or error), or None."""
+        data = self.store.get(f"job:{job_id}")
+        return json.loads(data) if data is not None else None
+
+    def submit(self, kind, func, *args):
+        """
+        Queue func(job, *args) and return the new job id. func returns a
+        JSON-serializable result or raises JobError with a user-facing message.
+        """
+        with self._lock:
+            executor = self._get_executor()
+            if self.pending >= self.max_pending:
+                JOBS_TOTAL.inc(kind=kind, status='rejected')
+                raise QueueFull(f"{self.pending} jobs already pending")
+            self.pending += 1
+
+        record = {
+            "id": secrets.token_urlsafe(16),
+            "kind": kind,
+            "status": "queued",
+            "created": time.time(),
+            "timings": {},
+        }
+        try:
+            self._save(record)
+            executor.submit(self._run, record, func, args)
+        except Exception:
+            # The job never reached _run, which would have freed its slot
+            JOBS_TOTAL.inc(kind=kind, status='error')
+            with self._lock:
+                self.pending -= 1
+            raise
+        return record["id"]
+
+    def _run(self, record, func, args):
+        started = time.time()
+        record["status"] = "running"
+        record["timings"]["queued_seconds"] = round(started - record["created"], 4)
+        JOB_SECONDS.observe(started - record["created"], kind=record["kind"], phase='queued')
+        try:
+            self._save(record)
+            record["result"] = func(Job(record), *args)
+            record["status"] = "done"
+        except JobError as e:
+            record["status"] = "error"
+            record["error"] = str(e)
+        except Exception as e:
+            logger.error(f"Job {record['id']} ({record['kind']}) failed: {str(e)}")
+            record["status"] = "error"
+            record["error"] = str(e)
+        finally:
+            finished = time.time()
+            record["timings"]["run_seconds"] = round(finished - started, 4)
+            record["timings"]["total_seconds"] = round(finished - record["created"], 4)
+            JOB_SECONDS.observe(finished - started, kind=record["kind"], phase='run')
+            JOB_SECONDS.observe(finished - record["created"], kind=record["kind"], phase='total')
+            JOBS_TOTAL.inc(kind=record["kind"], status=record["status"])
+            try:
+                self._save(record)
+            except Exception as e:
+                logger.error(f"Could not save job {record['id']}: {str(e)}")
+            with self._lock:
+                self.pending -= 1
+
+    def stats(self):
+        return {"pending": self.pending, "max_pending": self.max_pending, "workers": self.max_workers}
+
+
+def job_queue_from_env():
+    """Build the JobQueue configured by the JOB_* environment variables."""
+    ttl = int(os.getenv('JOB_TTL', '3600'))
+    if os.getenv('JOB_STORE', 'memory').lower() == 'sqlite':
+        store = SQLiteCache(os.getenv('JOB_STORE_PATH', './jobs.sqlite3'), 10000, ttl, table='jobs')
+    else:
+        store = MemoryCache(10000, ttl)
+    return JobQueue(store)
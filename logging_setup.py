@@ -0,0 +1,130 @@
+#logging_setup
+"""
+Logging configuration for the app.
+
+Records go through a bounded queue to a listener thread that does the actual
+I/O, so a slow disk or terminal never blocks a request; when the queue is
+full new records are dropped and counted instead, on /metrics as
+supplydrop_log_records_dropped_total. Large payloads (prompts
+with whole documents, full completions) are only logged through
+log_payload(), which does no work unless DEBUG is enabled, logs only a sample
+of calls and truncates what it logs.
+
+Configure with LOG_LEVEL (default INFO), LOG_ASYNC (1 to use the queue, the
+default), LOG_QUEUE_SIZE (records), LOG_PAYLOAD_SAMPLE_RATE (0 to 1) and
+LOG_PAYLOAD_MAX_CHARS (per message).
+"""
+import os
+import json
+import queue
+import atexit
+import random
+import logging
+import logging.handlers
+
+from metrics import LOG_RECORDS_DROPPED
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_ASYNC = os.getenv('LOG_ASYNC', '1') == '1'
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', '0.01'))
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv('LOG_PAYLOAD_MAX_CHARS', '500'))
+
+LOG_FORMAT = '%(levelname)s:%(name)s:%(message)s'
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records when the queue is full instead of blocking or raising."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            LOG_RECORDS_DROPPED.inc(level=record.levelname)
+
+
+_listener = None
+
+
+def _start_listener(log_queue, handlers):
+    global _listener
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+@atexit.register
+def _flush_listener():
+    # Write out whatever is still queued before the process exits
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+def configure_logging(level=LOG_LEVEL, use_queue=LOG_ASYNC):
+    """Install the root handler; call once at startup."""
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+    if not use_queue:
+        root.addHandler(stream_handler)
+        return
+
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    root.addHandler(DroppingQueueHandler(log_queue))
+    _start_listener(log_queue, [stream_handler])
+    # Threads do not survive fork, so gunicorn workers forked from a preloaded
+    # app need their own listener, reading from a fresh queue
+    os.register_at_fork(after_in_child=lambda: _restart_in_child(stream_handler))
+
+
+def _restart_in_child(stream_handler):
+    if _listener is not None:
+        # Under a gevent-patched master (see gunicorn.conf.py) the listener is a
+        # greenlet and does survive fork; keep it from writing out the
+        # parent's still-queued records a second time
+        _listener.handlers = ()
+    root = logging.getLogger()
+    for handler in root.handlers:
+        if isinstance(handler, DroppingQueueHandler):
+            handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+            _start_listener(handler.queue, [stream_handler])
+
+
+def _truncate(text, max_chars):
+    if len(text) <= max_chars:
+        return text
+    return f"{text[:max_chars]}... [{len(text) - max_chars} more characters]"
+
+
+def payload_preview(payload, max_chars=LOG_PAYLOAD_MAX_CHARS):
+    """Compact JSON of payload with each message's content (or a plain string) truncated."""
+    if isinstance(payload, str):
+        return _truncate(payload, max_chars)
+    preview = dict(payload)
+    if "messages" in preview:
+        preview["messages"] = [
+            dict(message, content=_truncate(message.get("content") or "", max_chars))
+            for message in preview["messages"]
+        ]
+    return json.dumps(preview)
+
+
+def log_payload(logger, label, payload, sample_rate=None):
+    """
+    Log a truncated preview of a large payload at DEBUG, for a sample of calls.
+    Nothing is formatted unless DEBUG is enabled and the call is sampled.
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    rate = LOG_PAYLOAD_SAMPLE_RATE if sample_rate is None else sample_rate
+    if rate < 1 and random.random() >= rate:
+        return
+    logger.debug("%s: %s", label, payload_preview(payload))
@@ -1,40 +1,92 @@
 import os
 import json
-from openai import OpenAI
-from flask import Flask, render_template, request, redirect, flash, jsonify
+import time
+from io import BytesIO
+from functools import cached_property
+from flask import Flask, Request, render_template, request, redirect, flash, jsonify, Response, stream_with_context, g, url_for
 from flask_wtf import FlaskForm
 from flask_wtf.csrf import CSRFProtect
 from wtforms import StringField, SubmitField, TextAreaField, MultipleFileField
 from wtforms.validators import DataRequired, Optional
-from werkzeug.utils import secure_filename
-from pypdf import PdfReader
-import bleach
+import openai
 import logging
+from retrieval import ResourceCatalog
+from prompts import PromptRegistry
+from completion_cache import cache_from_env, make_cache_key
+from similar_answers import similar_answers_from_env
+from page_cache import page_cache_from_env
+from static_assets import StaticAssets
+from openai_pool import get_client
+from pdf_extraction import PdfExtractor
+from pdf_text_cache import pdf_text_cache_from_env
+from document_packing import pack_documents
+from conversations import conversation_store_from_env
+from tokens import count_tokens, count_message_tokens
+from logging_setup import configure_logging, log_payload
+from jobs import job_queue_from_env, QueueFull, JobError
+from coalesce import coalescer_from_env
+from uploads import UploadGuard, UploadRejected, UPLOAD_MAX_FILES, UPLOAD_MAX_PAGES
+from batch import (BATCH_MAX_ITEMS, MAX_DOCUMENTS, BatchError, parse_items, run_concurrently, to_ndjson, submit_openai_batch,
+                   openai_batch_results)
+from admission import ADMISSION, Overloaded, retry_after_from
+from model_router import model_router_from_env
+from metrics import (REGISTRY, REQUEST_SECONDS, STAGE_SECONDS, PDF_PAGE_SECONDS, UPSTREAM_SECONDS,
+                     PROMPT_TOKENS, TOKENS_TOTAL, UPSTREAM_ERRORS)
 
 # ------------------------------------------------------------------------
 # SETUP FLASK APP & CONFIG
 # ------------------------------------------------------------------------
+class InMemoryRequest(Request):
+    """
+    Keeps uploaded files in memory instead of spooling bodies over 500 KB to
+    temporary files. Uploads are capped by MAX_CONTENT_LENGTH, checked while
+    they stream in (see uploads.py), and the PDFs are parsed straight from
+    these buffers.
+    """
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return self.upload_guard.open(filename)
+
+    @cached_property
+    def upload_guard(self):
+        return UploadGuard(self.endpoint or 'unknown',
+                           max_files=UPLOAD_MAX_FILES_BY_ENDPOINT.get(self.endpoint, UPLOAD_MAX_FILES))
+
 app = Flask(__name__)
+app.request_class = InMemoryRequest
 app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'YOUR-DEFAULT-SECRET-KEY')
-app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', './uploads')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16 MB limit for uploads
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
-logger = logging.getLogger(__name__)
+# Batches may carry documents for every item
+UPLOAD_MAX_FILES_BY_ENDPOINT = {'batch': BATCH_MAX_ITEMS * MAX_DOCUMENTS}
 
-# Create uploads directory if it doesn't exist
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+# Configure logging (see logging_setup.py for LOG_LEVEL and payload sampling)
+configure_logging()
+logger = logging.getLogger(__name__)
 
 # Enable CSRF Protection
 csrf = CSRFProtect(app)
 
+# Rendered GET pages, and hashed, pre-compressed static files once built
+# (see page_cache.py and static_assets.py)
+PAGES = page_cache_from_env()
+STATIC_ASSETS = StaticAssets(app)
+
+@app.errorhandler(UploadRejected)
+def upload_rejected(e):
+    # Raised while the multipart body is still streaming in; the rest of it is never read
+    logger.warning(f"Upload rejected on {request.endpoint}: {str(e)}")
+    return jsonify({"error": str(e)}), e.status
+
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'pdf'}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Process pool for PDF text extraction, with a cache of text already extracted
+# (see pdf_extraction.py and pdf_text_cache.py for configuration)
+PDF_EXTRACTOR = PdfExtractor(cache=pdf_text_cache_from_env(), max_pages=UPLOAD_MAX_PAGES)
+
 # Configure OpenAI
 
 # ------------------------------------------------------------------------
@@ -53,69 +105,524 @@ class RejectionSimulationForm(FlaskForm):
 # ------------------------------------------------------------------------
 # HELPER FUNCTIONS FOR LOADING PROMPTS AND PROCESSING FILES
 # ------------------------------------------------------------------------
-def load_json_prompt(file_path, default_prompt):
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            return data.get('system_prompt', default_prompt)
-    except FileNotFoundError:
-        return default_prompt
+def read_upload(file_storage):
+    """Return the bytes of an uploaded file without copying its in-memory buffer."""
+    stream = file_storage.stream
+    if isinstance(stream, BytesIO):
+        return stream.getvalue()
+    stream.seek(0)
+    return stream.read()
+
+def read_uploads(pdf_files, route):
+    """Return (filename, bytes) pairs for the uploaded files."""
+    files = []
+    with STAGE_SECONDS.time(route=route, stage='upload_read'):
+        for pdf_file in pdf_files:
+            logger.debug(f"Starting to process PDF file: {pdf_file.filename}")
+            files.append((pdf_file.filename, read_upload(pdf_file)))
+    return files
+
+def extract_pdf_texts(files, route):
+    """
+    Extracts and sanitizes the text of (filename, bytes) pairs in parallel on
+    the extraction pool, straight from the uploaded bytes.
+    Returns one result dict per file with "text" or "error" plus timings.
+    """
+    with STAGE_SECONDS.time(route=route, stage='pdf_extraction'):
+        results = PDF_EXTRACTOR.extract(files)
+    for result in results:
+        for seconds in result.get("page_seconds", []):
+            PDF_PAGE_SECONDS.observe(seconds, stage='extract')
+        for seconds in result.get("sanitize_seconds", []):
+            PDF_PAGE_SECONDS.observe(seconds, stage='sanitize')
+    return results
+
+def validate_form(form):
+    """form.validate_on_submit(), timed as the form_validation stage."""
+    with STAGE_SECONDS.time(route=request.endpoint, stage='form_validation'):
+        return form.validate_on_submit()
 
-def extract_and_clean_pdf_text(pdf_file):
+# ------------------------------------------------------------------------
+# HELPER FUNCTIONS FOR STREAMING RESPONSES
+# ------------------------------------------------------------------------
+def wants_stream():
+    """
+    True when the client asked for tokens as Server-Sent Events instead of
+    a single JSON answer (form field stream=1 or an Accept: text/event-stream header).
     """
-    Extracts text from a PDF file and sanitizes it.
-    Returns tuple of (success, text/error_message)
+    if request.form.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return 'text/event-stream' in request.headers.get('Accept', '')
+
+def sse_event(data, event=None):
+    """Format one Server-Sent Event frame carrying a JSON payload."""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data)}\n\n"
+
+def sse_response(events):
+    """Wrap an iterator of SSE frames in an unbuffered streaming response."""
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def stream_answer(answer, meta=None):
+    """Send an already complete answer using the same SSE framing as a live stream."""
+    def generate():
+        yield sse_event({"token": answer})
+        yield sse_event(meta or {}, event="done")
+
+    return sse_response(generate())
+
+def stream_chat_completion(api_key, meta=None, on_complete=None, route=None, **kwargs):
     """
+    Start a streaming chat completion and relay its tokens as Server-Sent Events.
+    The upstream call is opened before the response is returned so connection and
+    auth errors still surface through the route's normal JSON error handling.
+    meta is sent along with the final "done" event, and on_complete is called with
+    the full answer and the model that gave it once the stream finishes. The
+    admission permit is held until the stream ends.
+    """
+    client = get_client(api_key)
+    prompt_tokens = record_prompt_tokens(route, kwargs)
+    permit = ADMISSION.acquire(api_key, route)
     try:
-        logger.debug(f"Starting to process PDF file: {pdf_file.filename}")
-
-        # Save the file temporarily to handle streaming issues
-        temp_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(pdf_file.filename))
-        pdf_file.save(temp_path)
+        model, stream, started = MODEL_ROUTER.call(route, kwargs, lambda args: permit.call(
+            lambda: client.chat.completions.create(stream=True, **args)))
+    except Exception:
+        permit.release()
+        UPSTREAM_ERRORS.inc(route=route)
+        raise
+
+    def generate():
+        try:
+            tokens = []
+            ttft = None
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                token = chunk.choices[0].delta.content
+                if token:
+                    if not tokens:
+                        ttft = time.perf_counter() - started
+                        UPSTREAM_SECONDS.observe(ttft, route=route, model=model, phase='ttft')
+                    tokens.append(token)
+                    yield sse_event({"token": token})
+            answer = ''.join(tokens)
+            seconds = time.perf_counter() - started
+            completion_tokens = count_tokens(answer, model)
+            UPSTREAM_SECONDS.observe(seconds, route=route, model=model, phase='total')
+            TOKENS_TOTAL.inc(completion_tokens, route=route, kind='completion')
+            MODEL_ROUTER.record(route, model, seconds, ttft, prompt_tokens, completion_tokens)
+            if on_complete:
+                on_complete(answer, model)
+            yield sse_event(meta or {}, event="done")
+        except Exception as e:
+            UPSTREAM_ERRORS.inc(route=route)
+            MODEL_ROUTER.record(route, model, error=True)
+            logger.error(f"OpenAI streaming error: {str(e)}")
+            yield sse_event({"error": str(e)}, event="error")
+        finally:
+            stream.close()
+            permit.release()
+
+    response = sse_response(generate())
+    # Also release if the client goes away before the stream starts
+    response.call_on_close(permit.release)
+    return response
+
+def stream_flight(flight, meta=None, on_complete=None):
+    """Relay the tokens of a coalesced completion as Server-Sent Events, like stream_chat_completion."""
+    def generate():
+        try:
+            for token in flight.follow():
+                yield sse_event({"token": token})
+            if on_complete:
+                on_complete(flight.answer, flight.model)
+            yield sse_event(meta or {}, event="done")
+        except Exception as e:
+            logger.error(f"OpenAI streaming error: {str(e)}")
+            yield sse_event({"error": str(e)}, event="error")
 
-        logger.debug(f"Saved temp file to: {temp_path}")
+    return sse_response(generate())
 
-        # Open the saved file using updated PyPDF2 API
+# ------------------------------------------------------------------------
+# HELPER FUNCTIONS FOR CHAT COMPLETIONS
+# ------------------------------------------------------------------------
+def upstream_error_response(e):
+    """
+    JSON error response for a failed chat completion: 503 with Retry-After
+    when we or OpenAI are out of capacity, 500 otherwise.
+    """
+    if isinstance(e, Overloaded):
+        retry_after = e.retry_after
+        message = "The AI service is busy right now. Please try again shortly."
+    elif isinstance(e, openai.RateLimitError):
+        retry_after = int(retry_after_from(e) or 30)
+        message = "OpenAI is rate limiting requests right now. Please try again shortly."
+    else:
+        return jsonify({"error": str(e)}), 500
+    response = jsonify({"error": message, "retry_after": retry_after})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 503
+
+def complete_chat(route, api_key, completion_args, meta=None, cacheable=False, on_answer=None):
+    """
+    Run a chat completion for a route and return the Flask response, streamed
+    or JSON depending on the request. When cacheable is set and the route is
+    enabled in the completion cache, a cached answer is returned without an
+    upstream call and new answers are stored. on_answer, if given, is called
+    with the full answer once it is known.
+    """
+    meta = dict(meta or {})
+    cache_key = None
+
+    def on_complete(answer, model):
+        if cache_key is not None:
+            store_answer(route, completion_args, model, answer)
+        if on_answer:
+            on_answer(answer)
+
+    if cacheable and COMPLETION_CACHE.enabled_for(route):
+        cache_key = make_cache_key(completion_args["messages"], completion_args["model"], completion_args["temperature"])
+        cached_answer = COMPLETION_CACHE.get(route, cache_key)
+        meta["cached"] = cached_answer is not None
+        if cached_answer is not None:
+            logger.debug(f"Completion cache hit for {route}")
+            if on_answer:
+                on_answer(cached_answer)
+            if wants_stream():
+                return stream_answer(cached_answer, meta)
+            return jsonify({"answer": cached_answer, **meta})
+
+    if cacheable and COALESCER.enabled_for(route):
+        # Identical questions already in flight on the same API key share one upstream call
+        key = cache_key or make_cache_key(completion_args["messages"], completion_args["model"], completion_args["temperature"])
+        flight, leader = COALESCER.join(route, key, api_key,
+                                        lambda flight: produce_completion(api_key, route, completion_args, flight))
+        meta["coalesced"] = not leader
+        flight.wait_started()
+        if wants_stream():
+            return stream_flight(flight, meta=meta, on_complete=on_complete)
+        answer = flight.wait()
+        on_complete(answer, flight.model)
+        with STAGE_SECONDS.time(route=route, stage='serialization'):
+            return jsonify({"answer": answer, **meta})
+
+    if wants_stream():
+        return stream_chat_completion(api_key, meta=meta, on_complete=on_complete, route=route, **completion_args)
+
+    answer, model = request_completion(api_key, route, completion_args)
+    on_complete(answer, model)
+    with STAGE_SECONDS.time(route=route, stage='serialization'):
+        return jsonify({"answer": answer, **meta})
+
+def produce_completion(api_key, route, completion_args, flight):
+    """Stream one upstream completion into a coalescing flight, recording upstream time and tokens."""
+    client = get_client(api_key)
+    prompt_tokens = record_prompt_tokens(route, completion_args)
+    with ADMISSION.acquire(api_key, route) as permit:
+        model = completion_args["model"]
+        ttft = None
+        try:
+            model, stream, started = MODEL_ROUTER.call(route, completion_args, lambda args: permit.call(
+                lambda: client.chat.completions.create(stream=True, **args)))
+            flight.model = model
+            try:
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    token = chunk.choices[0].delta.content
+                    if token:
+                        if not flight.tokens:
+                            ttft = time.perf_counter() - started
+                            UPSTREAM_SECONDS.observe(ttft, route=route, model=model, phase='ttft')
+                        flight.add(token)
+            except Exception:
+                MODEL_ROUTER.record(route, model, error=True)
+                raise
+            finally:
+                stream.close()
+        except Exception:
+            UPSTREAM_ERRORS.inc(route=route)
+            raise
+    seconds = time.perf_counter() - started
+    completion_tokens = count_tokens(flight.answer, model)
+    UPSTREAM_SECONDS.observe(seconds, route=route, model=model, phase='total')
+    TOKENS_TOTAL.inc(completion_tokens, route=route, kind='completion')
+    MODEL_ROUTER.record(route, model, seconds, ttft, prompt_tokens, completion_tokens)
+
+def record_prompt_tokens(route, completion_args):
+    """Record the prompt size of a completion for route and return its token count."""
+    prompt_tokens = count_message_tokens(completion_args["messages"], completion_args["model"])
+    PROMPT_TOKENS.observe(prompt_tokens, route=route)
+    TOKENS_TOTAL.inc(prompt_tokens, route=route, kind='prompt')
+    return prompt_tokens
+
+def request_completion(api_key, route, completion_args):
+    """
+    Run a non-streaming chat completion, recording upstream time and tokens.
+    Returns (answer, model), model being the one that answered after any fallback.
+    """
+    client = get_client(api_key)
+    prompt_tokens = record_prompt_tokens(route, completion_args)
+    with ADMISSION.acquire(api_key, route) as permit:
         try:
-            with open(temp_path, 'rb') as file:
-                from PyPDF2 import PdfReader  # Updated import
-                reader = PdfReader(file)
-                extracted_text = ""
+            model, response, started = MODEL_ROUTER.call(route, completion_args, lambda args: permit.call(
+                lambda: client.chat.completions.create(**args)))
+        except Exception:
+            UPSTREAM_ERRORS.inc(route=route)
+            raise
+    seconds = time.perf_counter() - started
+    UPSTREAM_SECONDS.observe(seconds, route=route, model=model, phase='total')
+    answer = response.choices[0].message.content
+    usage = getattr(response, "usage", None)
+    completion_tokens = usage.completion_tokens if usage else count_tokens(answer, model)
+    TOKENS_TOTAL.inc(completion_tokens, route=route, kind='completion')
+    MODEL_ROUTER.record(route, model, seconds, None, prompt_tokens, completion_tokens)
+    log_payload(logger, f"Received OpenAI response for {route}", answer)
+    return answer, model
+
+def store_answer(route, completion_args, model, answer):
+    """
+    Cache an answer under the key of the model that gave it: after a fallback
+    that is not the requested model, whose own answers must not be replaced.
+    Answers from an unknown model (another worker's shared flight) are not cached.
+    """
+    if model is None:
+        return
+    cache_key = make_cache_key(completion_args["messages"], model, completion_args["temperature"])
+    COMPLETION_CACHE.set(route, cache_key, answer)
+
+def cached_completion(route, api_key, completion_args, cacheable=True):
+    """
+    Answer a completion outside of a request (background jobs, batches), from
+    the completion cache when possible. Returns (answer, cached).
+    """
+    cache_key = None
+    if cacheable and COMPLETION_CACHE.enabled_for(route):
+        cache_key = make_cache_key(completion_args["messages"], completion_args["model"], completion_args["temperature"])
+        cached_answer = COMPLETION_CACHE.get(route, cache_key)
+        if cached_answer is not None:
+            return cached_answer, True
+    answer, model = request_completion(api_key, route, completion_args)
+    if cache_key is not None:
+        store_answer(route, completion_args, model, answer)
+    return answer, False
+
+def converse(route, api_key, user_message):
+    """
+    Run one turn of a server-side conversation. The browser sends only the new
+    message and its conversation_id; the transcript (or its running summary)
+    is loaded from CONVERSATIONS and the turn is recorded once answered.
+    """
+    conversation = CONVERSATIONS.load(route, request.form.get('conversation_id', '').strip())
+    if conversation is None:
+        return jsonify({"error": "This conversation has expired. Please start a new one.", "conversation_expired": True}), 400
+
+    with STAGE_SECONDS.time(route=route, stage='prompt_assembly'):
+        messages = conversation.prompt_messages(PROMPTS.text(route), user_message)
+        completion_args = {
+            "model": MODEL_ROUTER.choose(route, messages),
+            "messages": messages,
+            "temperature": 0.7
+        }
 
-                logger.debug(f"PDF has {len(reader.pages)} pages")
+    def on_answer(answer):
+        CONVERSATIONS.record_turn(conversation, user_message, answer, api_key)
 
-                for page in reader.pages:
-                    text = page.extract_text() or ""  # Updated method name
-                    text = bleach.clean(text)  # sanitize text
-                    extracted_text += text + "\n"
-                    logger.debug(f"Extracted page text length: {len(text)} characters")
+    # Only the opening turn of an interview is the same across users
+    return complete_chat(route, api_key, completion_args, meta={"conversation_id": conversation.id},
+                         cacheable=conversation.is_new, on_answer=on_answer)
 
-                logger.debug(f"Total extracted text length: {len(extracted_text)}")
-                if len(extracted_text.strip()) == 0:
-                    logger.warning("Warning: Extracted text is empty")
-                    return False, "No text could be extracted from the PDF"
+def build_resource_finder(user_message):
+    """
+    Build the completion args for a resource finder question, sending only the
+    catalog entries relevant to it after the static instructions.
+    Returns (completion_args, meta).
+    """
+    with STAGE_SECONDS.time(route='resource_finder', stage='prompt_assembly'):
+        if RESOURCE_FINDER_RETRIEVAL:
+            base_prompt, context, retrieval_stats = RESOURCE_CATALOG.build_context(user_message, RESOURCE_FINDER_TOP_K)
+            messages = [
+                {"role": "system", "content": base_prompt},
+                {"role": "system", "content": context},
+                {"role": "user", "content": user_message}
+            ]
+        else:
+            retrieval_stats = None
+            messages = PROMPTS.messages('resource_finder', [{"role": "user", "content": user_message}])
+
+    completion_args = {
+        "model": MODEL_ROUTER.choose('resource_finder', messages),
+        "messages": messages,
+        "temperature": 0.7
+    }
+    meta = {"retrieval": retrieval_stats} if retrieval_stats else None
+    return completion_args, meta
+
+def build_interview(route, message_history):
+    """Completion args for an interview turn from its full transcript (legacy clients and batches)."""
+    messages = PROMPTS.messages(route, message_history)
+    return {
+        "model": MODEL_ROUTER.choose(route, messages),
+        "messages": messages,
+        "temperature": 0.7
+    }
 
-                return True, extracted_text.strip()
-        except Exception as e:
-            logger.error(f"PDF reading error: {str(e)}")
-            return False, f"Error reading PDF: {str(e)}"
-    except Exception as e:
-        logger.error(f"Error processing PDF {pdf_file.filename}: {str(e)}")
-        return False, f"Error processing {pdf_file.filename}: {str(e)}"
-    finally:
-        # Ensure temp file is cleaned up even if there's an error
-        if 'temp_path' in locals() and os.path.exists(temp_path):
-            try:
-                os.remove(temp_path)
-                logger.debug(f"Cleaned up temp file: {temp_path}")
-            except Exception as e:
-                logger.error(f"Error cleaning up temp file: {str(e)}")
+# ------------------------------------------------------------------------
+# HELPER FUNCTIONS FOR REJECTION SIMULATION
+# ------------------------------------------------------------------------
+def build_rejection_simulation(user_message, files):
+    """
+    Extract the uploaded PDFs and build the OpenAI payload for a rejection
+    simulation. Returns (openai_payload, meta, error); error is a message for
+    the user when a document could not be read.
+    """
+    documents_context = []
+
+    # Extract all files in parallel
+    extraction_stats = []
+    for result in extract_pdf_texts(files, 'rejection_simulation'):
+        if "error" in result:
+            logger.error(f"Failed to extract text: {result['error']}")
+            return None, None, result["error"]
+
+        logger.debug(f"Successfully extracted text from {result['filename']}, length: {len(result['text'])}")
+        log_payload(logger, f"Extracted text of {result['filename']}", result['text'])
+        documents_context.append({
+            "filename": result["filename"],
+            "content": result["text"]
+        })
+        extraction_stats.append({
+            "filename": result["filename"],
+            "pages": result["pages"],
+            "seconds": result["seconds"],
+            "page_seconds": result["page_seconds"],
+            "cached": result["cached"]
+        })
+
+    # Construct a detailed prompt that clearly separates the application details and documents
+    prompt_started = time.perf_counter()
+    full_message = f"""Application Details:
+{user_message}
 
-# Load prompts
-RESOURCE_FINDER_PROMPT = load_json_prompt('resource_finder_prompt.json', "You are a helpful assistant trained on wildfire relief resources for Los Angeles.")
-REJECTION_SIMULATION_PROMPT = load_json_prompt('rejection_simulation_prompt.json', "You are a harsh simulator that rejects applications for insurance, FEMA, or grants for hurricane and wildfire recovery.")
-TOXICITY_ASSESSMENT_PROMPT = load_json_prompt('toxicity_assessment_prompt.json', "You are an expert environmental health specialist helping assess toxicity exposure risks.")
-RECOVERY_CAPITAL_PROMPT = load_json_prompt('recovery_capital_prompt.json', "You are an expert financial advisor helping identify sources of disaster recovery funding.")
+"""
+    packing_stats = None
+    if documents_context:
+        # Fit the documents into the token budget, keeping what matters for this situation
+        documents_context, packing_stats = pack_documents(documents_context, user_message)
+        full_message += "Submitted Documents:\n"
+        for doc in documents_context:
+            logger.debug(f"Adding document to prompt: {doc['filename']}, content length: {len(doc['content'])}")
+            full_message += f"\n--- Document: {doc['filename']} ---\n{doc['content']}\n"
+    else:
+        full_message += "\nNote: No supporting documents were provided with this application."
+
+    # Payload sent to OpenAI; only a sampled, truncated preview of it is logged
+    messages = PROMPTS.messages('rejection_simulation', [{"role": "user", "content": full_message}])
+    openai_payload = {
+        "model": MODEL_ROUTER.choose('rejection_simulation', messages),
+        "messages": messages,
+        "temperature": 0.7
+    }
+    STAGE_SECONDS.observe(time.perf_counter() - prompt_started, route='rejection_simulation', stage='prompt_assembly')
+    log_payload(logger, "Complete OpenAI payload", openai_payload)
+
+    meta = {"extraction": extraction_stats, "packing": packing_stats} if extraction_stats else None
+    return openai_payload, meta, None
+
+def run_rejection_simulation_job(job, user_message, files, api_key):
+    """Background job body for a rejection simulation; returns the answer and stats."""
+    with job.stage('extraction_and_prompt'):
+        openai_payload, meta, error = build_rejection_simulation(user_message, files)
+    if error:
+        raise JobError(error)
+    with job.stage('upstream'):
+        answer, cached = cached_completion('rejection_simulation', api_key, openai_payload)
+    return {"answer": answer, "cached": cached, **(meta or {})}
+
+# ------------------------------------------------------------------------
+# HELPER FUNCTIONS FOR BATCHES
+# ------------------------------------------------------------------------
+def build_batch_item(item):
+    """
+    Completion args for one batch item (see batch.py). Returns
+    (completion_args, meta, cacheable); raises BatchError if its documents
+    could not be read.
+    """
+    tool = item["tool"]
+    if tool == 'resource_finder':
+        completion_args, meta = build_resource_finder(item["user_message"])
+        return completion_args, meta, True
+    if tool == 'rejection_simulation':
+        completion_args, meta, error = build_rejection_simulation(item["user_message"], item["documents"])
+        if error:
+            raise BatchError(error)
+        return completion_args, meta, True
+    transcript = item["messages"] + [{"role": "user", "content": item["user_message"]}]
+    # Only the opening turn of an interview is the same across users
+    return build_interview(tool, transcript), None, not item["messages"]
+
+def run_batch_item(item, api_key):
+    """Answer one batch item; returns its result fields."""
+    completion_args, meta, cacheable = build_batch_item(item)
+    answer, cached = cached_completion(item["tool"], api_key, completion_args, cacheable=cacheable)
+    return {"answer": answer, "cached": cached, **(meta or {})}
+
+# Load prompts; edits to the JSON files are picked up without a restart (see prompts.py)
+PROMPTS = PromptRegistry()
+PROMPTS.register('resource_finder', 'resource_finder_prompt.json', "You are a helpful assistant trained on wildfire relief resources for Los Angeles.")
+PROMPTS.register('rejection_simulation', 'rejection_simulation_prompt.json', "You are a harsh simulator that rejects applications for insurance, FEMA, or grants for hurricane and wildfire recovery.")
+PROMPTS.register('toxicity_assessment', 'toxicity_assessment_prompt.json', "You are an expert environmental health specialist helping assess toxicity exposure risks.")
+PROMPTS.register('recovery_capital', 'recovery_capital_prompt.json', "You are an expert financial advisor helping identify sources of disaster recovery funding.")
+
+# Retrieval index over the resource catalog, so /resource-finder only sends the relevant entries
+RESOURCE_FINDER_RETRIEVAL = os.getenv('RESOURCE_FINDER_RETRIEVAL', '1') == '1'
+RESOURCE_FINDER_TOP_K = int(os.getenv('RESOURCE_FINDER_TOP_K', '8'))
+RESOURCE_CATALOG = ResourceCatalog(PROMPTS, 'resource_finder', "You are a helpful assistant trained on wildfire relief resources for Los Angeles.")
+
+# Completion cache shared by the chat routes (see completion_cache.py for configuration)
+COMPLETION_CACHE = cache_from_env()
+
+# Answers reused for reworded resource finder questions (see similar_answers.py for configuration)
+SIMILAR_ANSWERS = similar_answers_from_env()
+
+# Single-flight coalescing of identical in-flight completions (see coalesce.py for configuration)
+COALESCER = coalescer_from_env()
+
+# Per-route model choice and fallback (see model_router.py for configuration)
+MODEL_ROUTER = model_router_from_env()
+
+# Server-side chat transcripts for the interview tools (see conversations.py for configuration)
+CONVERSATIONS = conversation_store_from_env()
+
+# Optional background job mode for rejection simulations (see jobs.py for configuration)
+REJECTION_JOBS = os.getenv('REJECTION_JOBS', '0') == '1'
+JOB_RETRY_AFTER = int(os.getenv('JOB_RETRY_AFTER', '30'))
+JOB_POLL_SECONDS = float(os.getenv('JOB_POLL_SECONDS', '1'))
+JOBS = job_queue_from_env()
+
+# ------------------------------------------------------------------------
+# REQUEST TIMING AND METRICS
+# ------------------------------------------------------------------------
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    REGISTRY.start_flusher()
+
+@app.after_request
+def record_request_time(response):
+    # Streamed responses are timed up to the start of the stream; see
+    # supplydrop_upstream_seconds for the full completion time
+    started = g.get('request_started')
+    if started is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - started, route=request.endpoint or 'unknown',
+                                method=request.method, status=response.status_code)
+    if 'upload_guard' in request.__dict__:
+        request.upload_guard.finish()
+    return response
 
 # ------------------------------------------------------------------------
 # ROUTES
@@ -125,19 +632,20 @@ def index():
     """
     Landing page
     """
-    return render_template("index.html")
+    return PAGES.render("index.html")
 
 @app.route("/resource-finder", methods=['GET', 'POST'])
 def resource_finder():
     """
     Resource Finder tool for wildfire relief resources in Los Angeles
     """
-    form = OpenAIKeyForm()
-
     if request.method == 'GET':
-        return render_template("resource_finder.html", form=form)
+        # The form is only built if the page is not cached yet
+        return PAGES.render("resource_finder.html", form=OpenAIKeyForm)
+
+    form = OpenAIKeyForm()
 
-    if form.validate_on_submit():
+    if validate_form(form):
         user_message = request.form.get('user_message', '').strip()
         if not user_message:
             return jsonify({"error": "Please enter a question"}), 400
@@ -150,25 +658,29 @@ def resource_finder():
                 if not api_key:
                     return jsonify({"error": "No API key provided. Please enter your OpenAI API key."}), 400
             
-            client = OpenAI(api_key=api_key)
-
-            # Make API call using new client format
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": RESOURCE_FINDER_PROMPT},
-                    {"role": "user", "content": user_message}
-                ],
-                temperature=0.7
-            )
-
-            # Extract and return the response
-            chatbot_answer = response.choices[0].message.content
-            return jsonify({"answer": chatbot_answer})
+            prompt_version = PROMPTS.get('resource_finder').version
+            if SIMILAR_ANSWERS:
+                match = SIMILAR_ANSWERS.lookup(user_message, prompt_version)
+                if match:
+                    similar_question, answer, similarity = match
+                    # The matched question is another user's and stays in the server logs
+                    log_payload(logger, f"Similar answer hit ({similarity}) for question", similar_question)
+                    meta = {"cached": True, "similarity": similarity}
+                    if wants_stream():
+                        return stream_answer(answer, meta)
+                    return jsonify({"answer": answer, **meta})
+
+            def on_answer(answer):
+                if SIMILAR_ANSWERS:
+                    SIMILAR_ANSWERS.add(user_message, answer, prompt_version)
+
+            completion_args, meta = build_resource_finder(user_message)
+            return complete_chat('resource_finder', api_key, completion_args, meta=meta, cacheable=True,
+                                 on_answer=on_answer)
 
         except Exception as e:
             app.logger.error(f"OpenAI API Error: {str(e)}")
-            return jsonify({"error": str(e)}), 500
+            return upstream_error_response(e)
 
     return render_template("resource_finder.html", form=form)
 
@@ -177,96 +689,63 @@ def rejection_simulation():
     """
     Rejection Simulation tool for insurance, FEMA, or grant applications
     """
-    form = RejectionSimulationForm()
-
     if request.method == 'GET':
-        return render_template("rejection_simulation.html", form=form)
+        # The form is only built if the page is not cached yet
+        return PAGES.render("rejection_simulation.html", form=RejectionSimulationForm, job_mode=REJECTION_JOBS)
+
+    form = RejectionSimulationForm()
 
-    if form.validate_on_submit():
+    if validate_form(form):
         user_message = form.user_message.data.strip()
         if not user_message:
             return jsonify({"error": "Please describe your situation"}), 400
 
         # Process uploaded files
         uploaded_files = request.files.getlist('documents')
-        documents_context = []
 
         logger.debug(f"Received {len(uploaded_files)} files")
 
         if len(uploaded_files) > 5:
             return jsonify({"error": "Maximum 5 files allowed."}), 400
 
-        # Process each uploaded file
-        for pdf_file in uploaded_files:
-            if pdf_file and pdf_file.filename:
-                logger.debug(f"Processing file: {pdf_file.filename}")
-
-                if not allowed_file(pdf_file.filename):
-                    return jsonify({"error": f"Invalid file type: {pdf_file.filename}. Only PDF files are allowed."}), 400
-
-                success, result = extract_and_clean_pdf_text(pdf_file)
-                if success:
-                    logger.debug(f"Successfully extracted text from {pdf_file.filename}, length: {len(result)}")
-                    logger.debug(f"First 500 characters of extracted text: {result[:500]}")
-                    documents_context.append({
-                        "filename": pdf_file.filename,
-                        "content": result
-                    })
-                else:
-                    logger.error(f"Failed to extract text: {result}")
-                    return jsonify({"error": result}), 400
-
-        # Construct a detailed prompt that clearly separates the application details and documents
-        full_message = f"""Application Details:
-{user_message}
+        # Validate every file before extracting any of them
+        pdf_files = [pdf_file for pdf_file in uploaded_files if pdf_file and pdf_file.filename]
+        for pdf_file in pdf_files:
+            if not allowed_file(pdf_file.filename):
+                return jsonify({"error": f"Invalid file type: {pdf_file.filename}. Only PDF files are allowed."}), 400
 
-"""
-        if documents_context:
-            full_message += "Submitted Documents:\n"
-            for doc in documents_context:
-                logger.debug(f"Adding document to prompt: {doc['filename']}, content length: {len(doc['content'])}")
-                full_message += f"\n--- Document: {doc['filename']} ---\n{doc['content']}\n"
-        else:
-            full_message += "\nNote: No supporting documents were provided with this application."
-
-        # Log the complete payload being sent to OpenAI
-        openai_payload = {
-            "model": "gpt-4o",
-            "messages": [
-                {"role": "system", "content": REJECTION_SIMULATION_PROMPT},
-                {"role": "user", "content": full_message}
-            ],
-            "temperature": 0.7
-        }
-        logger.debug("Complete OpenAI payload:")
-        logger.debug(json.dumps(openai_payload, indent=2))
+        # Get API key from form or system, with proper error handling
+        api_key = form.openai_key.data
+        if not api_key:
+            api_key = os.getenv('OPENAI_API_KEY')
+            if not api_key:
+                return jsonify({"error": "No API key provided. Please enter your OpenAI API key."}), 400
+
+        files = read_uploads(pdf_files, 'rejection_simulation')
+
+        if REJECTION_JOBS and request.form.get('job', '').lower() in ('1', 'true', 'yes'):
+            # Run extraction and the completion in the background; the client polls /jobs/<id>
+            try:
+                job_id = JOBS.submit('rejection_simulation', run_rejection_simulation_job, user_message, files, api_key)
+            except QueueFull:
+                logger.warning("Rejection simulation job queue is full")
+                response = jsonify({"error": "The simulator is busy right now. Please try again in a minute."})
+                response.headers['Retry-After'] = str(JOB_RETRY_AFTER)
+                return response, 503
+            return jsonify({"job_id": job_id, "status_url": url_for('job_status', job_id=job_id)}), 202
+
+        openai_payload, meta, error = build_rejection_simulation(user_message, files)
+        if error:
+            return jsonify({"error": error}), 400
+        if files:
+            meta = {**(meta or {}), "upload": request.upload_guard.stats()}
 
         try:
-            # Get API key from form or system, with proper error handling
-            api_key = form.openai_key.data
-            if not api_key:
-                api_key = os.getenv('OPENAI_API_KEY')
-                if not api_key:
-                    return jsonify({"error": "No API key provided. Please enter your OpenAI API key."}), 400
-            
-            client = OpenAI(api_key=api_key)
-
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": REJECTION_SIMULATION_PROMPT},
-                    {"role": "user", "content": full_message}
-                ],
-                temperature=0.7
-            )
-            simulation_result = response.choices[0].message.content
-            logger.debug("Received OpenAI response:")
-            logger.debug(simulation_result)
-            return jsonify({"answer": simulation_result})
+            return complete_chat('rejection_simulation', api_key, openai_payload, meta=meta, cacheable=True)
 
         except Exception as e:
             logger.error(f"OpenAI API Error: {str(e)}")
-            return jsonify({"error": str(e)}), 500
+            return upstream_error_response(e)
 
     # If form validation failed
     return jsonify({"error": "Invalid form submission"}), 400
@@ -277,21 +756,22 @@ def legal():
     """
     Combined Terms of Use and Privacy Policy page
     """
-    return render_template("legal.html")
+    return PAGES.render("legal.html")
 
 @app.route("/toxicity-assessment", methods=['GET', 'POST'])
 def toxicity_assessment():
     """
     Toxicity Assessment tool for evaluating environmental exposure risks
     """
-    form = OpenAIKeyForm()
-
     if request.method == 'GET':
-        return render_template("toxicity_assessment.html", form=form)
+        # The form is only built if the page is not cached yet
+        return PAGES.render("toxicity_assessment.html", form=OpenAIKeyForm)
 
-    if form.validate_on_submit():
+    form = OpenAIKeyForm()
+
+    if validate_form(form):
         user_message = request.form.get('user_message', '').strip()
-        message_history = request.form.get('message_history', '[]')
+        message_history = request.form.get('message_history')
         
         if not user_message:
             return jsonify({"error": "Please enter your response"}), 400
@@ -303,35 +783,23 @@ def toxicity_assessment():
                 api_key = os.getenv('OPENAI_API_KEY')
                 if not api_key:
                     return jsonify({"error": "No API key provided. Please enter your OpenAI API key."}), 400
-            
-            client = OpenAI(api_key=api_key)
 
-            # Parse message history
+            if message_history is None:
+                return converse('toxicity_assessment', api_key, user_message)
+
+            # Legacy clients send the full transcript on every turn
             message_history = json.loads(message_history)
             
-            # Construct messages array with system prompt and history
-            messages = [
-                {"role": "system", "content": TOXICITY_ASSESSMENT_PROMPT}
-            ]
-            messages.extend(message_history)
-
-            # Make API call using new client format
-            response = client.chat.completions.create(
-                model="gpt-4",
-                messages=messages,
-                temperature=0.7
-            )
-
-            # Extract and return the response
-            chatbot_answer = response.choices[0].message.content
-            return jsonify({"answer": chatbot_answer})
+            completion_args = build_interview('toxicity_assessment', message_history)
+            # Only the opening turn of an interview is the same across users
+            return complete_chat('toxicity_assessment', api_key, completion_args, cacheable=len(message_history) == 1)
 
         except json.JSONDecodeError:
             app.logger.error("Failed to parse message history")
             return jsonify({"error": "Invalid message history format"}), 400
         except Exception as e:
             app.logger.error(f"OpenAI API Error: {str(e)}")
-            return jsonify({"error": str(e)}), 500
+            return upstream_error_response(e)
 
     return render_template("toxicity_assessment.html", form=form)
 
@@ -340,14 +808,15 @@ def recovery_capital():
     """
     Recovery Capital tool for finding disaster recovery funding sources
     """
-    form = OpenAIKeyForm()
-
     if request.method == 'GET':
-        return render_template("recovery_capital.html", form=form)
+        # The form is only built if the page is not cached yet
+        return PAGES.render("recovery_capital.html", form=OpenAIKeyForm)
 
-    if form.validate_on_submit():
+    form = OpenAIKeyForm()
+
+    if validate_form(form):
         user_message = request.form.get('user_message', '').strip()
-        message_history = request.form.get('message_history', '[]')
+        message_history = request.form.get('message_history')
         
         if not user_message:
             return jsonify({"error": "Please enter your response"}), 400
@@ -359,40 +828,224 @@ def recovery_capital():
                 api_key = os.getenv('OPENAI_API_KEY')
                 if not api_key:
                     return jsonify({"error": "No API key provided. Please enter your OpenAI API key."}), 400
-            
-            client = OpenAI(api_key=api_key)
 
-            # Parse message history
+            if message_history is None:
+                return converse('recovery_capital', api_key, user_message)
+
+            # Legacy clients send the full transcript on every turn
             message_history = json.loads(message_history)
             
-            # Construct messages array with system prompt and history
-            messages = [
-                {"role": "system", "content": RECOVERY_CAPITAL_PROMPT}
-            ]
-            messages.extend(message_history)
-
-            # Make API call using new client format
-            response = client.chat.completions.create(
-                model="gpt-4",
-                messages=messages,
-                temperature=0.7
-            )
-
-            # Extract and return the response
-            chatbot_answer = response.choices[0].message.content
-            return jsonify({"answer": chatbot_answer})
+            completion_args = build_interview('recovery_capital', message_history)
+            # Only the opening turn of an interview is the same across users
+            return complete_chat('recovery_capital', api_key, completion_args, cacheable=len(message_history) == 1)
 
         except json.JSONDecodeError:
             app.logger.error("Failed to parse message history")
             return jsonify({"error": "Invalid message history format"}), 400
         except Exception as e:
             app.logger.error(f"OpenAI API Error: {str(e)}")
-            return jsonify({"error": str(e)}), 500
+            return upstream_error_response(e)
 
     return render_template("recovery_capital.html", form=form)
 
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    """
+    Status of a background job; the answer and stats once it is done
+    """
+    job = JOBS.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+    body = {"job_id": job["id"], "status": job["status"], "timings": job["timings"]}
+    if job["status"] == "done":
+        body.update(job["result"])
+    elif job["status"] == "error":
+        body["error"] = job["error"]
+    else:
+        body["poll_after"] = JOB_POLL_SECONDS
+    return jsonify(body)
+
+@app.route("/jobs/<job_id>/events")
+def job_events(job_id):
+    """
+    Subscribe to a background job: status events, then the answer in the same
+    SSE framing as a streamed completion
+    """
+    if JOBS.get(job_id) is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+
+    def generate():
+        status = None
+        while True:
+            job = JOBS.get(job_id)
+            if job is None:
+                yield sse_event({"error": "Unknown or expired job"}, event="error")
+                return
+            if job["status"] != status:
+                status = job["status"]
+                yield sse_event({"status": status}, event="status")
+            if status == "done":
+                result = dict(job["result"])
+                yield sse_event({"token": result.pop("answer")})
+                yield sse_event({**result, "timings": job["timings"]}, event="done")
+                return
+            if status == "error":
+                yield sse_event({"error": job["error"]}, event="error")
+                return
+            time.sleep(JOB_POLL_SECONDS)
+
+    return sse_response(generate())
+
+def bearer_token():
+    """The OpenAI key sent as an Authorization: Bearer header, or None."""
+    return request.headers.get('Authorization', '').removeprefix('Bearer ').strip() or None
+
+@app.route("/batch", methods=['POST'])
+@csrf.exempt
+def batch():
+    """
+    Run many tool requests at once for caseworkers; results stream back as
+    NDJSON as they finish, or go to the OpenAI Batch API (see batch.py).
+    Exempt from CSRF for scripts, so the caller's own OpenAI key is required.
+    """
+    if request.is_json:
+        payload, files = request.get_json(silent=True), {}
+    else:
+        try:
+            payload, files = json.loads(request.form.get('payload', '')), request.files
+        except json.JSONDecodeError:
+            return jsonify({"error": "Send the batch as JSON, or as a multipart form with a JSON \"payload\" field."}), 400
+
+    # Never the server's key: anyone, from any site, can post here
+    api_key = (payload.get('openai_key') if isinstance(payload, dict) else None) or bearer_token()
+    if not api_key:
+        return jsonify({"error": "No API key provided. Please include your OpenAI API key."}), 400
+    if not isinstance(api_key, str):
+        return jsonify({"error": "openai_key must be a string."}), 400
+
+    try:
+        items = parse_items(payload, files, request.upload_guard)
+    except BatchError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if payload.get('mode') == 'openai_batch':
+        try:
+            batch_requests = []
+            for item in items:
+                completion_args, _, _ = build_batch_item(item)
+                batch_requests.append((item["id"], completion_args))
+            openai_batch = submit_openai_batch(get_client(api_key), batch_requests)
+        except BatchError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            logger.error(f"OpenAI Batch API Error: {str(e)}")
+            return upstream_error_response(e)
+        return jsonify({
+            "batch_id": openai_batch.id,
+            "status": openai_batch.status,
+            "status_url": url_for('batch_status', batch_id=openai_batch.id)
+        }), 202
+
+    results = run_concurrently(items, lambda item: run_batch_item(item, api_key))
+    return Response(
+        stream_with_context(to_ndjson(results)),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route("/batch/<batch_id>")
+def batch_status(batch_id):
+    """
+    Status of an OpenAI Batch API run; its results as NDJSON once complete.
+    Pass the OpenAI key the batch was submitted with as an Authorization: Bearer header.
+    """
+    api_key = bearer_token()
+    if not api_key:
+        return jsonify({"error": "No API key provided. Please include your OpenAI API key."}), 400
+    try:
+        openai_batch, results = openai_batch_results(get_client(api_key), batch_id)
+    except openai.NotFoundError:
+        return jsonify({"error": "Unknown batch"}), 404
+    except Exception as e:
+        logger.error(f"OpenAI Batch API Error: {str(e)}")
+        return upstream_error_response(e)
+    if results is None:
+        counts = openai_batch.request_counts
+        return jsonify({
+            "batch_id": openai_batch.id,
+            "status": openai_batch.status,
+            "completed": counts.completed if counts else 0,
+            "total": counts.total if counts else None
+        })
+    return Response(to_ndjson(results), mimetype='application/x-ndjson')
+
+@app.route("/admission-stats")
+def admission_stats():
+    """
+    Current upstream concurrency limit, calls in flight and requests waiting in this worker
+    """
+    return jsonify(ADMISSION.stats())
+
+@app.route("/prompt-stats")
+def prompt_stats():
+    """
+    Version, size in tokens and reload count of the loaded system prompts
+    """
+    return jsonify(PROMPTS.stats())
+
+@app.route("/model-stats")
+def model_stats():
+    """
+    Latency, error rate, tokens and estimated cost per route and model in this worker
+    """
+    return jsonify(MODEL_ROUTER.stats())
+
+@app.route("/metrics")
+def metrics():
+    """
+    Request, stage, upstream and token metrics in the Prometheus text format
+    """
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route("/cache-stats")
+def cache_stats():
+    """
+    Completion cache, similar answer and page cache counters for this worker
+    """
+    stats = COMPLETION_CACHE.stats()
+    stats["similar_answers"] = SIMILAR_ANSWERS.stats() if SIMILAR_ANSWERS else None
+    stats["pages"] = PAGES.stats()
+    return jsonify(stats)
+
+@app.route("/healthz")
+def healthz():
+    """
+    Liveness check with this worker's startup timings
+    """
+    return jsonify({"status": "ok", "pid": os.getpid(), "startup": STARTUP})
+
+# ------------------------------------------------------------------------
+# STARTUP
+# ------------------------------------------------------------------------
+# Filled in by warm_up() and the gunicorn hooks in gunicorn.conf.py
+STARTUP = {"preloaded": False, "warm_up_seconds": None, "worker_boot_seconds": None}
+
+def warm_up():
+    """
+    Build the read-only state that would otherwise be built by the first
+    requests: every template is compiled now (prompts, the catalog index and
+    token encodings are already loaded at import). gunicorn.conf.py calls this
+    in the master before forking when the app is preloaded, so the workers
+    share it copy-on-write.
+    """
+    started = time.perf_counter()
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
+    STARTUP["warm_up_seconds"] = round(time.perf_counter() - started, 4)
+
 # ------------------------------------------------------------------------
 # RUN THE APP
 # ------------------------------------------------------------------------
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8080)
\ No newline at end of file
+    # Development server only; production runs python serve.py (gunicorn)
+    app.run(host='0.0.0.0', port=int(os.getenv('PORT', '5000')))
\ No newline at end of file
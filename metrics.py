@@ -0,0 +1,285 @@
+#metrics
+"""
+Lightweight request metrics exported in the Prometheus text format.
+
+Counters and histograms are kept in process memory; an observation is a dict
+lookup, a bisect and an increment under a lock, cheap enough to leave on in
+production. Under gunicorn every worker has its own registry, so when
+METRICS_DIR is set each worker also writes a snapshot there every
+METRICS_FLUSH_SECONDS and /metrics serves the sum over all workers.
+
+Set METRICS=off to disable collection.
+"""
+import os
+import json
+import time
+import bisect
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv('METRICS', 'on').lower() != 'off'
+METRICS_DIR = os.getenv('METRICS_DIR')
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', '5'))
+
+# Seconds; covers sub-millisecond stages up to slow upstream completions
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Counter:
+    """A monotonically increasing count per label set."""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return {"\x1f".join(key): value for key, value in self._values.items()}
+
+    @staticmethod
+    def merge(total, snapshot):
+        for key, value in snapshot.items():
+            total[key] = total.get(key, 0) + value
+
+    def render(self, snapshot):
+        lines = []
+        for key, value in sorted(snapshot.items()):
+            values = key.split("\x1f") if self.labelnames else ()
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Bucketed observations with a running sum and count per label set."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            return {"\x1f".join(key): list(counts) for key, counts in self._values.items()}
+
+    @staticmethod
+    def merge(total, snapshot):
+        for key, counts in snapshot.items():
+            if key in total:
+                total[key] = [a + b for a, b in zip(total[key], counts)]
+            else:
+                total[key] = list(counts)
+
+    def render(self, snapshot):
+        lines = []
+        for key, counts in sorted(snapshot.items()):
+            values = key.split("\x1f") if self.labelnames else ()
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """The metrics of one process, with optional snapshots shared across workers."""
+
+    def __init__(self, directory=None, flush_seconds=METRICS_FLUSH_SECONDS):
+        self.metrics = []
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self._flusher_pid = None
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self):
+        return {metric.name: metric.snapshot() for metric in self.metrics}
+
+    def write_snapshot(self):
+        """Write this worker's snapshot to METRICS_DIR/<pid>.json."""
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.error(f"Metrics snapshot write error: {str(e)}")
+
+    def start_flusher(self):
+        """Start the snapshot thread for this worker (once per process, after fork)."""
+        if not self.directory:
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+
+        def flush():
+            while True:
+                time.sleep(self.flush_seconds)
+                self.write_snapshot()
+
+        threading.Thread(target=flush, daemon=True).start()
+
+    def collect(self):
+        """Snapshot of this process, or the sum over every worker's snapshot file."""
+        if not self.directory:
+            return self.snapshot()
+        self.write_snapshot()
+        totals = {metric.name: {} for metric in self.metrics}
+        # Files of exited workers are kept, so totals never go backwards
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                with open(entry.path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for metric in self.metrics:
+                metric.merge(totals[metric.name], snapshot.get(metric.name, {}))
+        return totals
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        collected = self.collect()
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render(collected.get(metric.name, {})))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry(METRICS_DIR)
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "supplydrop_request_seconds", "Time to produce the response, by route, method and status.",
+    ("route", "method", "status"))
+STAGE_SECONDS = REGISTRY.histogram(
+    "supplydrop_stage_seconds", "Time spent in each stage of handling a request.", ("route", "stage"))
+PDF_PAGE_SECONDS = REGISTRY.histogram(
+    "supplydrop_pdf_page_seconds", "Time to extract and to sanitize one PDF page.", ("stage",))
+UPSTREAM_SECONDS = REGISTRY.histogram(
+    "supplydrop_upstream_seconds", "OpenAI time to first token and total completion time.",
+    ("route", "model", "phase"))
+PROMPT_TOKENS = REGISTRY.histogram(
+    "supplydrop_prompt_tokens", "Tokens in the prompt sent upstream.", ("route",), TOKEN_BUCKETS)
+TOKENS_TOTAL = REGISTRY.counter(
+    "supplydrop_tokens_total", "Prompt and completion tokens sent and received.", ("route", "kind"))
+UPSTREAM_ERRORS = REGISTRY.counter(
+    "supplydrop_upstream_errors_total", "Failed OpenAI calls.", ("route",))
+JOB_SECONDS = REGISTRY.histogram(
+    "supplydrop_job_seconds", "Background job time queued, running and in total.", ("kind", "phase"))
+JOBS_TOTAL = REGISTRY.counter(
+    "supplydrop_jobs_total", "Background jobs by outcome, including those rejected when the queue was full.",
+    ("kind", "status"))
+COALESCED_TOTAL = REGISTRY.counter(
+    "supplydrop_coalesced_requests_total",
+    "Completion requests that led an upstream call or followed an identical in-flight one; "
+    "the coalescing ratio is follower / (leader + follower). shared_follower counts leaders that "
+    "followed another worker instead of calling upstream.", ("route", "role"))
+ADMISSION_TOTAL = REGISTRY.counter(
+    "supplydrop_admission_total",
+    "Upstream call admissions: admitted at once, queued first, shed when saturated or timed out waiting.",
+    ("route", "outcome"))
+ADMISSION_WAIT_SECONDS = REGISTRY.histogram(
+    "supplydrop_admission_wait_seconds", "Time spent waiting for an upstream call permit.", ("route",))
+UPSTREAM_RETRIES = REGISTRY.counter(
+    "supplydrop_upstream_retries_total", "OpenAI calls retried after a retryable failure.", ("reason",))
+MODEL_SELECTED = REGISTRY.counter(
+    "supplydrop_model_selected_total", "Models chosen for completions, by the route policy or because the "
+    "policy's model was degraded.", ("route", "model", "reason"))
+MODEL_FALLBACKS = REGISTRY.counter(
+    "supplydrop_model_fallbacks_total", "Completions moved from one model to the next in the fallback chain.",
+    ("route", "from_model", "to_model", "reason"))
+UPLOAD_BYTES = REGISTRY.histogram(
+    "supplydrop_upload_bytes", "Uploaded file bytes buffered in memory per request.", ("route",),
+    (64 * 1024, 256 * 1024, 1024 ** 2, 4 * 1024 ** 2, 8 * 1024 ** 2, 16 * 1024 ** 2, 32 * 1024 ** 2))
+UPLOAD_REJECTIONS = REGISTRY.counter(
+    "supplydrop_upload_rejections_total", "Uploads rejected while streaming, by the limit they broke.",
+    ("route", "reason"))
+SIMILAR_ANSWERS_TOTAL = REGISTRY.counter(
+    "supplydrop_similar_answers_total", "Questions answered from a similar earlier question (hit) or not (miss).",
+    ("route", "outcome"))
+LOG_RECORDS_DROPPED = REGISTRY.counter(
+    "supplydrop_log_records_dropped_total", "Log records dropped because the logging queue was full.", ("level",))
+PAGE_RESPONSES = REGISTRY.counter(
+    "supplydrop_page_responses_total", "GET pages rendered, served from the page cache or answered 304.",
+    ("route", "outcome"))
@@ -0,0 +1,261 @@
+#model_router
+"""
+Per-route model selection with latency- and error-aware fallback.
+
+Each route has a policy: an ordered list of rules, the cheapest model first,
+and a fallback chain. choose() picks the first rule whose limits (prompt
+tokens, conversation turn) fit the request, then skips to the next model in
+the fallback chain while the chosen one is degraded in this worker: its error
+rate or its average time to first token on the route is over the policy's
+thresholds (max_latency, in seconds). The total time is not used, since a
+long answer that streams normally takes long by design. For complete
+(non-streamed) answers the time to first token is estimated as the total time
+less MODEL_SECONDS_PER_TOKEN per completion token. A degraded model is
+retried every MODEL_PROBE_SECONDS so it can recover.
+call() also falls back at request time when OpenAI reports the model as
+unavailable, overloaded or unreachable.
+
+Every call's latency, time to first token, tokens and estimated cost are
+recorded per route and model; /model-stats shows them so the policy can be
+tuned from data.
+
+Policies default to DEFAULT_POLICIES; set MODEL_ROUTES_PATH to a JSON file
+with the same shape to override some or all routes. Prices, in USD per
+million tokens, can be set the same way under "prices".
+"""
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+
+import openai
+
+from tokens import count_message_tokens
+from metrics import MODEL_SELECTED, MODEL_FALLBACKS
+
+logger = logging.getLogger(__name__)
+
+MODEL_ERROR_THRESHOLD = float(os.getenv('MODEL_ERROR_THRESHOLD', '0.5'))
+MODEL_MIN_SAMPLES = int(os.getenv('MODEL_MIN_SAMPLES', '5'))
+MODEL_PROBE_SECONDS = float(os.getenv('MODEL_PROBE_SECONDS', '30'))
+MODEL_SECONDS_PER_TOKEN = float(os.getenv('MODEL_SECONDS_PER_TOKEN', '0.05'))
+
+# Failures that another model may not share
+FALLBACK_ERRORS = (
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    openai.RateLimitError,
+    openai.NotFoundError,
+    openai.PermissionDeniedError,
+)
+
+DEFAULT_POLICIES = {
+    # Short factual lookups go to the small model; long prompts to gpt-4o
+    "resource_finder": {
+        "rules": [
+            {"model": "gpt-4o-mini", "max_prompt_tokens": 8000},
+            {"model": "gpt-4o"},
+        ],
+        "fallbacks": ["gpt-4o", "gpt-4o-mini"],
+        "max_latency": 10,
+    },
+    # Document-heavy simulations need the larger model
+    "rejection_simulation": {
+        "rules": [{"model": "gpt-4o"}],
+        "fallbacks": ["gpt-4o-mini"],
+        "max_latency": 30,
+    },
+    "toxicity_assessment": {
+        "rules": [{"model": "gpt-4"}],
+        "fallbacks": ["gpt-4o"],
+        "max_latency": 15,
+    },
+    "recovery_capital": {
+        "rules": [{"model": "gpt-4"}],
+        "fallbacks": ["gpt-4o"],
+        "max_latency": 15,
+    },
+}
+
+# USD per million prompt / completion tokens, for cost estimates
+DEFAULT_PRICES = {
+    "gpt-4o": [2.50, 10.00],
+    "gpt-4o-mini": [0.15, 0.60],
+    "gpt-4": [30.00, 60.00],
+}
+
+
+class ModelStats:
+    """Moving averages and totals for one model on one route."""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latency = None  # moving average, seconds
+        self.ttft = None
+        # Moving average of the time until the model started answering: the
+        # measured ttft for streams, estimated from the total for complete answers
+        self.start_latency = None
+        self.error_rate = 0.0  # moving average over recent calls
+        self.recent = deque(maxlen=200)
+        self.probe_at = 0.0
+
+    def record(self, seconds=None, ttft=None, prompt_tokens=0, completion_tokens=0, error=False):
+        self.requests += 1
+        self.error_rate = 0.8 * self.error_rate + (0.2 if error else 0.0)
+        if error:
+            self.errors += 1
+            return
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        if seconds is not None:
+            self.latency = seconds if self.latency is None else 0.8 * self.latency + 0.2 * seconds
+            self.recent.append(seconds)
+        if ttft is not None:
+            self.ttft = ttft if self.ttft is None else 0.8 * self.ttft + 0.2 * ttft
+            start = ttft
+        elif seconds is not None:
+            start = max(0.0, seconds - completion_tokens * MODEL_SECONDS_PER_TOKEN)
+        else:
+            return
+        self.start_latency = start if self.start_latency is None else 0.8 * self.start_latency + 0.2 * start
+
+    def degraded(self, max_latency):
+        if self.requests < MODEL_MIN_SAMPLES:
+            return False
+        if self.error_rate > MODEL_ERROR_THRESHOLD:
+            return True
+        return bool(max_latency) and self.start_latency is not None and self.start_latency > max_latency
+
+    def to_dict(self, prices):
+        recent = sorted(self.recent)
+        prompt_price, completion_price = prices or (0.0, 0.0)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_rate": round(self.error_rate, 3),
+            "latency_seconds": round(self.latency, 3) if self.latency is not None else None,
+            "ttft_seconds": round(self.ttft, 3) if self.ttft is not None else None,
+            "start_latency_seconds": round(self.start_latency, 3) if self.start_latency is not None else None,
+            "p50_seconds": round(recent[len(recent) // 2], 3) if recent else None,
+            "p95_seconds": round(recent[min(len(recent) - 1, int(len(recent) * 0.95))], 3) if recent else None,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "estimated_cost_usd": round(
+                (self.prompt_tokens * prompt_price + self.completion_tokens * completion_price) / 1e6, 4),
+        }
+
+
+class ModelRouter:
+    """Chooses the model for each completion from its route's policy and recent model health."""
+
+    def __init__(self, policies, prices=None):
+        self.policies = policies
+        self.prices = prices or {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _policy(self, route):
+        return self.policies.get(route, {})
+
+    def _get_stats(self, route, model):
+        stats = self._stats.get((route, model))
+        if stats is None:
+            stats = self._stats[(route, model)] = ModelStats()
+        return stats
+
+    def _available(self, route, model):
+        """False while model is degraded on route, except for one probe call every MODEL_PROBE_SECONDS."""
+        with self._lock:
+            stats = self._get_stats(route, model)
+            if not stats.degraded(self._policy(route).get("max_latency")):
+                return True
+            now = time.monotonic()
+            if now >= stats.probe_at:
+                stats.probe_at = now + MODEL_PROBE_SECONDS
+                return True
+            return False
+
+    def chain(self, route, model):
+        """model followed by the route's other fallback models."""
+        return [model] + [m for m in self._policy(route).get("fallbacks", []) if m != model]
+
+    def choose(self, route, messages, default="gpt-4o"):
+        """Pick the model for a completion of messages on route."""
+        policy = self._policy(route)
+        prompt_tokens = count_message_tokens(messages)
+        turn = sum(1 for m in messages if m.get("role") == "user")
+
+        model = default
+        for rule in policy.get("rules", []):
+            if rule.get("max_prompt_tokens") and prompt_tokens > rule["max_prompt_tokens"]:
+                continue
+            if rule.get("max_turn") and turn > rule["max_turn"]:
+                continue
+            model = rule["model"]
+            break
+
+        chosen = next((m for m in self.chain(route, model) if self._available(route, m)), model)
+        reason = 'policy' if chosen == model else 'degraded'
+        if chosen != model:
+            logger.warning(f"Model {model} is degraded on {route}, using {chosen}")
+            MODEL_FALLBACKS.inc(route=route, from_model=model, to_model=chosen, reason=reason)
+        MODEL_SELECTED.inc(route=route, model=chosen, reason=reason)
+        return chosen
+
+    def call(self, route, completion_args, create):
+        """
+        Run create(args) with completion_args, moving down the fallback chain
+        when a model fails with one of FALLBACK_ERRORS. Returns (model, result,
+        started), started being the perf_counter time of the successful attempt
+        so failed attempts on other models are not counted in its latency.
+        Other errors (a bad API key, an invalid request) are raised as they are.
+        """
+        model = completion_args["model"]
+        fallbacks = iter(self.chain(route, model)[1:])
+        while True:
+            started = time.perf_counter()
+            try:
+                return model, create(dict(completion_args, model=model)), started
+            except FALLBACK_ERRORS as e:
+                self.record(route, model, error=True)
+                # Only fall back to models that are not degraded themselves
+                next_model = next((m for m in fallbacks if self._available(route, m)), None)
+                if next_model is None:
+                    raise
+                logger.warning(f"Model {model} failed on {route} ({type(e).__name__}), falling back to {next_model}")
+                MODEL_FALLBACKS.inc(route=route, from_model=model, to_model=next_model, reason='error')
+                model = next_model
+
+    def record(self, route, model, seconds=None, ttft=None, prompt_tokens=0, completion_tokens=0, error=False):
+        """Record the outcome of one completion by model on route."""
+        with self._lock:
+            self._get_stats(route, model).record(seconds, ttft, prompt_tokens, completion_tokens, error)
+
+    def stats(self):
+        with self._lock:
+            routes = {}
+            for (route, model), stats in sorted(self._stats.items()):
+                if stats.requests:
+                    routes.setdefault(route, {})[model] = stats.to_dict(self.prices.get(model))
+            return routes
+
+
+def model_router_from_env():
+    """Build the ModelRouter from DEFAULT_POLICIES and the optional MODEL_ROUTES_PATH file."""
+    policies = dict(DEFAULT_POLICIES)
+    prices = dict(DEFAULT_PRICES)
+    path = os.getenv('MODEL_ROUTES_PATH')
+    if path:
+        try:
+            with open(path, 'r') as f:
+                config = json.load(f)
+            prices.update(config.pop("prices", {}))
+            policies.update(config)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not load model routes from {path}, using defaults: {str(e)}")
+    return ModelRouter(policies, prices)
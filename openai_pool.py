@@ -0,0 +1,66 @@
+#openai_pool
+"""
+Pool of reusable OpenAI clients keyed by API key.
+
+Each OpenAI client owns an HTTP connection pool, so building a new client per
+request throws away keep-alive connections and TLS sessions. Clients are kept
+per API key (users bring their own keys) in a bounded LRU and shared across
+requests and threads/greenlets in the worker.
+"""
+import os
+import threading
+import logging
+from collections import OrderedDict
+
+from openai import OpenAI
+
+logger = logging.getLogger(__name__)
+
+MAX_POOLED_CLIENTS = int(os.getenv('OPENAI_POOL_SIZE', '256'))
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', '120'))
+
+
+class ClientPool:
+    """Bounded LRU of OpenAI clients, one per API key."""
+
+    def __init__(self, factory=OpenAI, max_clients=MAX_POOLED_CLIENTS):
+        self.factory = factory
+        self.max_clients = max_clients
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def get(self, api_key):
+        """Return the pooled client for api_key, creating it if needed."""
+        with self._lock:
+            client = self._clients.get(api_key)
+            if client is not None:
+                self._clients.move_to_end(api_key)
+                self.reused += 1
+                return client
+
+            # Retries are done by admission.Permit.call, so each attempt is rate limited
+            client = self.factory(api_key=api_key, timeout=OPENAI_TIMEOUT, max_retries=0)
+            self._clients[api_key] = client
+            self.created += 1
+            # Evicted clients are not closed here since another request may still
+            # be using them; their connections close when they are garbage collected.
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+            return client
+
+    def stats(self):
+        return {
+            "clients": len(self._clients),
+            "created": self.created,
+            "reused": self.reused,
+        }
+
+
+CLIENT_POOL = ClientPool()
+
+
+def get_client(api_key):
+    """Shared OpenAI client for api_key."""
+    return CLIENT_POOL.get(api_key)
@@ -0,0 +1,120 @@
+#page_cache
+"""
+Cache of the rendered GET pages (the landing page, /legal and the tool pages).
+
+Each page is rendered once per worker and kept as bytes, plus a gzip copy,
+under a strong ETag. Later requests skip Jinja entirely. A request whose
+If-None-Match still matches gets a 304. Pages are sent with
+"Cache-Control: private, no-cache", so browsers revalidate on every load
+and a new deploy is picked up at once.
+
+The cached copy is shared by every visitor, so it cannot carry anyone's
+CSRF token. The token is removed from the cached HTML, and pages with a
+form send it in the csrf_token cookie on every response instead, 304s
+included. A script in
+base.html copies it into the forms' csrf_token fields, and Flask-WTF
+checks the submitted field as before.
+
+Pages that are not rendered from a template alone skip the cache: the POST
+fallbacks and anything rendered while flashed messages are pending. With
+PAGE_CACHE=off, or when templates auto-reload (debug), every page is
+rendered on each request with the token inline as before.
+"""
+import os
+import gzip
+import hashlib
+import threading
+
+from flask import Response, current_app, g, render_template, request, session
+from flask_wtf import FlaskForm
+from flask_wtf.csrf import generate_csrf
+
+from metrics import PAGE_RESPONSES
+
+CSRF_FIELD = 'csrf_token'
+# Smaller bodies are not worth the gzip header
+GZIP_MIN_BYTES = 1024
+
+
+class Page:
+    __slots__ = ("body", "gzip_body", "etag", "has_form")
+
+    def __init__(self, body, has_form):
+        self.body = body
+        self.has_form = has_form
+        self.gzip_body = gzip.compress(body, 9) if len(body) >= GZIP_MIN_BYTES else None
+        self.etag = hashlib.sha256(body).hexdigest()[:20]
+
+
+class PageCache:
+    """Rendered pages by template and template context, for this worker."""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def _cacheable(self):
+        return (self.enabled and not current_app.jinja_env.auto_reload
+                and '_flashes' not in session)
+
+    def render(self, template, **context):
+        """
+        Respond with template rendered with context. Form classes in context
+        are instantiated (empty) only when the page is actually rendered.
+        """
+        if not self._cacheable():
+            PAGE_RESPONSES.inc(route=request.endpoint, outcome='rendered')
+            return render_template(template, **_build_forms(context))
+
+        key = (template,) + tuple(sorted(
+            (name, value) for name, value in context.items() if not _is_form_class(value)))
+        page = self._pages.get(key)
+        if page is None:
+            html = render_template(template, **_build_forms(context))
+            token = g.get(CSRF_FIELD)
+            if token:
+                html = html.replace(token, "")
+            with self._lock:
+                page = self._pages.setdefault(key, Page(html.encode("utf-8"), has_form=bool(token)))
+            outcome = 'rendered'
+        else:
+            outcome = 'cached'
+
+        use_gzip = page.gzip_body is not None and request.accept_encodings['gzip'] > 0
+        response = Response(page.gzip_body if use_gzip else page.body, mimetype='text/html')
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+        # Each encoding is a different representation and needs its own ETag
+        response.set_etag(f"{page.etag}-gzip" if use_gzip else page.etag)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        # Pages without a form need no token, and so no session
+        if page.has_form:
+            response.set_cookie(CSRF_FIELD, generate_csrf(), samesite='Lax', secure=request.is_secure)
+        response.make_conditional(request)
+        if response.status_code == 304:
+            outcome = 'not_modified'
+        PAGE_RESPONSES.inc(route=request.endpoint, outcome=outcome)
+        return response
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "pages": len(self._pages),
+            "bytes": sum(len(page.body) for page in self._pages.values()),
+        }
+
+
+def _is_form_class(value):
+    return isinstance(value, type) and issubclass(value, FlaskForm)
+
+
+def _build_forms(context):
+    return {name: value() if _is_form_class(value) else value for name, value in context.items()}
+
+
+def page_cache_from_env():
+    """Build the PageCache configured by PAGE_CACHE=on|off."""
+    return PageCache(enabled=os.getenv('PAGE_CACHE', 'on').lower() != 'off')
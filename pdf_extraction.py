@@ -0,0 +1,228 @@
+#pdf_extraction
+"""
+Parallel PDF text extraction for rejection-simulation uploads.
+
+Files, and page ranges within large files, are extracted on a process pool so
+several uploads are parsed at once and the request thread only waits for the
+slowest one. PDFs are parsed from the uploaded bytes in memory; nothing is
+written to disk. Each file has a timeout; a file that runs past it has its
+pool processes killed and the pool replaced, and files that were sharing that
+pool are submitted again. Per-file and per-page timings are returned so the
+pool can be sized from real uploads.
+
+Configure with PDF_EXTRACTION_WORKERS (pool size, 0 extracts inline on the
+request thread), PDF_FILE_TIMEOUT (seconds per file) and PDF_PAGES_PER_TASK
+(minimum pages handed to one pool task). Files over max_pages are rejected
+before any page is extracted.
+"""
+import os
+import io
+import time
+import logging
+import weakref
+import threading
+import multiprocessing
+from concurrent.futures import CancelledError, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import bleach
+from PyPDF2 import PdfReader
+
+from pdf_text_cache import pdf_digest
+
+logger = logging.getLogger(__name__)
+
+PDF_EXTRACTION_WORKERS = int(os.getenv('PDF_EXTRACTION_WORKERS', str(min(4, os.cpu_count() or 1))))
+PDF_FILE_TIMEOUT = float(os.getenv('PDF_FILE_TIMEOUT', '30'))
+PDF_PAGES_PER_TASK = int(os.getenv('PDF_PAGES_PER_TASK', '8'))
+
+# Separates the pages of the extracted text (a form feed, as pdftotext does), so
+# document packing can tell page headers and footers from other repeated lines
+PAGE_BREAK = "\f"
+
+
+def extract_page_range(data, start, stop):
+    """
+    Extract and sanitize pages [start, stop) of the PDF in data (bytes).
+    Runs in a pool process; returns a list of
+    (page_index, text, extract_seconds, sanitize_seconds).
+    """
+    reader = PdfReader(io.BytesIO(data))
+    pages = []
+    for index in range(start, stop):
+        started = time.perf_counter()
+        text = reader.pages[index].extract_text() or ""
+        extracted = time.perf_counter()
+        text = bleach.clean(text)  # sanitize text
+        pages.append((index, text, extracted - started, time.perf_counter() - extracted))
+    return pages
+
+
+class PdfExtractor:
+    """Extracts text from several PDFs at once on a bounded process pool."""
+
+    def __init__(self, max_workers=PDF_EXTRACTION_WORKERS, file_timeout=PDF_FILE_TIMEOUT,
+                 pages_per_task=PDF_PAGES_PER_TASK, cache=None, max_pages=None):
+        self.max_workers = max_workers
+        self.max_pages = max_pages
+        self.cache = cache
+        self.file_timeout = file_timeout
+        self.pages_per_task = max(1, pages_per_task)
+        self._pool = None
+        # Pools killed after a timeout, as opposed to pools whose process crashed
+        self._terminated = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        # Created lazily so each server worker process gets its own pool after fork.
+        # Pool processes come from a forkserver with this module preloaded rather
+        # than being forked from a threaded server process. Each one still imports
+        # the __main__ script as __mp_main__ before its first task, like any
+        # multiprocessing child: under python serve.py that is the small launcher,
+        # under python main.py it is the whole app. The script must therefore keep
+        # its server and any extraction behind if __name__ == '__main__'; an
+        # unguarded script runs again in every pool process, where multiprocessing
+        # refuses to start another pool and every extraction fails.
+        with self._lock:
+            if self._pool is None:
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload([__name__])
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+            return self._pool
+
+    def _reset_pool(self, pool, terminate=False):
+        """
+        Stop using pool; the next file gets a new one. With terminate, its
+        processes are killed too: cancelling a future does not stop a task that
+        is already running, so a timed out task would keep its process busy.
+        """
+        if pool is None:
+            return
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        if terminate:
+            self._terminated.add(pool)
+            for process in list((getattr(pool, '_processes', None) or {}).values()):
+                process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, data, page_count):
+        """Submit one file's page ranges; returns the pool and the list of futures."""
+        if self.max_workers <= 0:
+            return None, None
+        pool = self._get_pool()
+        # Every task gets its own copy of the bytes, so split a file into at
+        # most max_workers ranges rather than many small ones
+        pages_per_task = max(self.pages_per_task, -(-page_count // self.max_workers))
+        return pool, [
+            pool.submit(extract_page_range, data, start, min(start + pages_per_task, page_count))
+            for start in range(0, page_count, pages_per_task)
+        ]
+
+    def extract(self, files):
+        """
+        Extract text from files, a list of (filename, bytes) pairs. Returns one
+        result dict per file, in order, with either "text" or "error" set plus
+        "pages", "seconds", "page_seconds" and "sanitize_seconds" timings.
+        "cached" tells whether the text came from the extracted text cache.
+        """
+        started = time.perf_counter()
+        jobs = []
+        for filename, data in files:
+            job = {"filename": filename, "data": data, "pool": None, "futures": None, "error": None, "pages": 0}
+            if self.cache is not None:
+                job["digest"] = pdf_digest(data)
+                job["cached"] = self.cache.get(job["digest"])
+                if job["cached"] is not None:
+                    jobs.append(job)
+                    continue
+            try:
+                job["pages"] = len(PdfReader(io.BytesIO(data)).pages)
+                if self.max_pages and job["pages"] > self.max_pages:
+                    job["error"] = (f"{filename} has {job['pages']} pages; the limit is {self.max_pages}. "
+                                    f"Please upload a shorter document.")
+                else:
+                    job["pool"], job["futures"] = self._submit(data, job["pages"])
+            except BrokenProcessPool:
+                self._reset_pool(self._pool)
+                job["error"] = f"Error processing {filename}: extraction worker crashed"
+            except Exception as e:
+                logger.error(f"PDF reading error: {str(e)}")
+                job["error"] = f"Error reading PDF: {str(e)}"
+            jobs.append(job)
+
+        return [self._collect(job, started) for job in jobs]
+
+    def _wait(self, job, deadline):
+        """
+        The pages of job's futures, waiting until deadline. A file whose pool
+        was recycled because another file timed out is submitted again once.
+        """
+        # All files were submitted together, so each deadline counts from the same start
+        for attempt in range(2):
+            try:
+                pages = []
+                for future in job["futures"]:
+                    pages.extend(future.result(timeout=max(deadline - time.perf_counter(), 0)))
+                return pages
+            except (BrokenProcessPool, CancelledError):
+                if attempt or job["pool"] not in self._terminated:
+                    raise
+                if deadline <= time.perf_counter():
+                    raise FutureTimeoutError()
+                job["pool"], job["futures"] = self._submit(job["data"], job["pages"])
+
+    def _collect(self, job, started):
+        filename = job["filename"]
+        cached = job.get("cached")
+        if cached is not None:
+            return {
+                "filename": filename,
+                "pages": cached["pages"],
+                "text": cached["text"],
+                "seconds": round(time.perf_counter() - started, 4),
+                "page_seconds": [],
+                "sanitize_seconds": [],
+                "cached": True,
+            }
+
+        result = {"filename": filename, "pages": job["pages"], "cached": False}
+        if job["error"]:
+            result["error"] = job["error"]
+            return result
+
+        try:
+            if job["futures"] is None:
+                pages = extract_page_range(job["data"], 0, job["pages"])
+            else:
+                pages = self._wait(job, started + self.file_timeout)
+        except FutureTimeoutError:
+            # The tasks still running would hold their pool processes and CPU
+            # until they finish; kill them and start a new pool
+            self._reset_pool(job["pool"], terminate=True)
+            logger.error(f"Timed out extracting {filename} after {self.file_timeout}s; extraction pool recycled")
+            result["error"] = f"Timed out reading {filename}. Please upload a smaller document."
+            return result
+        except (BrokenProcessPool, CancelledError):
+            self._reset_pool(job["pool"])
+            result["error"] = f"Error processing {filename}: extraction worker crashed"
+            return result
+        except Exception as e:
+            logger.error(f"PDF reading error: {str(e)}")
+            result["error"] = f"Error reading PDF: {str(e)}"
+            return result
+
+        pages.sort(key=lambda page: page[0])
+        text = f"\n{PAGE_BREAK}".join(page[1] for page in pages).strip()
+        result["seconds"] = round(time.perf_counter() - started, 4)
+        result["page_seconds"] = [round(page[2], 4) for page in pages]
+        result["sanitize_seconds"] = [round(page[3], 4) for page in pages]
+        if not text:
+            logger.warning("Warning: Extracted text is empty")
+            result["error"] = "No text could be extracted from the PDF"
+        else:
+            result["text"] = text
+            if self.cache is not None:
+                self.cache.set(job["digest"], {"text": text, "pages": job["pages"]})
+        return result
@@ -0,0 +1,198 @@
+#pdf_text_cache
+"""
+Content-addressed cache of extracted PDF text.
+
+Entries are keyed by the SHA-256 of the PDF bytes, so the same FEMA letter or
+insurance policy uploaded again skips PdfReader and bleach entirely. The
+on-disk store is bounded by total size (least recently used files are evicted
+first) and can be fronted by a small in-memory LRU. Writes keep a running
+total of the store size; the directory is only scanned when that total
+passes the limit, or every EVICT_CHECK_SECONDS to pick up the entries other
+workers wrote, and eviction then frees enough to leave some room. Entries
+unused for longer than the TTL are never served and are deleted by the same
+scan, which also runs at startup, since they hold the text of people's
+letters.
+
+Configure with PDF_TEXT_CACHE=disk|memory|off, PDF_TEXT_CACHE_DIR,
+PDF_TEXT_CACHE_MAX_MB, PDF_TEXT_CACHE_TTL (seconds unused before an entry is
+deleted) and PDF_TEXT_CACHE_MEMORY_ENTRIES (0 disables the in-memory tier).
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Other workers write to the same directory; rescan at least this often
+EVICT_CHECK_SECONDS = 60
+# Evict down to this share of max_bytes, so a full store is not rescanned on every write
+EVICT_LOW_WATER = 0.9
+
+
+def pdf_digest(data):
+    """SHA-256 hex digest of the PDF bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class PdfTextCache:
+    """Extracted text records keyed by PDF digest, on disk and/or in memory."""
+
+    def __init__(self, directory=None, max_bytes=256 * 1024 * 1024, memory_entries=64, ttl=6 * 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        # Size of the store as of the last scan plus this process's writes since; None until scanned
+        self._disk_bytes = None
+        self._scanned = 0.0
+        self._evict_lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._evict()
+
+    def _path(self, digest):
+        return os.path.join(self.directory, digest[:2], f"{digest}.json")
+
+    def get(self, digest):
+        """Return the cached record ({"text", "pages"}) for digest, or None."""
+        now = time.time()
+        with self._lock:
+            item = self._memory.get(digest)
+            if item is not None:
+                used, record = item
+                if used + self.ttl >= now:
+                    self._memory[digest] = (now, record)
+                    self._memory.move_to_end(digest)
+                    return record
+                del self._memory[digest]
+
+        if not self.directory:
+            return None
+        path = self._path(digest)
+        try:
+            if os.path.getmtime(path) + self.ttl < now:
+                os.remove(path)
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                record = json.load(f)
+            os.utime(path)  # mark as recently used for eviction
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.error(f"PDF text cache read error for {digest}: {str(e)}")
+            return None
+
+        self._remember(digest, record)
+        return record
+
+    def set(self, digest, record):
+        """Store a record for digest in both tiers."""
+        self._remember(digest, record)
+        if not self.directory:
+            return
+        path = self._path(digest)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            data = json.dumps(record).encode('utf-8')
+            try:
+                replaced = os.path.getsize(path)
+            except FileNotFoundError:
+                replaced = 0
+            # Write to a temp file and rename so readers never see a partial entry
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+            with self._lock:
+                if self._disk_bytes is not None:
+                    self._disk_bytes += len(data) - replaced
+                due = (self._disk_bytes is None or self._disk_bytes > self.max_bytes
+                       or time.monotonic() - self._scanned > EVICT_CHECK_SECONDS)
+            if due:
+                self._evict()
+        except OSError as e:
+            logger.error(f"PDF text cache write error for {digest}: {str(e)}")
+
+    def _remember(self, digest, record):
+        if self.memory_entries <= 0:
+            return
+        with self._lock:
+            self._memory[digest] = (time.time(), record)
+            self._memory.move_to_end(digest)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _evict(self):
+        """
+        Scan the store, delete entries unused for longer than the TTL and,
+        if it is still over max_bytes, delete least recently used entries
+        until it fits in EVICT_LOW_WATER of it.
+        """
+        if not self._evict_lock.acquire(blocking=False):
+            return  # another thread is already scanning
+        try:
+            total = self._scan_and_evict()
+        finally:
+            self._evict_lock.release()
+        with self._lock:
+            self._disk_bytes = total
+            self._scanned = time.monotonic()
+
+    def _scan_and_evict(self):
+        entries = []
+        total = 0
+        expired = time.time() - self.ttl
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith('.json'):
+                    stat = entry.stat()
+                    if stat.st_mtime < expired:
+                        try:
+                            os.remove(entry.path)
+                        except FileNotFoundError:
+                            pass
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        if total <= self.max_bytes:
+            return total
+        target = self.max_bytes * EVICT_LOW_WATER
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            if total <= target:
+                break
+        return total
+
+
+def pdf_text_cache_from_env():
+    """Build the PdfTextCache configured by the PDF_TEXT_CACHE_* environment variables."""
+    kind = os.getenv('PDF_TEXT_CACHE', 'disk').lower()
+    if kind == 'off':
+        return None
+    memory_entries = int(os.getenv('PDF_TEXT_CACHE_MEMORY_ENTRIES', '64'))
+    ttl = int(os.getenv('PDF_TEXT_CACHE_TTL', str(6 * 3600)))
+    if kind == 'memory':
+        return PdfTextCache(memory_entries=memory_entries or 64, ttl=ttl)
+    return PdfTextCache(
+        directory=os.getenv('PDF_TEXT_CACHE_DIR', './pdf_text_cache'),
+        max_bytes=int(float(os.getenv('PDF_TEXT_CACHE_MAX_MB', '256')) * 1024 * 1024),
+        memory_entries=memory_entries,
+        ttl=ttl
+    )
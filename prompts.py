@@ -0,0 +1,146 @@
+#prompts
+"""
+Registry of the tools' system prompts, reloaded from their JSON files
+without a restart.
+
+Each prompt is loaded into a Prompt snapshot: its text, a short
+content hash and its token count for the models in PROMPT_MODELS, counted
+once at load so per-request token accounting of the system prompt is a
+lookup. get() re-checks the file's mtime at most every
+PROMPT_RELOAD_SECONDS and swaps the new snapshot in with a single
+assignment; requests already running keep the snapshot they started with.
+A file that fails to parse keeps the previous prompt.
+
+messages() lays out a request with the static system prompt first, as the
+exact same string on every request, followed by the per-request system
+context (retrieved entries, a conversation summary) and then the chat
+turns. OpenAI caches prompt prefixes, so keeping the large static part
+byte-identical at the front is what lets repeated requests skip its
+prefill.
+
+Set PROMPT_RELOAD_SECONDS=0 to turn off reloading.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+from tokens import pretokenize, forget_pretokenized
+
+logger = logging.getLogger(__name__)
+
+PROMPT_RELOAD_SECONDS = float(os.getenv('PROMPT_RELOAD_SECONDS', '5'))
+PROMPT_MODELS = tuple(m.strip() for m in os.getenv('PROMPT_MODELS', 'gpt-4o,gpt-4').split(',') if m.strip())
+
+
+class Prompt:
+    """One loaded version of a system prompt."""
+
+    __slots__ = ("name", "text", "version", "tokens", "mtime", "loaded_at")
+
+    def __init__(self, name, text, mtime):
+        self.name = name
+        self.text = text
+        self.version = hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+        self.tokens = pretokenize(text, PROMPT_MODELS)
+        self.mtime = mtime
+        self.loaded_at = time.time()
+
+
+class PromptRegistry:
+    """System prompts by name, each backed by a JSON file with a "system_prompt" key."""
+
+    def __init__(self, reload_seconds=PROMPT_RELOAD_SECONDS):
+        self.reload_seconds = reload_seconds
+        self._files = {}    # name -> (file_path, default_prompt)
+        self._prompts = {}  # name -> Prompt
+        self._checked = {}  # name -> monotonic time of the last mtime check
+        self.reloads = 0
+        self._lock = threading.Lock()
+
+    def register(self, name, file_path, default_prompt):
+        self._files[name] = (file_path, default_prompt)
+        self._prompts[name] = self._load(name, None)
+        self._checked[name] = time.monotonic()
+        return self._prompts[name]
+
+    def _load(self, name, previous):
+        file_path, default_prompt = self._files[name]
+        mtime = None
+        try:
+            mtime = os.stat(file_path).st_mtime
+            with open(file_path, 'r', encoding='utf-8') as f:
+                text = json.load(f).get('system_prompt', default_prompt)
+        except FileNotFoundError:
+            mtime, text = None, default_prompt
+        except (OSError, ValueError) as e:
+            if previous is None:
+                logger.error(f"Could not load prompt {file_path}, using the default: {str(e)}")
+                return Prompt(name, default_prompt, None)
+            # Keep serving the last good version; try again when the file changes next
+            logger.error(f"Could not reload prompt {file_path}, keeping version {previous.version}: {str(e)}")
+            previous.mtime = mtime
+            return previous
+        if previous is not None and previous.text == text:
+            previous.mtime = mtime
+            return previous
+        prompt = Prompt(name, text, mtime)
+        logger.info(f"Loaded prompt {name} version {prompt.version} ({prompt.tokens} tokens)")
+        return prompt
+
+    def get(self, name):
+        """The current Prompt for name, reloaded first if its file changed."""
+        prompt = self._prompts[name]
+        if self.reload_seconds <= 0:
+            return prompt
+        now = time.monotonic()
+        if now - self._checked[name] < self.reload_seconds:
+            return prompt
+        with self._lock:
+            if now - self._checked[name] < self.reload_seconds:
+                return self._prompts[name]
+            self._checked[name] = now
+            prompt = self._prompts[name]
+            file_path = self._files[name][0]
+            try:
+                mtime = os.stat(file_path).st_mtime
+            except FileNotFoundError:
+                mtime = None
+            if mtime == prompt.mtime:
+                return prompt
+            new_prompt = self._load(name, prompt)
+            if new_prompt is not prompt:
+                self._prompts[name] = new_prompt
+                self.reloads += 1
+                forget_pretokenized(prompt.text)
+            return new_prompt
+
+    def text(self, name):
+        return self.get(name).text
+
+    def messages(self, name, turns, context=()):
+        """
+        Messages for a request: the static system prompt, then each context
+        string as its own system message, then the chat turns.
+        """
+        messages = [{"role": "system", "content": self.get(name).text}]
+        messages.extend({"role": "system", "content": text} for text in context if text)
+        messages.extend(turns)
+        return messages
+
+    def stats(self):
+        return {
+            "reloads": self.reloads,
+            "prompts": {
+                name: {
+                    "version": prompt.version,
+                    "file": self._files[name][0],
+                    "chars": len(prompt.text),
+                    "tokens": prompt.tokens,
+                    "loaded_at": prompt.loaded_at,
+                }
+                for name, prompt in self._prompts.items()
+            },
+        }
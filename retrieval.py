@@ -0,0 +1,213 @@
+#retrieval
+"""
+In-memory BM25 index over the resource catalog in resource_finder_prompt.json.
+
+The prompt file holds a short instruction block followed by a large catalog of
+resources (tables, links, contact lists). Instead of sending the whole file as
+the system message on every /resource-finder call, the catalog is split into
+entries once, indexed, and only the entries relevant to the user's question are
+sent along with the instruction block. The index is rebuilt when the prompt
+registry (prompts.py) loads a new version of the JSON file.
+"""
+import re
+import math
+import threading
+import logging
+from collections import Counter, defaultdict
+
+from tokens import count_tokens, pretokenize, forget_pretokenized
+
+logger = logging.getLogger(__name__)
+
+# Everything after this marker in the system prompt is catalog data
+CATALOG_MARKER = "THINGS YOU KNOW:"
+
+RETRIEVAL_INSTRUCTION = (
+    "Below are the catalog entries most relevant to the user's question, taken from "
+    "the Topanga Mutual Aid Tracker and related resource lists. Answer using these "
+    "entries. If they do not cover the question, say so and suggest where the user "
+    "might find current information."
+)
+
+MAX_ENTRY_CHARS = 1200
+MIN_ENTRY_CHARS = 60
+
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+HEADING_RE = re.compile(r"(?<!#)(?=#{2,4} )")
+ROW_RE = re.compile(r"\s\|\s{2,}|\s{2,}(?=\[)")
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset("""
+a an and are as at be by can for from how i in is it me my of on or our the
+this to we what where which who with you your do does near need any there
+""".split())
+
+
+def tokenize(text):
+    """Lowercase word tokens with stopwords removed."""
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+def _split_long(text):
+    """Split text into pieces no longer than MAX_ENTRY_CHARS on word boundaries."""
+    pieces = []
+    while len(text) > MAX_ENTRY_CHARS:
+        cut = text.rfind(" ", 0, MAX_ENTRY_CHARS)
+        if cut <= 0:
+            cut = MAX_ENTRY_CHARS
+        pieces.append(text[:cut].strip())
+        text = text[cut:].strip()
+    if text:
+        pieces.append(text)
+    return pieces
+
+
+def _section_heading(section):
+    """Short label for a section: the markdown heading plus its all-caps title words."""
+    words = section.split(" ", 12)
+    heading = words[:3]
+    for word in words[3:12]:
+        if not word.isupper():
+            break
+        heading.append(word)
+    return " ".join(heading)
+
+
+def split_catalog(catalog):
+    """
+    Split the catalog text into entries: one per table row or link, prefixed
+    with the heading of the section it came from.
+    """
+    entries = []
+    for section in HEADING_RE.split(catalog):
+        section = section.strip()
+        if not section:
+            continue
+        heading = _section_heading(section)
+
+        rows = []
+        for row in ROW_RE.split(section):
+            row = row.strip(" |-")
+            if not row:
+                continue
+            # Glue short fragments (table separators, stray cells) to the previous row
+            if rows and len(row) < MIN_ENTRY_CHARS:
+                rows[-1] = f"{rows[-1]} | {row}"
+            else:
+                rows.append(row)
+
+        for row in rows:
+            for piece in _split_long(row):
+                if piece.startswith(heading):
+                    entries.append(piece)
+                else:
+                    entries.append(f"[{heading}] {piece}")
+    return entries
+
+
+class BM25Index:
+    """Okapi BM25 over a list of text entries."""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.postings = defaultdict(list)
+        self.doc_lengths = []
+        for doc_id, entry in enumerate(entries):
+            terms = Counter(tokenize(entry))
+            self.doc_lengths.append(sum(terms.values()))
+            for term, freq in terms.items():
+                self.postings[term].append((doc_id, freq))
+        self.avg_length = (sum(self.doc_lengths) / len(entries)) if entries else 0.0
+        n = len(entries)
+        self.idf = {
+            term: math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def scores(self, query):
+        """BM25 score of every entry matching query, as {entry_index: score}."""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, freq in self.postings[term]:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[doc_id] / self.avg_length)
+                scores[doc_id] += idf * freq * (BM25_K1 + 1) / (freq + norm)
+        return scores
+
+    def search(self, query, k=8):
+        """Return up to k (score, entry) pairs ranked by BM25 score."""
+        ranked = sorted(self.scores(query).items(), key=lambda item: item[1], reverse=True)[:k]
+        # Keep catalog order so neighbouring rows of a table read naturally
+        ranked.sort(key=lambda item: item[0])
+        return [(score, self.entries[doc_id]) for doc_id, score in ranked]
+
+
+class ResourceCatalog:
+    """
+    Retrieval index over a prompt in the PromptRegistry. Rebuilds itself when
+    the registry loads a new version of the prompt.
+    """
+
+    def __init__(self, prompts, name, default_prompt, model="gpt-4o"):
+        self.prompts = prompts
+        self.name = name
+        self.default_prompt = default_prompt
+        self.model = model
+        self._lock = threading.Lock()
+        self._prompt = None
+        self.refresh()
+
+    def _load(self, source):
+        prompt = source.text
+        base, marker, catalog = prompt.partition(CATALOG_MARKER)
+        if not marker:
+            base, catalog = self.default_prompt, prompt
+
+        entries = split_catalog(catalog)
+        self.full_prompt_tokens = count_tokens(prompt, self.model)
+        base_prompt = f"{base.strip()}\n\n{RETRIEVAL_INSTRUCTION}"
+        pretokenize(base_prompt, (self.model,))
+        if self._prompt is not None and self.base_prompt != base_prompt:
+            forget_pretokenized(self.base_prompt)
+        self.base_prompt = base_prompt
+        self.index = BM25Index(entries)
+        self._prompt = source
+        logger.info(f"Indexed {len(entries)} catalog entries from prompt {self.name} version {source.version} "
+                    f"({self.full_prompt_tokens} prompt tokens)")
+
+    def refresh(self):
+        """Rebuild the index if the registry has a newer version of the prompt."""
+        source = self.prompts.get(self.name)
+        if source is not self._prompt:
+            with self._lock:
+                if source is not self._prompt:
+                    self._load(source)
+
+    def build_context(self, query, k=8):
+        """
+        Find the top-k entries for query. Returns (base_prompt, context, stats):
+        base_prompt is the static instruction block, the same string on every
+        call so it stays a cacheable prefix, and context lists the entries.
+        """
+        self.refresh()
+        index, base_prompt = self.index, self.base_prompt
+        results = index.search(query, k)
+        if results:
+            entries = "\n".join(f"- {entry}" for _, entry in results)
+        else:
+            entries = "- (no catalog entries matched this question)"
+        context = f"RELEVANT CATALOG ENTRIES:\n{entries}"
+
+        prompt_tokens = count_tokens(base_prompt, self.model) + count_tokens(context, self.model)
+        stats = {
+            "entries": len(results),
+            "catalog_entries": len(index.entries),
+            "system_prompt_tokens": prompt_tokens,
+            "tokens_saved": max(self.full_prompt_tokens - prompt_tokens, 0),
+        }
+        return base_prompt, context, stats
@@ -0,0 +1,28 @@
+#serve
+"""
+Production entry point: runs main:app under gunicorn with gunicorn.conf.py.
+
+    python serve.py [gunicorn options]
+
+The master loads the app once and forks WEB_CONCURRENCY workers from it; see
+gunicorn.conf.py for the worker settings, graceful reloads and the startup
+timings it logs. Options given on the command line override the config file,
+e.g. python serve.py --workers 4. python main.py still runs the single-process
+development server.
+"""
+import os
+import sys
+
+from gunicorn.app.wsgiapp import run
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def main():
+    sys.argv = [sys.argv[0], '--config', os.path.join(APP_DIR, 'gunicorn.conf.py'), '--chdir', APP_DIR,
+                *sys.argv[1:], 'main:app']
+    run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,346 @@
+#similar_answers
+"""
+Reuse of resource finder answers for questions that are worded differently
+but ask for the same thing ("Where can I find shelters in Altadena tonight?"
+and "where can i find shelter in altadena tonight").
+
+Each question is reduced to a set of shingles (its words, minus stopwords,
+and the character trigrams of each word, so plurals and typos still
+overlap) and to a MinHash signature of SIMILAR_ANSWERS_PERMUTATIONS hashes.
+The signatures are indexed with LSH: split into bands, and only questions
+sharing at least one band are compared. A stored question whose estimated
+Jaccard similarity is at least SIMILAR_ANSWERS_THRESHOLD is a candidate.
+Everything runs locally in a couple of milliseconds; no embedding service is
+needed.
+
+The similarity is lexical: rewordings, reorderings and filler words match,
+synonyms ("shelter" and "place to sleep") do not. It also cannot see the
+words that change the answer: "Are pets allowed at the Pasadena shelter?"
+and the same question with "not" are 0.89 similar, and two questions that
+differ only in a place name can be 0.75. So a candidate is only a match if
+the two questions also agree word for word on their negations, numbers and
+place names (PLACE_NAMES, plus any capitalized word past the start of a
+sentence), and only then is its answer returned without retrieval or an
+upstream call.
+
+Entries are tagged with the version of resource_finder_prompt.json they
+were answered from. When the prompt registry loads a new version, every
+entry from another version is dropped. The index keeps at most
+SIMILAR_ANSWERS_SIZE entries, each for at most SIMILAR_ANSWERS_TTL seconds;
+the least recently used are evicted first from memory, the oldest from the
+SQLite file.
+
+Configure with SIMILAR_ANSWERS=memory|sqlite|off. With sqlite the entries
+are stored in SIMILAR_ANSWERS_PATH, so they survive restarts and are shared
+by every worker on the host: each worker keeps its own in-memory LSH index
+and picks up the other workers' new entries every
+SIMILAR_ANSWERS_REFRESH_SECONDS.
+"""
+import os
+import re
+import time
+import array
+import random
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from completion_cache import normalize_message
+from retrieval import tokenize
+from metrics import SIMILAR_ANSWERS_TOTAL
+
+logger = logging.getLogger(__name__)
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+# Fixed seed: signatures stored by one process must match those of the next
+PERMUTATION_SEED = 1729
+BAND_ROWS = 4
+
+WORD_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+CAPITALIZED_RE = re.compile(r"(?<![\w'])[A-Z][A-Za-z0-9]*")
+SENTENCE_START_RE = re.compile(r"(?:^|[.?!:;]\s*)$")
+DIGIT_GROUP_RE = re.compile(r"(?<=\d),(?=\d{3})")
+NEGATIONS = frozenset("""
+no not never none nobody nothing nowhere neither nor without cannot cant dont doesnt didnt
+isnt arent wasnt werent wont wouldnt shouldnt couldnt havent hasnt hadnt aint
+""".split())
+# Communities of the Los Angeles fires the catalog covers, matched however they are typed
+PLACE_NAMES = frozenset("""
+altadena pasadena topanga malibu palisades brentwood encino sylmar calabasas agoura
+monica santa sierra madre eaton hurst arcadia monrovia glendale burbank
+duarte azusa tujunga sunland montrose crescenta canada flintridge hollywood
+westwood venice mandeville lancaster palmdale acton castaic valencia clarita
+""".split())
+
+
+def shingles(text):
+    """Words (minus stopwords) and the character trigrams of each word."""
+    words = tokenize(text)
+    result = {f"w:{word}" for word in words}
+    for word in words:
+        padded = f" {word} "
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+class MinHasher:
+    """MinHash signatures from num_perm universal hash permutations."""
+
+    def __init__(self, num_perm=128, seed=PERMUTATION_SEED):
+        rng = random.Random(seed)
+        self.permutations = [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(MERSENNE_PRIME))
+                             for _ in range(num_perm)]
+
+    def signature(self, text):
+        """The signature of text as an array of 32-bit ints, or None if it has no shingles."""
+        hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little")
+                  for s in shingles(text)]
+        if not hashes:
+            return None
+        return array.array("I", (
+            min((a * h + b) % MERSENNE_PRIME for h in hashes) & MAX_HASH
+            for a, b in self.permutations
+        ))
+
+
+def _words(text):
+    return WORD_RE.findall(DIGIT_GROUP_RE.sub("", text.lower().replace("\u2019", "'")))
+
+
+def _negation(word):
+    word = word.replace("'", "")
+    if word not in NEGATIONS:
+        return None
+    # don't, cannot, isn't... are all "not"
+    return "not" if word == "cannot" or word.endswith("nt") else word
+
+
+def key_terms(text):
+    """
+    (negations, numbers, anchors) of text: the words a reworded question
+    must keep for the answer to still apply. "n't" counts as "not"; anchors
+    are place names and capitalized words that do not start a sentence.
+    """
+    words = _words(text)
+    negations = {_negation(word) for word in words} - {None}
+    numbers = {word for word in words if any(ch.isdigit() for ch in word)}
+    anchors = {word for word in words if word in PLACE_NAMES}
+    text = text.replace("\u2019", "'")
+    anchors.update(match.group().lower() for match in CAPITALIZED_RE.finditer(text)
+                   if match.group() != "I" and not SENTENCE_START_RE.search(text[:match.start()]))
+    return negations, numbers, anchors
+
+
+def terms_agree(question, other):
+    """True if question and other have the same negations and numbers and each other's anchors."""
+    negations, numbers, anchors = key_terms(question)
+    other_negations, other_numbers, other_anchors = key_terms(other)
+    return (negations == other_negations and numbers == other_numbers
+            and anchors <= set(_words(other)) and other_anchors <= set(_words(question)))
+
+
+def similarity(signature, other):
+    """Estimated Jaccard similarity: the share of equal signature positions."""
+    return sum(1 for x, y in zip(signature, other) if x == y) / len(signature)
+
+
+class Entry:
+    __slots__ = ("question", "answer", "signature", "created")
+
+    def __init__(self, question, answer, signature, created):
+        self.question = question
+        self.answer = answer
+        self.signature = signature
+        self.created = created
+
+
+class SimilarAnswerIndex:
+    """LSH index of answered questions for one prompt version, optionally backed by SQLite."""
+
+    def __init__(self, threshold=0.9, max_entries=2000, ttl=21600, num_perm=128,
+                 path=None, refresh_seconds=30, route='resource_finder'):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self.route = route
+        self.hasher = MinHasher(num_perm)
+        self.bands = num_perm // BAND_ROWS
+        self.version = None
+        self._entries = OrderedDict()  # normalized question -> Entry, least recently used first
+        self._buckets = {}             # (band, band hashes) -> set of normalized questions
+        self._last_row = 0
+        self._refreshed = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pid = os.getpid()
+        if path:
+            with self._connect() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS similar_answers ("
+                    "row INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT UNIQUE NOT NULL, "
+                    "version TEXT NOT NULL, question TEXT NOT NULL, answer TEXT NOT NULL, "
+                    "signature BLOB NOT NULL, created REAL NOT NULL)"
+                )
+
+    def _connect(self):
+        if self._pid != os.getpid():
+            # Never reuse a connection opened before fork (a preloaded app)
+            self._local = threading.local()
+            self._pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _band_keys(self, signature):
+        return [(band, tuple(signature[band * BAND_ROWS:(band + 1) * BAND_ROWS])) for band in range(self.bands)]
+
+    def _put(self, key, entry):
+        self._drop(key)
+        self._entries[key] = entry
+        for band_key in self._band_keys(entry.signature):
+            self._buckets.setdefault(band_key, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for band_key in self._band_keys(entry.signature):
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def _sync(self, version):
+        """Switch to version, dropping other versions' entries, and load entries added by other workers."""
+        if version != self.version:
+            if self.version is not None:
+                self.invalidations += 1
+                logger.info(f"Resource finder prompt is now version {version}, "
+                            f"dropping {len(self._entries)} similar answers")
+            self.version = version
+            self._entries.clear()
+            self._buckets.clear()
+            self._last_row = 0
+            self._refreshed = None
+            if self.path:
+                self._connect().execute("DELETE FROM similar_answers WHERE version != ?", (version,))
+        if not self.path or (self._refreshed is not None and time.monotonic() - self._refreshed < self.refresh_seconds):
+            return
+        self._refreshed = time.monotonic()
+        rows = self._connect().execute(
+            "SELECT row, key, question, answer, signature, created FROM similar_answers "
+            "WHERE version = ? AND row > ? AND created > ? ORDER BY row",
+            (version, self._last_row, time.time() - self.ttl)
+        ).fetchall()
+        for row, key, question, answer, signature, created in rows[-self.max_entries:]:
+            self._put(key, Entry(question, answer, array.array("I", signature), created))
+        if rows:
+            self._last_row = rows[-1][0]
+
+    def lookup(self, question, version):
+        """
+        Return (question, answer, similarity) for the most similar stored
+        question of version at or above the threshold, or None.
+        """
+        signature = self.hasher.signature(question)
+        now = time.time()
+        best = None
+        try:
+            with self._lock:
+                self._sync(version)
+                if signature is not None:
+                    candidates = set()
+                    for band_key in self._band_keys(signature):
+                        candidates.update(self._buckets.get(band_key, ()))
+                    for key in candidates:
+                        entry = self._entries[key]
+                        if entry.created + self.ttl < now:
+                            self._drop(key)
+                            continue
+                        score = similarity(signature, entry.signature)
+                        if score >= self.threshold and (best is None or score > best[2]) \
+                                and terms_agree(question, entry.question):
+                            best = (key, entry, score)
+                if best is not None:
+                    self._entries.move_to_end(best[0])
+        except sqlite3.Error as e:
+            logger.error(f"Similar answers read error: {str(e)}")
+            best = None
+
+        if best is None:
+            self.misses += 1
+            SIMILAR_ANSWERS_TOTAL.inc(route=self.route, outcome='miss')
+            return None
+        self.hits += 1
+        SIMILAR_ANSWERS_TOTAL.inc(route=self.route, outcome='hit')
+        _, entry, score = best
+        return entry.question, entry.answer, round(score, 3)
+
+    def add(self, question, answer, version):
+        """Store the answer to question, as answered from the prompt version."""
+        signature = self.hasher.signature(question)
+        if signature is None or not answer:
+            return
+        key = normalize_message(question)
+        entry = Entry(question, answer, signature, time.time())
+        try:
+            with self._lock:
+                self._sync(version)
+                self._put(key, entry)
+                if self.path:
+                    conn = self._connect()
+                    conn.execute(
+                        "INSERT OR REPLACE INTO similar_answers (key, version, question, answer, signature, created) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (key, version, question, answer, signature.tobytes(), entry.created)
+                    )
+                    conn.execute(
+                        "DELETE FROM similar_answers WHERE row IN ("
+                        "SELECT row FROM similar_answers ORDER BY row DESC LIMIT -1 OFFSET ?)",
+                        (self.max_entries,)
+                    )
+        except sqlite3.Error as e:
+            logger.error(f"Similar answers write error: {str(e)}")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": "sqlite" if self.path else "memory",
+            "version": self.version,
+            "entries": len(self._entries),
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+
+def similar_answers_from_env():
+    """Build the SimilarAnswerIndex configured by the SIMILAR_ANSWERS_* environment variables, or None if off."""
+    kind = os.getenv('SIMILAR_ANSWERS', 'memory').lower()
+    if kind not in ('memory', 'sqlite'):
+        return None
+    return SimilarAnswerIndex(
+        threshold=float(os.getenv('SIMILAR_ANSWERS_THRESHOLD', '0.9')),
+        max_entries=int(os.getenv('SIMILAR_ANSWERS_SIZE', '2000')),
+        ttl=int(os.getenv('SIMILAR_ANSWERS_TTL', '21600')),
+        num_perm=int(os.getenv('SIMILAR_ANSWERS_PERMUTATIONS', '128')),
+        path=os.getenv('SIMILAR_ANSWERS_PATH', './similar_answers.sqlite3') if kind == 'sqlite' else None,
+        refresh_seconds=float(os.getenv('SIMILAR_ANSWERS_REFRESH_SECONDS', '30')),
+    )
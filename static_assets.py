@@ -0,0 +1,156 @@
+#static_assets
+"""
+Build step and serving for the files in static/.
+
+    python static_assets.py
+
+This writes a content-hashed copy of every static file to static/dist/, for
+example logo.png becomes dist/logo.3f9a1c2b7d.png. Next to each
+compressible file it writes a .gz copy, and a .br copy when the brotli
+package is installed. It also writes static/dist/manifest.json, which maps
+the original names to the hashed ones. Run it at build time; the .replit
+deployment does. Nothing is compressed at request time.
+
+While the manifest exists, url_for('static', filename='logo.png') links to
+the hashed copy. That copy never changes under its name, so it is served
+with a one-year "immutable" Cache-Control. It is also served pre-compressed
+when the browser accepts br or gzip. Files without a hashed copy, or every
+file when the build has not run, are served as before and revalidated with
+ETag / Last-Modified.
+"""
+import os
+import sys
+import json
+import gzip
+import shutil
+import hashlib
+import logging
+import mimetypes
+
+from flask import request, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# Already compressed formats gain nothing from gzip or brotli
+COMPRESSED_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.webp', '.avif', '.ico', '.woff', '.woff2',
+                         '.gz', '.br', '.zip', '.pdf', '.mp4', '.webm'}
+# Only keep a compressed copy that saves at least this share of the bytes
+MIN_SAVING = 0.05
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def hashed_name(filename, data):
+    """filename with the first 10 hex digits of the SHA-256 of data before its extension."""
+    base, ext = os.path.splitext(filename)
+    return f"{base}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+
+
+def _compressed(data):
+    """(encoding suffix, bytes) pairs worth writing next to a file with contents data."""
+    variants = [('.gz', gzip.compress(data, 9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data, quality=11)))
+    return [(suffix, body) for suffix, body in variants if len(body) <= len(data) * (1 - MIN_SAVING)]
+
+
+def build(static_dir):
+    """Write static_dir/dist with hashed, pre-compressed copies and the manifest; returns the manifest."""
+    dist_dir = os.path.join(static_dir, DIST_DIR)
+    shutil.rmtree(dist_dir, ignore_errors=True)
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        if os.path.abspath(root) == os.path.abspath(static_dir) and DIST_DIR in dirs:
+            dirs.remove(DIST_DIR)
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            filename = os.path.relpath(path, static_dir).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                data = f.read()
+            target = f"{DIST_DIR}/{hashed_name(filename, data)}"
+            target_path = os.path.join(static_dir, target)
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            with open(target_path, 'wb') as f:
+                f.write(data)
+
+            encodings = []
+            if os.path.splitext(name)[1].lower() not in COMPRESSED_EXTENSIONS:
+                for suffix, body in _compressed(data):
+                    with open(target_path + suffix, 'wb') as f:
+                        f.write(body)
+                    encodings.append(suffix)
+            manifest[filename] = {"path": target, "encodings": encodings}
+
+    os.makedirs(dist_dir, exist_ok=True)
+    with open(os.path.join(dist_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+class StaticAssets:
+    """Links to and serves the hashed, pre-compressed copies listed in the build manifest."""
+
+    def __init__(self, app):
+        self.static_folder = app.static_folder
+        self.manifest = self._load_manifest()
+        # hashed path -> pre-compressed suffixes available for it
+        self.encodings = {entry["path"]: entry["encodings"] for entry in self.manifest.values()}
+        app.url_defaults(self.hashed_url)
+        app.view_functions['static'] = self.send
+
+    def _load_manifest(self):
+        path = os.path.join(self.static_folder, DIST_DIR, MANIFEST_NAME)
+        try:
+            with open(path, 'r') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            logger.info("No static asset manifest; run python static_assets.py to hash and compress static/")
+            return {}
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not load static asset manifest {path}: {str(e)}")
+            return {}
+        return manifest
+
+    def hashed_url(self, endpoint, values):
+        if endpoint == 'static':
+            entry = self.manifest.get(values.get('filename'))
+            if entry is not None:
+                values['filename'] = entry["path"]
+
+    def send(self, filename):
+        """The static view: hashed files are immutable and sent pre-compressed when accepted."""
+        encodings = self.encodings.get(filename)
+        if encodings is None:
+            # Not a hashed copy: revalidated with ETag / Last-Modified
+            return send_from_directory(self.static_folder, filename)
+
+        response = None
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        for encoding, suffix in ENCODINGS:
+            if suffix in encodings and request.accept_encodings[encoding] > 0:
+                response = send_from_directory(self.static_folder, filename + suffix, mimetype=mimetype,
+                                               max_age=IMMUTABLE_MAX_AGE)
+                response.headers['Content-Encoding'] = encoding
+                break
+        if response is None:
+            response = send_from_directory(self.static_folder, filename, max_age=IMMUTABLE_MAX_AGE)
+        if encodings:
+            response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    static_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    manifest = build(static_dir)
+    for filename, entry in sorted(manifest.items()):
+        logger.info(f"{filename} -> {entry['path']} {' '.join(entry['encodings'])}".rstrip())
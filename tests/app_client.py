@@ -0,0 +1,49 @@
+#app_client
+"""
+Shared setup for tests that drive main.py end to end against the fake OpenAI
+server in benchmarks/fake_openai.py.
+
+Importing this module starts the fake server on a free port, points the
+OpenAI clients at it and imports the app with caches kept in memory. Tests
+change FAKE_OPENAI's latency through its handler class, and should use an
+API key of their own so their results do not share cache or coalescing keys.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import fake_openai  # noqa: E402
+
+FAKE_OPENAI = fake_openai.start_in_thread(latency=0.05, tokens_per_second=0, answer_tokens=20)
+os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{FAKE_OPENAI.server_address[1]}/v1"
+for name, value in (("PDF_TEXT_CACHE", "memory"), ("COMPLETION_CACHE", "memory"),
+                    ("CONVERSATION_STORE", "memory"), ("JOB_STORE", "memory"),
+                    ("SIMILAR_ANSWERS", "memory"), ("COALESCE", "local")):
+    os.environ.setdefault(name, value)
+
+import main  # noqa: E402
+
+main.app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+
+
+def set_latency(seconds):
+    """Seconds the fake server waits before its first token."""
+    FAKE_OPENAI.RequestHandlerClass.latency = seconds
+
+
+def fail_models(*models):
+    """Make the fake server answer 503 for models (none to stop)."""
+    FAKE_OPENAI.RequestHandlerClass.failing_models = frozenset(models)
+
+
+def upstream_requests(model):
+    """Chat completion requests the fake server has received for model."""
+    return FAKE_OPENAI.RequestHandlerClass.requests.get(model, 0)
+
+
+def ask(client, path, api_key, **form):
+    """POST a chat form to path, asking for a JSON answer; returns the response."""
+    return client.post(path, data={"openai_key": api_key, **form}, headers={"Accept": "application/json"})
@@ -0,0 +1,107 @@
+import os
+import sys
+import time
+import threading
+import unittest
+
+from openai import OpenAI
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import fake_openai  # noqa: E402
+from admission import AdaptiveLimit, AdmissionController, Overloaded  # noqa: E402
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+class AdaptiveLimitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.limit = AdaptiveLimit(16, latency_target=10, latency_floor=0.25)
+
+    def a_second_later(self):
+        self.limit._last_decrease -= 1
+
+    def test_rate_limit_halves_once_per_second(self):
+        self.limit.on_rate_limited()
+        self.limit.on_rate_limited()
+        self.assertEqual(self.limit.limit, 8)
+        self.a_second_later()
+        self.limit.on_rate_limited()
+        self.assertEqual(self.limit.limit, 4)
+
+    def test_fast_calls_grow_the_limit_back(self):
+        self.limit.on_rate_limited()
+        for _ in range(8):
+            self.limit.on_success(1.0)
+        self.assertGreater(self.limit.limit, 8.9)
+        for _ in range(1000):
+            self.limit.on_success(1.0)
+        self.assertEqual(self.limit.limit, 16)
+
+    def test_slow_calls_shrink_the_limit_down_to_the_floor_only(self):
+        for _ in range(100):
+            self.limit.on_success(30.0)
+            self.a_second_later()
+        self.assertEqual(self.limit.limit, 4)
+        self.limit.on_rate_limited()
+        self.assertEqual(self.limit.limit, 2)
+
+
+class AdmissionControllerTest(unittest.TestCase):
+
+    def test_request_over_the_key_limit_waits_for_a_permit(self):
+        controller = AdmissionController(global_limit=8, key_limit=1, max_wait=2)
+        first = controller.acquire("sk-a")
+        threading.Timer(0.2, first.release).start()
+        second = controller.acquire("sk-a")
+        self.assertEqual(controller.stats()["in_flight"], 1)
+        second.release()
+
+    def test_other_keys_are_not_held_up(self):
+        controller = AdmissionController(global_limit=8, key_limit=1, max_wait=0.1)
+        held = controller.acquire("sk-a")
+        controller.acquire("sk-b").release()
+        held.release()
+
+    def test_request_is_shed_when_the_queue_is_full(self):
+        controller = AdmissionController(global_limit=1, key_limit=1, queue_size=0)
+        held = controller.acquire("sk-a")
+        with self.assertRaises(Overloaded) as raised:
+            controller.acquire("sk-a")
+        self.assertGreaterEqual(raised.exception.retry_after, 1)
+        held.release()
+
+    def test_request_times_out_waiting(self):
+        controller = AdmissionController(global_limit=1, key_limit=1, max_wait=0.2)
+        controller.hold_seconds = 0.01
+        held = controller.acquire("sk-a")
+        with self.assertRaises(Overloaded):
+            controller.acquire("sk-a")
+        held.release()
+
+
+class RateLimitRetryTest(unittest.TestCase):
+
+    def test_429_is_retried_and_halves_the_limits(self):
+        server = fake_openai.start_in_thread(latency=0.5, tokens_per_second=0, answer_tokens=5, max_concurrent=1)
+        self.addCleanup(server.shutdown)
+        client = OpenAI(api_key="sk-admission", base_url=f"http://127.0.0.1:{server.server_address[1]}/v1",
+                        max_retries=0)
+        controller = AdmissionController(global_limit=16, key_limit=16)
+
+        busy = threading.Thread(target=client.chat.completions.create, kwargs={"model": "m", "messages": MESSAGES})
+        busy.start()
+        self.addCleanup(busy.join)
+        time.sleep(0.1)  # let it take the only upstream slot
+        with controller.acquire("sk-admission") as permit:
+            response = permit.call(lambda: client.chat.completions.create(model="m", messages=MESSAGES))
+        self.assertEqual(response.choices[0].finish_reason, "stop")
+        self.assertGreaterEqual(server.RequestHandlerClass.requests["m"], 3)
+        self.assertLess(controller.stats()["global_limit"], 16)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import json
+import unittest
+
+from app_client import main
+
+
+class BatchValidationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = main.app.test_client()
+
+    def post(self, payload):
+        return self.client.post("/batch", json=payload)
+
+    def test_non_string_document_file_is_rejected(self):
+        response = self.post({"openai_key": "sk-batch", "items": [{
+            "tool": "rejection_simulation", "user_message": "x", "documents": [{"file": ["a"]}]}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("must be strings", response.get_json()["error"])
+
+    def test_non_string_base64_content_is_rejected(self):
+        response = self.post({"openai_key": "sk-batch", "items": [{
+            "tool": "rejection_simulation", "user_message": "x",
+            "documents": [{"filename": "a.pdf", "content_base64": 5}]}]})
+        self.assertEqual(response.status_code, 400)
+
+    def test_non_string_key_is_rejected(self):
+        response = self.post({"openai_key": 5, "items": [{"tool": "resource_finder", "user_message": "x"}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()["error"], "openai_key must be a string.")
+
+    def test_missing_key_is_rejected(self):
+        response = self.post({"items": [{"tool": "resource_finder", "user_message": "x"}]})
+        self.assertEqual(response.status_code, 400)
+
+    def test_items_are_answered(self):
+        response = self.post({"openai_key": "sk-batch", "items": [
+            {"id": "a", "tool": "resource_finder", "user_message": "food banks in Malibu"},
+            {"id": "b", "tool": "toxicity_assessment", "user_message": "smoke in my house"}]})
+        self.assertEqual(response.status_code, 200)
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual({line["id"]: line["status"] for line in lines[:-1]}, {"a": "ok", "b": "ok"})
+        self.assertEqual(lines[-1]["errors"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
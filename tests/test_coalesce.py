@@ -0,0 +1,71 @@
+import os
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from app_client import ask, main, set_latency, upstream_requests
+from coalesce import SharedFlights, SingleFlight
+
+
+class RouteCoalescingTest(unittest.TestCase):
+
+    def setUp(self):
+        set_latency(0.5)
+
+    def tearDown(self):
+        set_latency(0.05)
+
+    def ask_together(self, question, api_keys):
+        def post(api_key):
+            return ask(main.app.test_client(), "/recovery-capital", api_key, user_message=question)
+
+        with ThreadPoolExecutor(len(api_keys)) as executor:
+            return list(executor.map(post, api_keys))
+
+    def test_identical_concurrent_requests_make_one_upstream_call(self):
+        calls = upstream_requests("gpt-4")
+        responses = self.ask_together("Which grants cover a burned rental unit?", ["sk-coalesce"] * 2)
+        self.assertEqual(upstream_requests("gpt-4"), calls + 1)
+        bodies = [response.get_json() for response in responses]
+        self.assertEqual(bodies[0]["answer"], bodies[1]["answer"])
+        self.assertEqual(sorted(body["coalesced"] for body in bodies), [False, True])
+
+    def test_requests_with_different_keys_are_not_coalesced(self):
+        calls = upstream_requests("gpt-4")
+        responses = self.ask_together("Which grants cover a burned barn?", ["sk-coalesce-a", "sk-coalesce-b"])
+        self.assertEqual(upstream_requests("gpt-4"), calls + 2)
+        self.assertFalse(any(response.get_json()["coalesced"] for response in responses))
+
+
+class SharedFlightTest(unittest.TestCase):
+    """Two SingleFlights on one SQLite file, standing in for two server workers."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, "coalesce.sqlite3")
+        self.workers = [SingleFlight(["chat"], SharedFlights(path, stale_seconds=0.6)) for _ in range(2)]
+        self.calls = 0
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def produce(self, flight):
+        self.calls += 1
+        # A first token slower than stale_seconds: the heartbeat keeps the flight alive
+        self.release.wait(2)
+        for token in ("one ", "two"):
+            flight.add(token)
+
+    def test_workers_share_one_call_despite_a_slow_first_token(self):
+        first, _ = self.workers[0].join("chat", "key", "sk-shared", self.produce)
+        second, _ = self.workers[1].join("chat", "key", "sk-shared", self.produce)
+        threading.Timer(1.5, self.release.set).start()
+        self.assertEqual(first.wait(), "one two")
+        self.assertEqual(second.wait(), "one two")
+        self.assertEqual(self.calls, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
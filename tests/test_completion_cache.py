@@ -0,0 +1,39 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from completion_cache import SQLiteCache  # noqa: E402
+
+
+class SQLiteCacheSweepTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = SQLiteCache(os.path.join(self.directory.name, "cache.sqlite3"), ttl=3600)
+
+    def tearDown(self):
+        self.cache._connect().close()
+        self.directory.cleanup()
+
+    def test_expired_rows_are_deleted_without_being_read(self):
+        self.cache.ttl = -1
+        self.cache.set("abandoned", {"messages": ["my address"]})
+        self.cache.ttl = 3600
+        self.cache._next_sweep = 0
+        self.cache.set("fresh", "kept")
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.get("fresh"), "kept")
+
+    def test_expired_rows_are_deleted_on_open(self):
+        self.cache.ttl = -1
+        self.cache.set("abandoned", "left behind")
+        reopened = SQLiteCache(self.cache.path, ttl=3600)
+        self.assertEqual(len(reopened), 0)
+        reopened._connect().close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import sys
+import json
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from completion_cache import MemoryCache, SQLiteCache  # noqa: E402
+from conversations import ConversationStore  # noqa: E402
+
+ROUTE = "toxicity_assessment"
+
+
+class InterleavedCache(MemoryCache):
+    """Runs before_replace once, just before the next replace, like another worker saving first."""
+
+    before_replace = None
+
+    def replace(self, key, expected, value):
+        before_replace, self.before_replace = self.before_replace, None
+        if before_replace:
+            before_replace()
+        return super().replace(key, expected, value)
+
+
+class ConversationStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = InterleavedCache()
+        self.store = ConversationStore(self.backend, summarize=lambda api_key, summary, messages: "summary",
+                                       threshold=10 ** 6)
+
+    def started(self):
+        conversation = self.store.new(ROUTE)
+        self.store.record_turn(conversation, "hello", "hi", "sk-test")
+        return self.store.load(ROUTE, conversation.id)
+
+    def contents(self, conversation_id):
+        return [m["content"] for m in self.store.load(ROUTE, conversation_id).messages]
+
+    def test_conflicting_save_is_retried_on_the_stored_copy(self):
+        conversation = self.started()
+        other_copy = self.store.load(ROUTE, conversation.id)
+        self.backend.before_replace = lambda: self.store.record_turn(other_copy, "second", "answer 2", "sk-test")
+        self.store.record_turn(conversation, "third", "answer 3", "sk-test")
+        self.assertEqual(self.contents(conversation.id), ["hello", "hi", "second", "answer 2", "third", "answer 3"])
+        self.assertEqual(self.store.load(ROUTE, conversation.id).revision, 3)
+
+    def test_turn_saved_during_a_roll_up_is_kept(self):
+        self.store.keep_recent = 2
+        conversation = self.started()
+        self.store.record_turn(conversation, "second", "answer 2", "sk-test")
+        self.backend.before_replace = lambda: self.store.record_turn(
+            self.store.load(ROUTE, conversation.id), "third", "answer 3", "sk-test")
+        self.store._roll_up(ROUTE, conversation.id, "sk-test")
+
+        stored = self.store.load(ROUTE, conversation.id)
+        self.assertEqual(stored.summary, "summary")
+        self.assertEqual(self.contents(conversation.id), ["second", "answer 2", "third", "answer 3"])
+
+    def test_roll_up_loses_to_one_saved_first(self):
+        self.store.keep_recent = 2
+        conversation = self.started()
+        self.store.record_turn(conversation, "second", "answer 2", "sk-test")
+
+        def other_roll_up():
+            stored = self.store.load(ROUTE, conversation.id)
+            stored.summary = "other summary"
+            stored.revision += 1
+            self.backend.set(f"conversation:{conversation.id}", json.dumps(stored.to_dict()))
+
+        self.backend.before_replace = other_roll_up
+        self.store._roll_up(ROUTE, conversation.id, "sk-test")
+        self.assertEqual(self.store.load(ROUTE, conversation.id).summary, "other summary")
+
+
+class SQLiteConcurrentTurnsTest(unittest.TestCase):
+
+    def test_concurrent_turns_are_all_kept(self):
+        with tempfile.TemporaryDirectory() as directory:
+            backend = SQLiteCache(os.path.join(directory, "conversations.sqlite3"), table="conversations")
+            store = ConversationStore(backend, threshold=10 ** 6)
+            conversation = store.new(ROUTE)
+            store.record_turn(conversation, "hello", "hi", "sk-test")
+            loaded = store.load(ROUTE, conversation.id)
+
+            with ThreadPoolExecutor(8) as executor:
+                list(executor.map(lambda i: store.record_turn(loaded, f"q{i}", f"a{i}", "sk-test"), range(8)))
+
+            messages = store.load(ROUTE, conversation.id).messages
+            self.assertEqual(len(messages), 18)
+            self.assertEqual([m["seq"] for m in messages], list(range(18)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import os
+import sys
+import sqlite3
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from completion_cache import MemoryCache  # noqa: E402
+from jobs import JobQueue  # noqa: E402
+
+
+class LockedStore(MemoryCache):
+    """A store whose writes fail while locked is set, like a busy SQLite file."""
+
+    locked = True
+
+    def set(self, key, value):
+        if self.locked:
+            raise sqlite3.OperationalError("database is locked")
+        super().set(key, value)
+
+
+class JobQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = LockedStore()
+        self.queue = JobQueue(self.store, max_workers=1, max_pending=2)
+
+    def tearDown(self):
+        self.queue.shutdown()
+
+    def test_failed_save_frees_its_slot(self):
+        for _ in range(3):
+            with self.assertRaises(sqlite3.OperationalError):
+                self.queue.submit("test", lambda job: "ok")
+        self.assertEqual(self.queue.pending, 0)
+
+        self.store.locked = False
+        job_id = self.queue.submit("test", lambda job: "ok")
+        self.queue.shutdown()
+        self.assertEqual(self.queue.get(job_id)["result"], "ok")
+        self.assertEqual(self.queue.pending, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+import os
+import sys
+import queue
+import logging
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logging_setup import DroppingQueueHandler  # noqa: E402
+from metrics import LOG_RECORDS_DROPPED  # noqa: E402
+
+
+class DroppingQueueHandlerTest(unittest.TestCase):
+
+    def test_dropped_records_are_counted_in_metrics(self):
+        before = LOG_RECORDS_DROPPED.snapshot().get("WARNING", 0)
+        handler = DroppingQueueHandler(queue.Queue(1))
+        logger = logging.getLogger("test_logging_setup")
+        logger.propagate = False
+        logger.addHandler(handler)
+        try:
+            for _ in range(3):
+                logger.warning("busy")
+        finally:
+            logger.removeHandler(handler)
+        self.assertEqual(handler.dropped, 2)
+        self.assertEqual(LOG_RECORDS_DROPPED.snapshot().get("WARNING", 0), before + 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
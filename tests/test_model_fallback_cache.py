@@ -0,0 +1,51 @@
+import unittest
+
+from app_client import ask, fail_models, main, upstream_requests
+
+
+class FallbackAnswerCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        main.MODEL_ROUTER._stats.clear()
+        self.client = main.app.test_client()
+
+    def tearDown(self):
+        fail_models()
+        main.MODEL_ROUTER._stats.clear()
+
+    def assert_fallback_answer_not_served_for_primary(self, question, **form):
+        fail_models("gpt-4")
+        first = ask(self.client, "/toxicity-assessment", "sk-fallback", user_message=question, **form)
+        self.assertEqual(first.status_code, 200)
+        self.assertNotIn('"error"', first.get_data(as_text=True))
+        fail_models()
+
+        primary_calls = upstream_requests("gpt-4")
+        second = ask(self.client, "/toxicity-assessment", "sk-fallback", user_message=question, **form)
+        self.assertEqual(second.status_code, 200)
+        self.assertNotIn('"cached": true', second.get_data(as_text=True))
+        self.assertEqual(upstream_requests("gpt-4"), primary_calls + 1)
+
+    def test_json_answer(self):
+        self.assert_fallback_answer_not_served_for_primary("Is ash from my burned garage toxic?")
+
+    def test_streamed_answer(self):
+        self.assert_fallback_answer_not_served_for_primary("Is ash from my burned shed toxic?", stream="1")
+
+    def test_uncoalesced_answer(self):
+        routes = main.COALESCER.routes
+        main.COALESCER.routes = set()
+        try:
+            self.assert_fallback_answer_not_served_for_primary("Is ash from my burned carport toxic?")
+        finally:
+            main.COALESCER.routes = routes
+
+    def test_primary_answer_is_cached(self):
+        question = "Is ash from my burned fence toxic?"
+        ask(self.client, "/toxicity-assessment", "sk-fallback", user_message=question)
+        second = ask(self.client, "/toxicity-assessment", "sk-fallback", user_message=question)
+        self.assertTrue(second.get_json()["cached"])
+
+
+if __name__ == "__main__":
+    unittest.main()
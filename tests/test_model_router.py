@@ -0,0 +1,86 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+from openai import OpenAI
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import fake_openai  # noqa: E402
+import model_router  # noqa: E402
+from model_router import ModelRouter  # noqa: E402
+
+POLICIES = {"chat": {"rules": [{"model": "big"}], "fallbacks": ["small"], "max_latency": 5}}
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+class ModelRouterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.router = ModelRouter(POLICIES)
+
+    def degrade(self, model, **outcome):
+        for _ in range(model_router.MODEL_MIN_SAMPLES):
+            self.router.record("chat", model, **outcome)
+
+    def choose_after_probe(self):
+        # The first choice after a model degrades is its probe
+        self.router.choose("chat", MESSAGES)
+        return self.router.choose("chat", MESSAGES)
+
+    def test_call_falls_back_on_overloaded_model(self):
+        server = fake_openai.start_in_thread(latency=0, tokens_per_second=0, answer_tokens=5, failing_models=["big"])
+        self.addCleanup(server.shutdown)
+        client = OpenAI(api_key="sk-router", base_url=f"http://127.0.0.1:{server.server_address[1]}/v1",
+                        max_retries=0)
+
+        model, response, _ = self.router.call("chat", {"model": "big", "messages": MESSAGES},
+                                              lambda args: client.chat.completions.create(**args))
+        self.assertEqual((model, response.model), ("small", "small"))
+        self.assertEqual(server.RequestHandlerClass.requests, {"big": 1, "small": 1})
+        self.assertEqual(self.router.stats()["chat"]["big"]["errors"], 1)
+
+    def test_other_errors_do_not_fall_back(self):
+        def create(args):
+            raise ValueError("bad request")
+
+        with self.assertRaises(ValueError):
+            self.router.call("chat", {"model": "big", "messages": MESSAGES}, create)
+
+    def test_slow_first_token_degrades_model(self):
+        self.degrade("big", seconds=6, ttft=6, completion_tokens=10)
+        self.assertEqual(self.choose_after_probe(), "small")
+
+    def test_long_stream_with_fast_first_token_is_not_degraded(self):
+        self.degrade("big", seconds=60, ttft=0.5, completion_tokens=1200)
+        self.assertEqual(self.choose_after_probe(), "big")
+
+    def test_long_complete_answer_is_not_degraded(self):
+        # 60s for 1,150 tokens is 2.5s before the first token at 0.05s per token
+        self.degrade("big", seconds=60, completion_tokens=1150)
+        self.assertEqual(self.choose_after_probe(), "big")
+
+    def test_errors_degrade_model(self):
+        self.degrade("big", error=True)
+        self.assertEqual(self.choose_after_probe(), "small")
+
+    def test_degraded_model_is_probed_again(self):
+        self.degrade("big", error=True)
+        with mock.patch("model_router.time.monotonic", return_value=0.0):
+            self.assertEqual(self.router.choose("chat", MESSAGES), "big")  # the probe
+            self.assertEqual(self.router.choose("chat", MESSAGES), "small")
+        with mock.patch("model_router.time.monotonic", return_value=model_router.MODEL_PROBE_SECONDS):
+            self.assertEqual(self.router.choose("chat", MESSAGES), "big")
+
+    def test_recovered_model_is_used_again(self):
+        self.degrade("big", error=True)
+        for _ in range(10):
+            self.router.record("chat", "big", seconds=1, ttft=0.2, completion_tokens=10)
+        self.assertEqual(self.choose_after_probe(), "big")
+
+
+if __name__ == "__main__":
+    unittest.main()
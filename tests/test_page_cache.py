@@ -0,0 +1,67 @@
+import unittest
+
+from app_client import main
+
+
+class CachedPageCsrfTest(unittest.TestCase):
+
+    def setUp(self):
+        main.app.config["WTF_CSRF_ENABLED"] = True
+        self.first = main.app.test_client()
+        self.second = main.app.test_client()
+
+    def tearDown(self):
+        main.app.config["WTF_CSRF_ENABLED"] = False
+
+    def page_token(self, client):
+        response = client.get("/resource-finder")
+        self.assertEqual(response.status_code, 200)
+        token = client.get_cookie("csrf_token").value
+        self.assertNotIn(token, response.get_data(as_text=True))
+        return token
+
+    def assert_csrf_rejected(self, response):
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(b"CSRF", response.get_data())
+
+    def post(self, client, token=None):
+        data = {"user_message": "Where can I get a free meal in Altadena?", "openai_key": "sk-page-cache"}
+        if token is not None:
+            data["csrf_token"] = token
+        return client.post("/resource-finder", data=data, headers={"Accept": "application/json"})
+
+    def test_cached_page_is_shared_but_its_token_is_not(self):
+        first_token = self.page_token(self.first)
+        second_token = self.page_token(self.second)
+        self.assertNotEqual(first_token, second_token)
+        self.assertEqual(self.first.get("/resource-finder").get_data(),
+                         self.second.get("/resource-finder").get_data())
+
+    def test_post_without_token_is_rejected(self):
+        self.page_token(self.first)
+        self.assert_csrf_rejected(self.post(self.first))
+
+    def test_post_with_another_visitors_token_is_rejected(self):
+        self.page_token(self.first)
+        other_token = self.page_token(self.second)
+        self.assert_csrf_rejected(self.post(self.first, other_token))
+
+    def test_post_with_garbled_token_is_rejected(self):
+        token = self.page_token(self.first)
+        self.assert_csrf_rejected(self.post(self.first, token[:-4] + "abcd"))
+
+    def test_post_with_own_cookie_token_is_accepted(self):
+        token = self.page_token(self.first)
+        response = self.post(self.first, token)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("answer", response.get_json())
+
+    def test_not_modified_page_still_refreshes_the_token_cookie(self):
+        etag = self.first.get("/resource-finder").headers["ETag"]
+        response = self.first.get("/resource-finder", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertIn("csrf_token=", response.headers.get("Set-Cookie", ""))
+
+
+if __name__ == "__main__":
+    unittest.main()
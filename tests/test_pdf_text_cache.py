@@ -0,0 +1,60 @@
+import os
+import sys
+import time
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pdf_text_cache import PdfTextCache  # noqa: E402
+
+DIGEST = "ab" * 32
+RECORD = {"text": "Your FEMA application was denied", "pages": 1}
+
+
+class PdfTextCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = PdfTextCache(self.directory.name, memory_entries=0, ttl=60)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def files(self):
+        return [name for _, _, names in os.walk(self.directory.name) for name in names]
+
+    def age(self, seconds):
+        then = time.time() - seconds
+        os.utime(self.cache._path(DIGEST), (then, then))
+
+    def test_entry_unused_past_ttl_is_deleted_on_read(self):
+        self.cache.set(DIGEST, RECORD)
+        self.assertEqual(self.cache.get(DIGEST), RECORD)
+        self.age(120)
+        self.assertIsNone(self.cache.get(DIGEST))
+        self.assertEqual(self.files(), [])
+
+    def test_expired_entries_are_deleted_by_the_scan(self):
+        self.cache.set(DIGEST, RECORD)
+        self.age(120)
+        PdfTextCache(self.directory.name, memory_entries=0, ttl=60)
+        self.assertEqual(self.files(), [])
+
+    def test_memory_tier_expires(self):
+        cache = PdfTextCache(memory_entries=4, ttl=60)
+        cache.set(DIGEST, RECORD)
+        self.assertEqual(cache.get(DIGEST), RECORD)
+        with mock.patch("pdf_text_cache.time.time", return_value=time.time() + 120):
+            self.assertIsNone(cache.get(DIGEST))
+
+    def test_failed_write_leaves_no_temp_file(self):
+        with mock.patch("pdf_text_cache.os.replace", side_effect=OSError("disk full")):
+            self.cache.set(DIGEST, RECORD)
+        self.assertEqual(self.files(), [])
+        self.assertIsNone(self.cache.get(DIGEST))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+
+from app_client import ask, main
+
+
+class SimilarAnswerPrivacyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.first = main.app.test_client()
+        self.second = main.app.test_client()
+
+    def test_reused_answer_does_not_reveal_the_other_question(self):
+        question = "My family of four lost our home at 1234 Lake Ave in Altadena, where can we stay?"
+        first = ask(self.first, "/resource-finder", "sk-similar-a", user_message=question)
+        self.assertEqual(first.status_code, 200)
+
+        second = ask(self.second, "/resource-finder", "sk-similar-b", user_message=question.lower() + " ?")
+        self.assertEqual(second.status_code, 200)
+        body = second.get_json()
+        self.assertTrue(body["cached"])
+        self.assertIn("similarity", body)
+        self.assertEqual(body["answer"], first.get_json()["answer"])
+        self.assertNotIn("similar_question", body)
+        self.assertNotIn("1234 Lake Ave", second.get_data(as_text=True))
+
+    def test_streamed_reuse_does_not_reveal_the_other_question(self):
+        question = "We are a household of two renters from Pacific Palisades, is there rental assistance?"
+        ask(self.first, "/resource-finder", "sk-similar-a", user_message=question)
+
+        second = self.second.post("/resource-finder", data={"openai_key": "sk-similar-b", "stream": "1",
+                                                            "user_message": question.lower()})
+        text = second.get_data(as_text=True)
+        self.assertIn('"cached": true', text)
+        self.assertNotIn("similar_question", text)
+        self.assertNotIn("Pacific Palisades", text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from similar_answers import SimilarAnswerIndex, key_terms, terms_agree  # noqa: E402
+
+VERSION = "v1"
+
+
+class SimilarAnswerIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = SimilarAnswerIndex()
+
+    def lookup_after(self, question, other):
+        self.index.add(question, f"answer to: {question}", VERSION)
+        return self.index.lookup(other, VERSION)
+
+    def test_rewording_reuses_answer(self):
+        match = self.lookup_after("Where can I find shelters in Altadena tonight?",
+                                  "where can i find shelter in altadena tonight")
+        self.assertIsNotNone(match)
+        self.assertEqual(match[0], "Where can I find shelters in Altadena tonight?")
+
+    def test_negation_is_not_reused(self):
+        self.assertIsNone(self.lookup_after("Are pets allowed at the Pasadena shelter?",
+                                            "Are pets not allowed at the Pasadena shelter?"))
+
+    def test_contracted_negation_is_not_reused(self):
+        self.assertIsNone(self.lookup_after("Does the Altadena shelter take walk-ins?",
+                                            "Doesn’t the Altadena shelter take walk-ins?"))
+
+    def test_other_place_is_not_reused(self):
+        self.assertIsNone(self.lookup_after("Which shelters accept pets in Altadena",
+                                            "Which shelters accept pets in Pasadena"))
+
+    def test_lowercase_place_still_matches_place(self):
+        self.assertIsNotNone(self.lookup_after("free meals for families in Topanga",
+                                               "Free meals for families in topanga"))
+        self.assertIsNone(self.lookup_after("free meals for families in Malibu",
+                                            "free meals for families in malibu and topanga"))
+
+    def test_other_number_is_not_reused(self):
+        self.assertIsNone(self.lookup_after("Is there a $1,000 grant for renters in Altadena?",
+                                            "Is there a $10,000 grant for renters in Altadena?"))
+
+
+class KeyTermsTest(unittest.TestCase):
+
+    def test_negations_are_normalized(self):
+        self.assertEqual(key_terms("I don't have insurance")[0], {"not"})
+        self.assertEqual(key_terms("I cannot pay rent")[0], {"not"})
+        self.assertEqual(key_terms("I have no insurance")[0], {"no"})
+
+    def test_negation_and_place_must_agree(self):
+        self.assertFalse(terms_agree("Are pets allowed at the Pasadena shelter?",
+                                     "Are pets not allowed at the Pasadena shelter?"))
+        self.assertFalse(terms_agree("shelters in Altadena", "shelters in Pasadena"))
+        self.assertTrue(terms_agree("Shelters in Altadena?", "altadena shelters"))
+
+    def test_numbers_ignore_digit_grouping(self):
+        self.assertEqual(key_terms("Need $1,000 for 3 kids")[1], {"1000", "3"})
+
+    def test_capitalized_words_past_sentence_start_are_anchors(self):
+        self.assertEqual(key_terms("Where is the FEMA office? Is it open")[2], {"fema"})
+        self.assertTrue(terms_agree("Where is the FEMA office", "where is the fema office"))
+        self.assertFalse(terms_agree("Where is the FEMA office", "where is the SBA office"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import io
+import unittest
+
+from app_client import main
+from sample_pdfs import make_sample_pdf
+from uploads import UploadGuard, UploadRejected
+
+BOUNDARY = "----supplydroptest"
+
+
+class CountingStream(io.BytesIO):
+    """A request body that records how far the app read into it."""
+
+    @property
+    def read_bytes(self):
+        return self.tell()
+
+
+def multipart(filename, content):
+    head = (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"user_message\"\r\n\r\nMy claim was denied\r\n"
+            f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"documents\"; filename=\"{filename}\"\r\n"
+            "Content-Type: application/pdf\r\n\r\n").encode("ascii")
+    return head + content + f"\r\n--{BOUNDARY}--\r\n".encode("ascii")
+
+
+class UploadStreamTest(unittest.TestCase):
+
+    def post(self, filename, content):
+        body = multipart(filename, content)
+        stream = CountingStream(body)
+        response = main.app.test_client().post(
+            "/rejection-simulation", input_stream=stream,
+            content_length=len(body), content_type=f"multipart/form-data; boundary={BOUNDARY}")
+        return response, stream.read_bytes, len(body)
+
+    def test_oversize_file_is_rejected_before_the_body_is_read(self):
+        content = make_sample_pdf(1) + b"0" * (12 * 1024 * 1024)
+        response, read, total = self.post("big.pdf", content)
+        self.assertEqual(response.status_code, 413)
+        self.assertIn("larger than", response.get_json()["error"])
+        self.assertLess(read, 11 * 1024 * 1024)
+        self.assertLess(read, total)
+
+    def test_non_pdf_is_rejected_from_its_first_bytes(self):
+        response, read, total = self.post("letter.pdf", b"MZ" + b"\0" * (4 * 1024 * 1024))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("is not a PDF", response.get_json()["error"])
+        self.assertLess(read, 1024 * 1024)
+
+    def test_wrong_extension_is_rejected_before_its_data(self):
+        response, read, _ = self.post("letter.exe", b"%PDF-" + b"\0" * (4 * 1024 * 1024))
+        self.assertEqual(response.status_code, 400)
+        self.assertLess(read, 1024 * 1024)
+
+
+class UploadGuardTest(unittest.TestCase):
+
+    def test_page_limit_is_enforced_while_streaming(self):
+        guard = UploadGuard("test", max_pages=2)
+        stream = guard.open("long.pdf")
+        with self.assertRaises(UploadRejected) as raised:
+            for start in range(0, 10000, 512):
+                stream.write(make_sample_pdf(5)[start:start + 512])
+        self.assertEqual(raised.exception.reason, "pages")
+
+    def test_file_count_is_limited(self):
+        guard = UploadGuard("test", max_files=1)
+        guard.open("a.pdf")
+        with self.assertRaises(UploadRejected) as raised:
+            guard.open("b.pdf")
+        self.assertEqual(raised.exception.reason, "too_many_files")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+#tokens
+"""
+Local token counting for prompt budgeting.
+
+Uses tiktoken when it is installed and its encoding files can be loaded;
+otherwise falls back to the usual ~4 characters per token estimate, which is
+close enough for accounting.
+
+Large static texts (the system prompts) can be tokenized once with
+pretokenize(); later counts of the same text are a dictionary lookup.
+"""
+import logging
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+_encodings = {}
+
+# (encoding name, text) -> token count, for texts passed to pretokenize()
+_known_counts = {}
+
+
+def _get_encoding(model):
+    if tiktoken is None:
+        return None
+    if model not in _encodings:
+        try:
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            # tiktoken downloads encoding files on first use, which fails offline
+            logger.warning(f"Could not load tiktoken encoding for {model}, estimating tokens: {str(e)}")
+            _encodings[model] = None
+    return _encodings[model]
+
+
+def count_tokens(text, model="gpt-4o"):
+    """Count the tokens in text for the given model."""
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    if _known_counts:
+        known = _known_counts.get((encoding.name, text))
+        if known is not None:
+            return known
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def pretokenize(text, models=("gpt-4o",)):
+    """Count text's tokens for each model now and remember them; returns {model: tokens}."""
+    counts = {}
+    for model in models:
+        counts[model] = count_tokens(text, model)
+        encoding = _get_encoding(model)
+        if encoding is not None:
+            _known_counts[(encoding.name, text)] = counts[model]
+    return counts
+
+
+def forget_pretokenized(text):
+    """Drop the remembered counts for text, e.g. when a prompt is replaced."""
+    for key in [key for key in list(_known_counts) if key[1] == text]:
+        _known_counts.pop(key, None)
+
+
+def count_message_tokens(messages, model="gpt-4o"):
+    """Count the tokens in a chat messages list, including per-message overhead."""
+    return sum(count_tokens(m.get("content", ""), model) + 4 for m in messages) + 2
@@ -1,10 +1,10 @@
 #treehouse
 import os
-import json
-from collections import defaultdict
-from pathlib import Path
-import importlib.util
 import re
+import json
+import time
+import argparse
+import tempfile
 
 IGNORE_PATTERNS = [
     r'\.pyc$',
@@ -28,60 +28,120 @@ IGNORE_PATTERNS = [
     r'\.local',
 ]
 
+# One pass of the regex engine per path instead of one per pattern
+IGNORE_RE = re.compile("|".join(f"(?:{pattern})" for pattern in IGNORE_PATTERNS))
+
 IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.svg', '.ico', '.webp'}
 RELEVANT_EXTENSIONS = {'.py', '.html', '.js', '.json', '.css', '.md'}
 
-
-def count_files_by_type(directory):
-    """Count files by extension in a directory."""
-    counts = defaultdict(int)
-    for root, _, files in os.walk(directory):
-        for file in files:
-            ext = os.path.splitext(file)[1].lower()
-            counts[ext] += 1
-    return counts
+# mtime snapshot of the directories seen by the last scan (under .cache, which is ignored)
+SNAPSHOT_PATH = os.path.join('.cache', 'treehouse.json')
 
 
 def should_ignore(path):
     """Check if path should be ignored based on patterns."""
-    return any(re.search(pattern, str(path)) for pattern in IGNORE_PATTERNS)
-
+    return IGNORE_RE.search(str(path)) is not None
+
+
+class TreeScanner:
+    """
+    Scans a directory tree in a single os.scandir pass, aggregating image
+    counts bottom-up. Directories whose mtime matches the snapshot from the
+    previous scan reuse their cached listing instead of being listed again.
+    """
+
+    def __init__(self, snapshot=None):
+        self.snapshot = snapshot or {}
+        self.new_snapshot = {}
+        self.scanned = 0
+        self.reused = 0
+
+    def _entries(self, path):
+        """Sorted [name, kind] pairs in path; kind is 'f' (file), 'd' (directory) or 'l' (not descended)."""
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return []
+        cached = self.snapshot.get(path)
+        if cached is not None and cached["mtime"] == mtime:
+            self.reused += 1
+            entries = cached["entries"]
+        else:
+            self.scanned += 1
+            entries = []
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_file():
+                                kind = 'f'
+                            elif entry.is_dir(follow_symlinks=False):
+                                kind = 'd'
+                            else:
+                                # Symlinked directories are listed but not followed, to avoid cycles
+                                kind = 'l'
+                        except OSError:
+                            kind = 'l'
+                        entries.append([entry.name, kind])
+            except OSError:
+                pass
+            entries.sort()
+        self.new_snapshot[path] = {"mtime": mtime, "entries": entries}
+        return entries
+
+    def scan(self, path, indent=''):
+        """Return (tree lines, image files) for the directory at path."""
+        lines = []
+        images = 0
+        for name, kind in self._entries(path):
+            child = os.path.join(path, name)
+            if IGNORE_RE.search(child):
+                continue
+            ext = os.path.splitext(name)[1].lower()
+            if kind == 'f':
+                if ext in RELEVANT_EXTENSIONS:
+                    lines.append(f"{indent}├── {name}")
+                if ext in IMAGE_EXTENSIONS:
+                    images += 1
+                continue
+
+            subtree, subtree_images = self.scan(child, indent + "│   ") if kind == 'd' else ([], 0)
+            images += subtree_images
+            lines.append(f"{indent}├── {name}/")
+            if subtree_images > 0:
+                lines.append(f"{indent}│   └── [{subtree_images} image files]")
+            lines.extend(subtree)
+        return lines, images
+
+
+def load_snapshot(root, path=SNAPSHOT_PATH):
+    """The directory snapshot saved by the last scan of root, or {} if missing or stale."""
+    try:
+        with open(os.path.join(root, path), 'r') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get("root") != root or data.get("ignore") != IGNORE_RE.pattern:
+        return {}
+    return data.get("directories", {})
 
-def generate_tree(start_path, indent=''):
-    """Generate a tree structure of the codebase."""
-    tree_content = []
-    start_path = Path(start_path)
 
+def save_snapshot(root, snapshot, path=SNAPSHOT_PATH):
+    path = os.path.join(root, path)
     try:
-        items = sorted(start_path.iterdir())
-    except PermissionError:
-        return []
-
-    for item in items:
-        if should_ignore(item):
-            continue
-
-        if item.is_file():
-            ext = item.suffix.lower()
-            if ext in RELEVANT_EXTENSIONS:
-                tree_content.append(f"{indent}├── {item.name}")
-        else:
-            # For directories
-            image_counts = count_files_by_type(item)
-            image_files = sum(count for ext, count in image_counts.items()
-                              if ext.lower() in IMAGE_EXTENSIONS)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({"root": root, "ignore": IGNORE_RE.pattern, "directories": snapshot}, f)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"Could not save the scan snapshot: {str(e)}")
 
-            tree_content.append(f"{indent}├── {item.name}/")
-            if image_files > 0:
-                tree_content.append(
-                    f"{indent}│   └── [{image_files} image files]")
 
-            # Recursively process subdirectories
-            subtree = generate_tree(item, indent + "│   ")
-            if subtree:
-                tree_content.extend(subtree)
-
-    return tree_content
+def generate_tree(start_path, indent='', scanner=None):
+    """Generate a tree structure of the codebase."""
+    scanner = scanner or TreeScanner()
+    return scanner.scan(os.path.abspath(start_path), indent)[0]
 
 
 def extract_models_relationships():
@@ -165,12 +225,17 @@ def get_pyproject_content():
     return pyproject_content
 
 
-def main():
+def main(incremental=True):
     """Generate the complete tree.md file."""
     current_dir = os.path.dirname(os.path.abspath(__file__))
 
     # Generate content sections
-    tree_content = generate_tree(current_dir)
+    started = time.perf_counter()
+    scanner = TreeScanner(load_snapshot(current_dir) if incremental else None)
+    tree_content = generate_tree(current_dir, scanner=scanner)
+    save_snapshot(current_dir, scanner.new_snapshot)
+    print(f"Scanned {scanner.scanned} directories, reused {scanner.reused} unchanged "
+          f"in {time.perf_counter() - started:.3f}s")
     models_content = extract_models_relationships()
     config_content = extract_config_map()
     pyproject_content = get_pyproject_content()
@@ -188,4 +253,7 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Generate tree.md")
+    parser.add_argument("--full", action="store_true", help="ignore the snapshot and list every directory again")
+    args = parser.parse_args()
+    main(incremental=not args.full)
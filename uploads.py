@@ -0,0 +1,130 @@
+#uploads
+"""
+Streaming validation of uploaded PDFs while the multipart body is parsed.
+
+Werkzeug asks the request class for a stream per uploaded file and writes
+the file into it chunk by chunk. UploadGuard hands out streams that check
+each file as it arrives and raise UploadRejected as soon as a limit is
+broken, which stops reading the rest of the body:
+
+- the number of files (UPLOAD_MAX_FILES, per endpoint)
+- the extension, before any of the file's data is read
+- the %PDF- magic bytes, from the first chunk
+- the size of each file (UPLOAD_MAX_FILE_MB)
+- the page count (UPLOAD_MAX_PAGES), from the page objects seen so far
+
+Page objects inside compressed object streams are not visible while
+streaming, so PdfExtractor checks the real page count again before
+extracting. Files are kept in memory, so the upload memory of a request is
+bounded by the file count times the per-file size and is reported in
+stats().
+"""
+import io
+import os
+import re
+
+from metrics import UPLOAD_BYTES, UPLOAD_REJECTIONS
+
+UPLOAD_MAX_FILES = int(os.getenv('UPLOAD_MAX_FILES', '5'))
+UPLOAD_MAX_FILE_BYTES = int(float(os.getenv('UPLOAD_MAX_FILE_MB', '10')) * 1024 * 1024)
+UPLOAD_MAX_PAGES = int(os.getenv('UPLOAD_MAX_PAGES', '300'))
+
+PDF_MAGIC = b"%PDF-"
+# The header may be preceded by junk; readers accept it within the first 1024 bytes
+PDF_HEADER_WINDOW = 1024
+PAGE_OBJECT_RE = re.compile(rb"/Type\s{0,4}/Page\b")
+PAGE_SCAN_OVERLAP = 32
+
+
+class UploadRejected(Exception):
+    """An upload broke a limit; message is safe to show to the user."""
+
+    def __init__(self, message, reason, status=400):
+        super().__init__(message)
+        self.reason = reason
+        self.status = status
+
+
+class UploadGuard:
+    """Limits and accounting for the uploaded files of one request."""
+
+    def __init__(self, route, max_files=UPLOAD_MAX_FILES, max_file_bytes=UPLOAD_MAX_FILE_BYTES,
+                 max_pages=UPLOAD_MAX_PAGES, extensions=('pdf',)):
+        self.route = route
+        self.max_files = max_files
+        self.max_file_bytes = max_file_bytes
+        self.max_pages = max_pages
+        self.extensions = extensions
+        self.files = 0
+        self.buffered_bytes = 0
+
+    def open(self, filename):
+        """The stream Werkzeug writes the uploaded file named filename into."""
+        if not filename:
+            # An empty file input; the routes skip these
+            return io.BytesIO()
+        self.files += 1
+        if self.files > self.max_files:
+            self.reject(f"Maximum {self.max_files} files allowed.", 'too_many_files')
+        if '.' not in filename or filename.rsplit('.', 1)[1].lower() not in self.extensions:
+            self.reject(f"Invalid file type: {filename}. Only PDF files are allowed.", 'extension')
+        return PdfUploadStream(self, filename)
+
+    def reject(self, message, reason, status=400):
+        UPLOAD_REJECTIONS.inc(route=self.route, reason=reason)
+        raise UploadRejected(message, reason, status)
+
+    def stats(self):
+        return {
+            "files": self.files,
+            "buffered_bytes": self.buffered_bytes,
+            "max_buffered_bytes": self.max_files * self.max_file_bytes,
+        }
+
+    def finish(self):
+        """Record this request's upload size once it is done."""
+        if self.files:
+            UPLOAD_BYTES.observe(self.buffered_bytes, route=self.route)
+
+
+class PdfUploadStream(io.BytesIO):
+    """In-memory upload buffer that validates the PDF as it is written."""
+
+    def __init__(self, guard, filename):
+        super().__init__()
+        self.guard = guard
+        self.filename = filename
+        self.pages = 0
+        self._header_checked = False
+        self._head = b""
+        self._tail = b""
+
+    def write(self, data):
+        size = self.tell() + len(data)
+        if size > self.guard.max_file_bytes:
+            self.guard.reject(f"{self.filename} is larger than the "
+                              f"{self.guard.max_file_bytes // (1024 * 1024)} MB limit.", 'file_size', 413)
+        if not self._header_checked:
+            self._head = (self._head + data)[:PDF_HEADER_WINDOW]
+            if PDF_MAGIC in self._head:
+                self._header_checked = True
+            elif len(self._head) >= PDF_HEADER_WINDOW:
+                self.guard.reject(f"{self.filename} is not a PDF file.", 'not_pdf')
+        self._count_pages(data)
+        self.guard.buffered_bytes += len(data)
+        return super().write(data)
+
+    def _count_pages(self, data):
+        window = self._tail + data
+        # Count a match once: only if it ends in the new data
+        self.pages += sum(1 for match in PAGE_OBJECT_RE.finditer(window) if match.end() > len(self._tail))
+        self._tail = window[-PAGE_SCAN_OVERLAP:]
+        if self.pages > self.guard.max_pages:
+            self.guard.reject(f"{self.filename} has more than {self.guard.max_pages} pages. "
+                              f"Please upload a shorter document.", 'pages', 413)
+
+    def seek(self, *args):
+        # Werkzeug rewinds the stream once the file is complete; a file too short to hold the header ends here
+        if not self._header_checked:
+            self.guard.reject(f"{self.filename} is not a PDF file.", 'not_pdf')
+        return super().seek(*args)